@@ -14,6 +14,9 @@ setup(
     author_email = 'jeff@jeffkistler.com',
     url = 'https://bitbucket.org/jeffkistler/django-backlinks',
     packages = ['backlinks',
+                'backlinks.management',
+                'backlinks.management.commands',
+                'backlinks.migrations',
                 'backlinks.templatetags',
                 'backlinks.tests',
                 'backlinks.utils',
@@ -22,7 +25,7 @@ setup(
                 'backlinks.trackback',
                 'backlinks.trackback.templatetags'],
     package_dir = {'': 'src'},
-    package_data = {'backlinks': ['fixtures/*',],
+    package_data = {'backlinks': ['fixtures/*', 'sql/*'],
                     'backlinks.trackback': ['templates/backlinks/trackback/*']},
     classifiers = [
         'Development Status :: 3 - Alpha',
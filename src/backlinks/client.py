@@ -1,15 +1,82 @@
+import os
 import sys
+import socket
+import inspect
+import httplib
+import datetime
 from urllib2 import URLError, HTTPError
 from urlparse import urljoin
 
 from django.core.urlresolvers import get_mod_func
+from django.contrib.contenttypes.models import ContentType
 
 from backlinks.conf import settings
 from backlinks.utils import parse_external_links, url_reader, \
-    get_site_absolute_uri, parse_title, parse_excerpt
+    get_site_absolute_uri, get_url_host, canonicalize_url, ParsedDocument, \
+    LimitedAsyncURLReader
+from backlinks.utils.workers import WorkerPool
+from backlinks.utils.cache import get_default_discovery_cache
+from backlinks.utils.ratelimit import get_default_rate_limiter
 from backlinks.models import OutboundBacklink
+from backlinks.fields import canonical_url_hash
 from backlinks.exceptions import BacklinkClientError
 
+# HTTP error codes with which fetching a linked resource may succeed later
+TEMPORARY_ERROR_CODES = (408, 429)
+
+
+class DiscoveryFailure(object):
+    """
+    The result of autodiscovery for a linked resource which could not be
+    fetched for a temporary reason, such as a connection error, a timeout
+    or a server error. It is false, like the ``None`` result for a resource
+    which advertises no backlink server, so callers which only want the
+    servers found may treat both alike.
+
+    """
+    def __init__(self, error):
+        self.error = error
+
+    def __nonzero__(self):
+        return False
+
+    def get_message(self):
+        return 'Could not fetch the linked resource: %s' % (self.error,)
+
+
+def is_temporary_fetch_error(error):
+    """
+    Return whether fetching a resource which failed with the given error
+    may succeed if retried later.
+
+    """
+    if isinstance(error, HTTPError):
+        return error.code >= 500 or error.code in TEMPORARY_ERROR_CODES
+    return True
+
+
+def opener_supports_method(url_opener):
+    """
+    Return whether ``url_opener`` can make requests with another HTTP method,
+    such as HEAD, passed as a ``method`` keyword argument. An opener may
+    declare this with a ``supports_method`` attribute; otherwise it is
+    decided from the opener's signature.
+
+    """
+    supports_method = getattr(url_opener, 'supports_method', None)
+    if supports_method is not None:
+        return bool(supports_method)
+    func = url_opener
+    if not (inspect.isfunction(func) or inspect.ismethod(func)):
+        func = getattr(func, '__call__', None)
+    func = getattr(func, 'im_func', func)
+    try:
+        args, varargs, varkw, defaults = inspect.getargspec(func)
+    except TypeError:
+        # Builtins and other callables which cannot be introspected
+        return False
+    return 'method' in args or varkw is not None
+
 
 class BacklinksClient(object):
     """
@@ -17,10 +84,19 @@ class BacklinksClient(object):
 
     """
     url_opener = url_reader.open
+    required_client_methods = ('autodiscover',)
+    # Whether discovery tries a HEAD request first, or None to follow the
+    # DISCOVERY_HEAD_REQUEST setting. Ignored if ``url_opener`` does not
+    # accept a ``method`` argument.
+    head_request = None
 
-    def __init__(self, clients=None, url_opener=None):
+    def __init__(self, clients=None, url_opener=None, discovery_cache=None,
+                 rate_limiter=None):
         self._clients = clients
         self.url_opener = url_opener or self.url_opener
+        self.opener_supports_head = opener_supports_method(self.url_opener)
+        self._discovery_cache = discovery_cache
+        self._rate_limiter = rate_limiter
 
     def _get_clients(self):
         """
@@ -30,7 +106,7 @@ class BacklinksClient(object):
         """
         if not self._clients:
             self._clients = []
-            for name, display, client_name in settings.INSTALLED_MODULES:
+            for name, display, client_name in self.get_installed_modules():
                 try:
                     module_name, obj = get_mod_func(client_name)
                     mod = __import__(module_name)
@@ -38,12 +114,203 @@ class BacklinksClient(object):
                     client = getattr(client_module, obj)
                 except (ImportError, AttributeError):
                     continue
-                if hasattr(client, 'autodiscover'):
+                for method_name in self.required_client_methods:
+                    if not hasattr(client, method_name):
+                        break
+                else:
                     self._clients.append((name, display, client))
         return self._clients
     clients = property(_get_clients)
 
-    def discover_backlinks(self, markup):
+    def get_installed_modules(self):
+        """
+        Return the (protocol-name, display-name, client-import-path) tuples
+        for the installed backlinks modules.
+
+        """
+        return settings.INSTALLED_MODULES
+
+    def _get_discovery_cache(self):
+        """
+        Return the ``DiscoveryCache`` holding autodiscovery results, which
+        is shared by all clients unless one was given.
+
+        """
+        if self._discovery_cache is None:
+            self._discovery_cache = get_default_discovery_cache()
+        return self._discovery_cache
+    discovery_cache = property(_get_discovery_cache)
+
+    def _get_rate_limiter(self):
+        """
+        Return the ``HostRateLimiter`` spacing out requests to each host,
+        which is shared by all clients unless one was given.
+
+        """
+        if self._rate_limiter is None:
+            self._rate_limiter = get_default_rate_limiter()
+        return self._rate_limiter
+    rate_limiter = property(_get_rate_limiter)
+
+    def get_cached_backlink(self, link):
+        """
+        Return a cached (resource-url, ping-url, client-object, protocol-name)
+        tuple for the link, ``None`` if the link is known not to be
+        pingable, or ``False`` if nothing usable is cached.
+
+        """
+        cached = self.discovery_cache.get(link)
+        if cached is None:
+            return False
+        if cached == self.discovery_cache.NO_ENDPOINT:
+            return None
+        resource_url, ping_url, protocol = cached
+        for name, display, client in self.clients:
+            if name == protocol:
+                return (resource_url, ping_url, client, name)
+        return False
+
+    def cache_backlink(self, link, backlink):
+        """
+        Store the autodiscovery result for the link in the discovery cache.
+
+        """
+        if backlink:
+            resource_url, ping_url, client, name = backlink
+            self.discovery_cache.set(link, resource_url, ping_url, name)
+        else:
+            self.discovery_cache.set_no_endpoint(link)
+
+    def autodiscover_headers(self, link, response):
+        """
+        Look for a backlink server in the headers of a response for a linked
+        resource, and return a (resource-url, ping-url, client-object,
+        protocol-name) tuple, or ``None`` if the headers name no server.
+
+        """
+        for name, display, client in self.clients:
+            if hasattr(client, 'autodiscover_headers'):
+                ping_url = client.autodiscover_headers(link, response)
+                if ping_url:
+                    return (response.url, ping_url, client, name)
+        return None
+
+    def autodiscover(self, link, response):
+        """
+        Determine the backlink server for a linked resource from a response
+        and return a (resource-url, ping-url, client-object, protocol-name)
+        tuple, or ``None`` if no server was found.
+
+        The response headers are checked first. Only if they name no server
+        is the body read, ``DISCOVERY_CHUNK_SIZE`` bytes at a time, and
+        reading stops as soon as each client, in order of preference, has
+        either found its server URL or given up on finding one.
+
+        """
+        backlink = self.autodiscover_headers(link, response)
+        if backlink:
+            return backlink
+        scanners = []
+        for name, display, client in self.clients:
+            scanner = None
+            if hasattr(client, 'get_markup_scanner'):
+                scanner = client.get_markup_scanner(link)
+            scanners.append((name, client, scanner))
+        max_length = settings.MAX_URL_READ_LENGTH
+        chunk_size = settings.DISCOVERY_CHUNK_SIZE
+        length = 0
+        while True:
+            if max_length:
+                chunk_size = min(chunk_size, max_length - length)
+            chunk = chunk_size > 0 and response.read(chunk_size) or ''
+            length = length + len(chunk)
+            if not chunk:
+                break
+            for name, client, scanner in scanners:
+                if scanner and not scanner.finished:
+                    scanner.feed(chunk)
+            for name, client, scanner in scanners:
+                if scanner is None or not scanner.finished:
+                    # A preferred client needs more of the document
+                    break
+                if scanner.result:
+                    return (response.url, scanner.result, client, name)
+            else:
+                return None
+        # The whole (or maximum length of the) document has been read
+        for name, client, scanner in scanners:
+            if scanner is None:
+                ping_url = client.autodiscover(link, response)
+            else:
+                ping_url = scanner.result
+            if ping_url:
+                return (response.url, ping_url, client, name)
+        return None
+
+    def discover_link(self, link):
+        """
+        Autodiscover a backlink server for a single linked resource and
+        return a (resource-url, ping-url, client-object, protocol-name)
+        tuple, or ``None`` if no server was found. If the resource could not
+        be fetched for a temporary reason, a ``DiscoveryFailure`` is
+        returned instead, and not cached.
+
+        """
+        backlink = self.get_cached_backlink(link)
+        if backlink is not False:
+            return backlink
+        backlink = None
+        head_request = self.head_request
+        if head_request is None:
+            head_request = settings.DISCOVERY_HEAD_REQUEST
+        if head_request and self.opener_supports_head:
+            try:
+                self.rate_limiter.wait(get_url_host(link))
+                response = self.url_opener(link, method='HEAD')
+            except (URLError, HTTPError, IOError):
+                # Some servers refuse HEAD requests, so fall back to GET
+                pass
+            else:
+                try:
+                    backlink = self.autodiscover_headers(link, response)
+                finally:
+                    response.close()
+        if not backlink:
+            try:
+                self.rate_limiter.wait(get_url_host(link))
+                response = self.url_opener(link)
+                try:
+                    backlink = self.autodiscover(link, response)
+                finally:
+                    response.close()
+            except (URLError, HTTPError, IOError, httplib.HTTPException), e:
+                if is_temporary_fetch_error(e):
+                    return DiscoveryFailure(e)
+                # The resource does not exist, or may not be fetched
+                backlink = None
+        self.cache_backlink(link, backlink)
+        return backlink
+
+    def discover_links(self, links, workers=None):
+        """
+        Call ``discover_link`` for each of the given links, returning the
+        results in the same order.
+
+        If ``workers`` (or the ``DISCOVERY_WORKERS`` setting) is greater than
+        one, links are fetched concurrently by that many threads, with at
+        most ``DISCOVERY_WORKERS_PER_HOST`` fetches to any one host at once.
+
+        """
+        # Load the protocol clients before any worker threads need them.
+        self._get_clients()
+        if workers is None:
+            workers = settings.DISCOVERY_WORKERS
+        if workers > 1 and len(links) > 1:
+            pool = WorkerPool(workers, settings.DISCOVERY_WORKERS_PER_HOST)
+            return pool.map(self.discover_link, links, key=get_url_host)
+        return [self.discover_link(link) for link in links]
+
+    def discover_backlinks(self, markup, workers=None):
         """
         Parse out links to all external resource in markup, autodiscover
         backlink servers for these resources, and return a list of
@@ -51,21 +318,53 @@ class BacklinksClient(object):
 
         """
         links = parse_external_links(markup)
-        ping_urls = []
-        for link in links:
-            ping_url = ''
-            try:
-                response = self.url_opener(link)
-            except (URLError, HTTPError):
-                # We ignore non-OK responses or connection errors
-                continue
-            for name, display, client in self.clients:
-                ping_url = client.autodiscover(link, response)
-                if ping_url:
-                    ping_urls.append((response.url, ping_url, client, name))
-                    break
-            response.close()
-        return ping_urls
+        return [result for result in self.discover_links(links, workers) if result]
+
+    def get_ping_record(self, target_url, source_object=None):
+        """
+        Return the existing ``OutboundBacklink`` record for a ping from the
+        given source object to the given target URL, or a new, unsaved one.
+        Records are keyed by the canonical form of the target URL, and hold
+        the target URL as given.
+
+        """
+        lookup = {'target_url_hash': canonical_url_hash(target_url)}
+        if source_object is not None:
+            lookup['content_type'] = ContentType.objects.get_for_model(source_object)
+            lookup['object_id'] = source_object.pk
+        else:
+            lookup['content_type__isnull'] = True
+        try:
+            ping_record = OutboundBacklink.objects.filter(**lookup)[0]
+        except IndexError:
+            ping_record = OutboundBacklink()
+            if source_object is not None:
+                ping_record.source_object = source_object
+        ping_record.target_url = target_url
+        return ping_record
+
+    def get_ping_records(self, target_urls, source_object=None):
+        """
+        Return the ``OutboundBacklink`` records for pings from the given
+        source object to each of the given target URLs, in order, using a
+        single query. Targets with no existing record get a new, unsaved
+        one; a target given twice, or in two equivalent forms, gets the same
+        record twice. Records are keyed by the canonical form of the target
+        URL.
+
+        """
+        existing = OutboundBacklink.objects.for_targets(target_urls, source_object)
+        ping_records = []
+        for target_url in target_urls:
+            key = canonical_url_hash(target_url)
+            ping_record = existing.get(key)
+            if ping_record is None:
+                ping_record = OutboundBacklink(target_url=target_url)
+                if source_object is not None:
+                    ping_record.source_object = source_object
+                existing[key] = ping_record
+            ping_records.append(ping_record)
+        return ping_records
 
     def register_successful_ping(self, target_url, source_url, protocol,
                                  source_object=None, title=None, excerpt=None):
@@ -75,12 +374,10 @@ class BacklinksClient(object):
         model.
 
         """
-        ping_record, created = OutboundBacklink.objects.get_or_create(target_url=target_url,
-                                                                      source_object=source_object)
+        ping_record = self.get_ping_record(target_url, source_object)
         ping_record.status = OutboundBacklink.SUCCESSFUL_STATUS
         ping_record.protocol = protocol
         ping_record.source_url = source_url
-        ping_record.target_url = target_url
         ping_record.title = title or ''
         ping_record.excerpt = excerpt or ''
         ping_record.save()
@@ -94,31 +391,39 @@ class BacklinksClient(object):
         model.
 
         """
-
-        ping_record, created = OutboundBacklink.objects.get_or_create(target_url=target_url,
-                                                                      source_object=source_object)
+        ping_record = self.get_ping_record(target_url, source_object)
         ping_record.status = OutboundBacklink.UNSUCCESSFUL_STATUS
         ping_record.protocol = protocol
         ping_record.source_url = source_url
-        ping_record.target_url = target_url
         ping_record.title = title or ''
         ping_record.excerpt = excerpt or ''
         ping_record.save()
         return ping_record
 
+    def parse_document(self, markup):
+        """
+        Return a ``ParsedDocument`` for the given markup, unless it already
+        is one.
+
+        """
+        if isinstance(markup, ParsedDocument):
+            return markup
+        return ParsedDocument(markup)
+
     def get_title(self, markup):
         """
-        Return a title parsed from the given markup.
+        Return a title parsed from the given markup or ``ParsedDocument``.
 
         """
-        return parse_title(markup)
+        return self.parse_document(markup).title
 
     def get_excerpt(self, markup, target_url):
         """
-        Return a contextual excerpt parsed from the given markup.
+        Return a contextual excerpt parsed from the given markup or
+        ``ParsedDocument``.
 
         """
-        return parse_excerpt(markup, target_url, settings.MAX_EXCERPT_WORDS)
+        return self.parse_document(markup).get_excerpt(target_url, settings.MAX_EXCERPT_WORDS)
 
     def get_url(self, model_instance):
         """
@@ -131,29 +436,283 @@ class BacklinksClient(object):
         except AttributeError:
             raise ValueError('get_url must receive a model instance with a get_absolute_url method defined')
 
-    def ping_all(self, markup, source_url=None, source_object=None, title=None, excerpt=None):
+    def get_pinged_urls(self, source_object, incremental=None):
+        """
+        Return the set of the canonical forms of the target URLs already
+        pinged successfully from the given source object, which should not
+        be pinged again. This is
+        always empty unless in incremental mode (the ``incremental``
+        argument, or the ``INCREMENTAL_PINGS`` setting).
+
+        """
+        if incremental is None:
+            incremental = settings.INCREMENTAL_PINGS
+        if not incremental or source_object is None:
+            return set()
+        pinged = OutboundBacklink.objects.for_model(source_object)\
+            .filter(status=OutboundBacklink.SUCCESSFUL_STATUS)
+        return set([canonicalize_url(target_url)
+                    for target_url in pinged.values_list('target_url', flat=True)])
+
+    def enqueue_pings(self, markup, source_url=None, source_object=None, title=None, excerpt=None,
+                      incremental=None):
+        """
+        Record a pending ping for every external link found in the given
+        markup, to be sent later by ``process_pending_pings``.
+
+        """
+        document = self.parse_document(markup)
+        title = title or self.get_title(document)
+        if not source_url and source_object:
+            source_url = self.get_url(source_object)
+        pinged = self.get_pinged_urls(source_object, incremental)
+        links = [link for link in document.external_links
+                 if canonicalize_url(link) not in pinged]
+        ping_records = self.get_ping_records(links, source_object)
+        for link, ping_record in zip(links, ping_records):
+            # The link as written in the source is what is fetched and pinged
+            ping_record.target_url = link
+            ping_record.status = OutboundBacklink.PENDING_STATUS
+            ping_record.protocol = ''
+            ping_record.message = ''
+            ping_record.source_url = source_url
+            ping_record.title = title or ''
+            ping_record.excerpt = excerpt or self.get_excerpt(document, link) or ''
+            ping_record.sent = datetime.datetime.now()
+            ping_record.claimed_by = ''
+            ping_record.claimed_at = None
+            ping_record.num_attempts = 0
+            ping_record.next_attempt = None
+        OutboundBacklink.objects.bulk_save(ping_records)
+        return ping_records
+
+    def get_worker_id(self):
+        """
+        Return a string identifying this process when claiming pending pings.
+
+        """
+        return '%s:%d' % (socket.gethostname(), os.getpid())
+
+    def process_pending_pings(self, batch_size=None, worker_id=None):
+        """
+        Claim a batch of pending ``OutboundBacklink`` records, and of
+        unsuccessful records due for a retry, autodiscover and ping their
+        targets, and record the outcomes. Returns the number of records
+        processed.
+
+        """
+        ping_records = OutboundBacklink.objects.claim_pending(worker_id or self.get_worker_id(),
+                                                              batch_size or settings.QUEUE_BATCH_SIZE,
+                                                              settings.QUEUE_CLAIM_TIMEOUT)
+        if not ping_records:
+            return 0
+        discovered = self.discover_links([ping_record.target_url for ping_record in ping_records])
+        for ping_record, backlink in zip(ping_records, discovered):
+            self.process_ping_record(ping_record, backlink, commit=False)
+        OutboundBacklink.objects.bulk_save(ping_records)
+        return len(ping_records)
+
+    def process_ping_record(self, ping_record, backlink, commit=True):
+        """
+        Send the ping for an ``OutboundBacklink`` record, given its
+        (resource-url, ping-url, client-object, protocol-name) autodiscovery
+        result, and record the outcome. The record is only saved if
+        ``commit`` is true.
+
+        A ping failing with a temporary ``BacklinkClientError``, or whose
+        target could not be fetched for autodiscovery (a ``DiscoveryFailure``
+        result), is scheduled to be retried, with exponential backoff, by
+        ``process_pending_pings``.
+
+        """
+        ping_record.increment_attempts()
+        ping_record.next_attempt = None
+        if backlink:
+            target_url, ping_url, client, client_name = backlink
+            ping_record.protocol = client_name
+            try:
+                self.rate_limiter.wait(get_url_host(ping_url))
+                client.ping(ping_url, target_url, ping_record.source_url,
+                            title=ping_record.title, excerpt=ping_record.excerpt)
+                ping_record.status = OutboundBacklink.SUCCESSFUL_STATUS
+                ping_record.message = ''
+            except BacklinkClientError, e:
+                ping_record.status = OutboundBacklink.UNSUCCESSFUL_STATUS
+                ping_record.message = (e.reason or e.message)[:1024]
+                if e.temporary:
+                    ping_record.schedule_retry()
+        elif isinstance(backlink, DiscoveryFailure):
+            ping_record.status = OutboundBacklink.UNSUCCESSFUL_STATUS
+            ping_record.message = backlink.get_message()[:1024]
+            ping_record.schedule_retry()
+        else:
+            ping_record.status = OutboundBacklink.UNSUCCESSFUL_STATUS
+            ping_record.message = 'No backlink server found'
+        ping_record.sent = datetime.datetime.now()
+        ping_record.claimed_by = ''
+        ping_record.claimed_at = None
+        if commit:
+            ping_record.save()
+        return ping_record
+
+    def ping_all(self, markup, source_url=None, source_object=None, title=None, excerpt=None,
+                 defer=None, incremental=None):
         """
         Ping all pingable, linked resources found in the given markup.
 
+        If ``defer`` (or the ``QUEUE_PINGS`` setting) is true, the pings
+        are only queued by ``enqueue_pings``, and returned immediately.
+
+        If ``incremental`` (or the ``INCREMENTAL_PINGS`` setting) is true,
+        resources already pinged successfully from ``source_object`` are
+        neither fetched nor pinged again.
+
         """
-        title = title or self.get_title(markup)
+        if defer is None:
+            defer = settings.QUEUE_PINGS
+        if defer:
+            return self.enqueue_pings(markup, source_url, source_object, title, excerpt,
+                                      incremental)
+        document = self.parse_document(markup)
+        title = title or self.get_title(document)
         if not source_url and source_object:
             source_url = self.get_url(source_object)
-        for target_url, ping_url, client, client_name in self.discover_backlinks(markup):
+        pinged = self.get_pinged_urls(source_object, incremental)
+        links = [link for link in document.external_links
+                 if canonicalize_url(link) not in pinged]
+        # A redirected link is recorded under the URL it resolved to
+        discovered = [result for result in self.discover_links(links)
+                      if result and canonicalize_url(result[0]) not in pinged]
+        ping_records = self.get_ping_records([backlink[0] for backlink in discovered],
+                                             source_object)
+        for ping_record, backlink in zip(ping_records, discovered):
+            ping_record.target_url = backlink[0]
+            ping_record.source_url = source_url
+            ping_record.title = title or ''
+            ping_record.excerpt = excerpt or self.get_excerpt(document, backlink[0]) or ''
+            ping_record.num_attempts = 0
+            self.process_ping_record(ping_record, backlink, commit=False)
+        OutboundBacklink.objects.bulk_save(ping_records)
+
+
+class AsyncBacklinksClient(BacklinksClient):
+    """
+    A counterpart to ``BacklinksClient`` which performs autodiscovery and
+    pings on a single thread through an ``AsyncURLReader``.
+
+    ``discover_backlinks`` and ``ping_all`` schedule their requests and
+    return immediately. The requests scheduled by any number of calls are
+    then performed concurrently by ``run``. Unless the reader was given a
+    rate limiter of its own, each request waits on the client's
+    ``rate_limiter`` for a slot to its host before it is started.
+
+    """
+    reader_class = LimitedAsyncURLReader
+    required_client_methods = ('autodiscover', 'ping_async')
+
+    def __init__(self, clients=None, reader=None, discovery_cache=None,
+                 rate_limiter=None):
+        self._clients = clients
+        self._discovery_cache = discovery_cache
+        self._rate_limiter = rate_limiter
+        self.reader = reader or self.reader_class()
+        if self.reader.rate_limiter is None:
+            self.reader.rate_limiter = self.rate_limiter
+
+    def get_installed_modules(self):
+        return settings.INSTALLED_ASYNC_MODULES
+
+    def discover_link(self, link, callback):
+        """
+        Schedule autodiscovery for a single linked resource. ``callback`` is
+        called with a (resource-url, ping-url, client-object, protocol-name)
+        tuple, or ``None`` if no server was found.
+
+        """
+        backlink = self.get_cached_backlink(link)
+        if backlink is not False:
+            return callback(backlink)
+
+        def handle_response(response):
             try:
-                contextual_excerpt = excerpt or self.get_excerpt(markup, target_url)
-                client.ping(ping_url, target_url, source_url,
-                            title=title, excerpt=contextual_excerpt)
-                self.register_successful_ping(target_url,
-                                              source_url,
-                                              client_name,
-                                              source_object=source_object,
-                                              title=title,
-                                              excerpt=contextual_excerpt)
-            except BacklinkClientError:
-                self.register_unsuccessful_ping(target_url,
-                                                source_url,
-                                                client_name,
-                                                source_object=source_object,
-                                                title=title,
-                                                excerpt=contextual_excerpt)
+                backlink = self.autodiscover(link, response)
+            finally:
+                response.close()
+            self.cache_backlink(link, backlink)
+            callback(backlink)
+
+        self.reader.open(link, callback=handle_response,
+                         errback=lambda error: callback(None))
+
+    def discover_backlinks(self, markup, callback):
+        """
+        Schedule autodiscovery for all external links in markup. ``callback``
+        is called with the list of (resource-url, ping-url, client-object,
+        protocol-name) tuples once every link has been checked.
+
+        """
+        self.discover_links(parse_external_links(markup), callback)
+
+    def discover_links(self, links, callback):
+        """
+        Schedule autodiscovery for each of the given links. ``callback`` is
+        called with the list of (resource-url, ping-url, client-object,
+        protocol-name) tuples found once every link has been checked.
+
+        """
+        if not links:
+            return callback([])
+        results = [None] * len(links)
+        remaining = [len(links)]
+
+        def link_callback(index):
+            def handle_result(result):
+                results[index] = result
+                remaining[0] = remaining[0] - 1
+                if not remaining[0]:
+                    callback([result for result in results if result])
+            return handle_result
+
+        for index, link in enumerate(links):
+            self.discover_link(link, link_callback(index))
+
+    def ping_all(self, markup, source_url=None, source_object=None, title=None, excerpt=None,
+                 incremental=None):
+        """
+        Schedule pings to all pingable, linked resources found in the given
+        markup. ``incremental`` behaves as for ``BacklinksClient.ping_all``.
+
+        """
+        document = self.parse_document(markup)
+        title = title or self.get_title(document)
+        if not source_url and source_object:
+            source_url = self.get_url(source_object)
+
+        def ping_target(target_url, ping_url, client, client_name):
+            contextual_excerpt = excerpt or self.get_excerpt(document, target_url)
+            record_args = (target_url, source_url, client_name)
+            record_kwargs = {'source_object': source_object,
+                             'title': title,
+                             'excerpt': contextual_excerpt}
+            client.ping_async(self.reader, ping_url, target_url, source_url,
+                              callback=lambda result: self.register_successful_ping(*record_args, **record_kwargs),
+                              errback=lambda error: self.register_unsuccessful_ping(*record_args, **record_kwargs),
+                              title=title, excerpt=contextual_excerpt)
+
+        pinged = self.get_pinged_urls(source_object, incremental)
+
+        def ping_discovered(discovered):
+            for target_url, ping_url, client, client_name in discovered:
+                if canonicalize_url(target_url) not in pinged:
+                    ping_target(target_url, ping_url, client, client_name)
+
+        links = [link for link in document.external_links
+                 if canonicalize_url(link) not in pinged]
+        self.discover_links(links, ping_discovered)
+
+    def run(self):
+        """
+        Perform all scheduled autodiscovery requests and pings.
+
+        """
+        self.reader.run()
@@ -7,6 +7,54 @@ INSTALLED_MODULES = [
     ('trackback', 'TrackBack', 'backlinks.trackback.client.default_client'),
 ]
 
+INSTALLED_ASYNC_MODULES = [
+    ('pingback', 'Pingback', 'backlinks.pingback.client.default_async_client'),
+    ('trackback', 'TrackBack', 'backlinks.trackback.client.default_async_client'),
+]
+
+INSTALLED_SERVERS = [
+    ('pingback', 'backlinks.pingback.server.default_server'),
+]
+
+CANONICAL_URL_DROP_DEFAULT_PORT = True
+CANONICAL_URL_DROP_FRAGMENT = True
+CANONICAL_URL_LOWERCASE_HOST = True
+CANONICAL_URL_STRIP_PARAMS = ['utm_*', 'fbclid', 'gclid', 'mc_cid', 'mc_eid']
+CONNECTION_POOL_SIZE = 10
+CONNECTION_POOL_IDLE_TIMEOUT = 30
+DEFER_PING_VERIFICATION = False
+DISCOVERY_CACHE_SIZE = 1000
+DISCOVERY_CACHE_TIMEOUT = 6 * 60 * 60
+DISCOVERY_CACHE_NEGATIVE_TIMEOUT = 60 * 60
+DISCOVERY_CACHE_USE_DJANGO_CACHE = False
+DISCOVERY_CHUNK_SIZE = 2048
+DISCOVERY_HEAD_REQUEST = False
+DISCOVERY_WORKERS = 1
+DISCOVERY_WORKERS_PER_HOST = 2
+FETCH_CONNECT_TIMEOUT = 10
+FETCH_DEADLINE = 60
+FETCH_READ_TIMEOUT = 30
+INCREMENTAL_PINGS = False
+MAX_COMPRESSION_RATIO = 100
+MAX_DECOMPRESSED_LENGTH = 1024 * 1024
 MAX_EXCERPT_WORDS = 32
 MAX_URL_READ_LENGTH = 8192
+PARSER_BACKEND = 'regex'
+PINGABLE_CACHE_SIZE = 1000
+PINGABLE_CACHE_TIMEOUT = 5 * 60
+PINGBACK_CONNECT_TIMEOUT = 10
+PINGBACK_READ_TIMEOUT = 30
+QUEUE_PINGS = False
+QUEUE_BATCH_SIZE = 20
+QUEUE_CLAIM_TIMEOUT = 600
+RATE_LIMIT_BURST = 10
+RATE_LIMIT_RATE = 2.0
+RATE_LIMIT_USE_DJANGO_CACHE = False
+RESOLVE_CACHE_SIZE = 1000
+RETRY_DELAY = 5 * 60
+RETRY_JITTER = 0.25
+RETRY_MAX_ATTEMPTS = 5
+RETRY_MAX_DELAY = 24 * 60 * 60
+SOURCE_CACHE_SIZE = 100
+SOURCE_CACHE_TIMEOUT = 60
 USER_AGENT_STRING = _get_user_agent_string
@@ -17,6 +17,10 @@ class BacklinkSourceDoesNotLink(BacklinkServerError):
     code = 0x0011
     message = 'Source does not link'
 
+class BacklinkSourceUnavailable(BacklinkServerError):
+    # The source could not be fetched, but may be later
+    code = 0x0000
+
 class BacklinkTargetDoesNotExist(BacklinkServerError):
     code = 0x0020
     message = 'Target does not exist'
@@ -44,6 +48,8 @@ class BacklinkClientError(Exception):
     code = 0x0000
     message = 'An unknown error has occurred'
     reason = ''
+    # Whether the ping may succeed if retried later
+    temporary = True
     def __init__(self, message='', reason=''):
         self.message = message or self.message
         self.reason = reason or self.reason
@@ -55,22 +61,27 @@ class BacklinkClientSourceDoesNotExist(BacklinkClientError):
 class BacklinkClientSourceDoesNotLink(BacklinkClientError):
     code = 0x0011
     message = 'Source does not link'
+    temporary = False
 
 class BacklinkClientTargetDoesNotExist(BacklinkClientError):
     code = 0x0020
     message = 'Target does not exist'
+    temporary = False
 
 class BacklinkClientTargetNotPingable(BacklinkClientError):
     code = 0x0021
     message = 'Target not pingable'
+    temporary = False
 
 class BacklinkClientAlreadyRegistered(BacklinkClientError):
     code = 0x0030
     message = 'Ping from given source to given target already registered'
+    temporary = False
 
 class BacklinkClientAccessDenied(BacklinkClientError):
     code = 0x0031
     message = 'Access denied'
+    temporary = False
 
 class BacklinkClientServerConnectionError(BacklinkClientError):
     code = 0x0032
@@ -79,6 +90,7 @@ class BacklinkClientServerConnectionError(BacklinkClientError):
 class BacklinkClientServerDoesNotExist(BacklinkClientError):
     code = 0x0100
     message = 'The given server resource does not exist'
+    temporary = False
 
 class BacklinkClientRemoteError(BacklinkClientError):
     code = 0x0101
@@ -0,0 +1,62 @@
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+from django.db import models
+
+
+def url_hash(url):
+    """
+    Return the hex MD5 digest of an URL, which stands in for the URL in
+    indexes.
+
+    """
+    if isinstance(url, unicode):
+        url = url.encode('utf-8')
+    return md5(url or '').hexdigest()
+
+
+def canonical_url_hash(url):
+    """
+    Return the ``url_hash`` of the canonical form of an URL, which stands in
+    for every equivalent URL.
+
+    """
+    from backlinks.utils import canonicalize_url
+    return url_hash(canonicalize_url(url or ''))
+
+
+class URLHashField(models.CharField):
+    """
+    Holds the ``url_hash`` of the model's ``url_field``, computed whenever
+    the model is saved, so that lookups by URL can use a short, fixed
+    length index. If ``canonical`` is true the hash is of the URL's
+    canonical form, so equivalent URLs share one hash.
+
+    """
+    def __init__(self, url_field, canonical=False, *args, **kwargs):
+        kwargs.setdefault('max_length', 32)
+        kwargs.setdefault('editable', False)
+        self.url_field = url_field
+        self.canonical = canonical
+        super(URLHashField, self).__init__(*args, **kwargs)
+
+    def pre_save(self, model_instance, add):
+        url = getattr(model_instance, self.url_field)
+        if self.canonical:
+            value = canonical_url_hash(url)
+        else:
+            value = url_hash(url)
+        setattr(model_instance, self.attname, value)
+        return value
+
+
+try:
+    from south.modelsinspector import add_introspection_rules
+except ImportError:
+    pass
+else:
+    add_introspection_rules([([URLHashField], [], {'url_field': ['url_field', {}],
+                                                    'canonical': ['canonical', {'default': False}]})],
+                            [r'^backlinks\.fields\.URLHashField'])
@@ -0,0 +1,43 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+
+class QueueCommand(NoArgsCommand):
+    """
+    A command which claims and processes batches of queued pings until
+    none remain, or keeps polling for them with ``--loop``.
+    Subclasses must override ``get_processor``.
+
+    """
+    processed_message = 'Processed %d pending pings'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', type='int', dest='batch_size', default=None,
+                    help='The number of pending pings to claim at a time.'),
+        make_option('--loop', action='store_true', dest='loop', default=False,
+                    help='Keep polling for pending pings instead of exiting '
+                         'once none remain.'),
+        make_option('--interval', type='float', dest='interval', default=5.0,
+                    help='Seconds to wait between polls when looping.'),
+    )
+
+    def get_processor(self):
+        """
+        Return the object whose ``process_pending_pings`` method processes
+        a batch of queued pings.
+
+        """
+        raise NotImplementedError
+
+    def handle_noargs(self, **options):
+        processor = self.get_processor()
+        verbosity = int(options.get('verbosity', 1))
+        while True:
+            processed = processor.process_pending_pings(options.get('batch_size'))
+            if processed and verbosity > 1:
+                print self.processed_message % processed
+            if not processed:
+                if not options.get('loop'):
+                    break
+                time.sleep(options.get('interval'))
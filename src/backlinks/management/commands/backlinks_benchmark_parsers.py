@@ -0,0 +1,58 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+
+from backlinks.utils.parsers import TOKENIZERS, DocumentParser
+
+PARAGRAPH = '<p>Lorem ipsum dolor sit amet, <a href="http://example.com/%(n)d/?a=1&amp;b=2">' \
+            'consectetur &amp; adipisicing</a> elit, sed do eiusmod tempor&nbsp;incididunt ' \
+            'ut labore et <em>dolore</em> magna aliqua. <img src="/%(n)d.png" alt="&#8220;%(n)d&#8221;"/>' \
+            '<br/>Ut enim ad minim <a href="/internal/%(n)d/">veniam</a>.</p>\n'
+
+DOCUMENT = '<!DOCTYPE html>\n<html><head><title>Benchmark document %(n)d</title>\n' \
+           '<script type="text/javascript">if (a < b && c > d) { document.write("<a href=\'x\'>"); }</script>\n' \
+           '</head><body><h1>Document %(n)d</h1>\n<!-- navigation -->\n%(body)s' \
+           '<textarea name="comment"><a href="http://spam.com/">spam</a></textarea>\n</body></html>\n'
+
+
+def build_corpus(num_documents=50):
+    """
+    Returns a fixed list of HTML documents, of 1 to ``num_documents``
+    paragraphs each.
+
+    """
+    corpus = []
+    for n in range(1, num_documents + 1):
+        body = ''.join([PARAGRAPH % {'n': i} for i in range(n)])
+        corpus.append(DOCUMENT % {'n': n, 'body': body})
+    return corpus
+
+
+class Command(NoArgsCommand):
+    help = 'Measures how many documents per second each markup parser backend ' \
+           'parses from a fixed HTML corpus.'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--backend', action='append', dest='backends', default=None,
+                    help='A parser backend to measure. May be given more than '
+                         'once. Defaults to all available backends.'),
+        make_option('--repeat', type='int', dest='repeat', default=20,
+                    help='The number of times the corpus is parsed.'),
+    )
+
+    def handle_noargs(self, **options):
+        backends = options.get('backends') or sorted(TOKENIZERS.keys())
+        for backend in backends:
+            if backend not in TOKENIZERS:
+                raise CommandError('Unknown or unavailable parser backend: %r' % backend)
+        corpus = build_corpus()
+        repeat = max(1, options.get('repeat') or 1)
+        for backend in backends:
+            start = time.time()
+            for i in range(repeat):
+                for document in corpus:
+                    parser = DocumentParser(backend=backend)
+                    parser.feed(document)
+                    parser.close()
+            elapsed = time.time() - start
+            print '%-12s %10.1f documents/second' % (backend, len(corpus) * repeat / elapsed)
@@ -0,0 +1,10 @@
+from backlinks.management.base import QueueCommand
+from backlinks.client import BacklinksClient
+
+
+class Command(QueueCommand):
+    help = 'Sends pending outbound pings queued by BacklinksClient.ping_all, ' \
+           'and retries failed pings which are due.'
+
+    def get_processor(self):
+        return BacklinksClient()
@@ -0,0 +1,12 @@
+from backlinks.management.base import QueueCommand
+from backlinks.server import BacklinksServer
+
+
+class Command(QueueCommand):
+    help = 'Verifies the sources of inbound pings accepted while ' \
+           'DEFER_PING_VERIFICATION is set, recording the valid ones. ' \
+           'Each ping is verified by the server installed for its protocol.'
+    processed_message = 'Verified %d pending pings'
+
+    def get_processor(self):
+        return BacklinksServer()
@@ -1,7 +1,56 @@
-from django.db import models
+import datetime
+import uuid
+
+import django
+from django.db import models, connection, transaction, IntegrityError
+from django.db.models import Q
 from django.contrib.contenttypes.models import ContentType
 
-class InboundBacklinkManager(models.Manager):
+from backlinks.fields import url_hash, canonical_url_hash
+
+def get_db_prep_save(field, value):
+    # Django 1.2 made preparing values database specific
+    if django.VERSION >= (1, 2):
+        return field.get_db_prep_save(value, connection=connection)
+    return field.get_db_prep_save(value)
+
+class ClaimableManagerMixin(object):
+    """
+    Claims batches of queued records for a worker. Managers using it
+    provide ``claimable(now)``, the records a worker may claim, and
+    ``claim_order``, the field claims are made in order of.
+
+    """
+    claim_order = 'pk'
+
+    def claimable(self, now):
+        raise NotImplementedError
+
+    def claim_pending(self, worker_id, batch_size, claim_timeout):
+        """
+        Claim up to ``batch_size`` claimable records for the given worker
+        and return them. Records claimed by another worker more than
+        ``claim_timeout`` seconds ago are treated as abandoned.
+
+        The claim is a single conditional ``UPDATE``, so concurrent workers
+        never claim the same record.
+
+        """
+        now = datetime.datetime.now()
+        unclaimed = Q(claimed_by='') | \
+            Q(claimed_at__lt=now - datetime.timedelta(seconds=claim_timeout))
+        candidates = list(self.claimable(now).filter(unclaimed).order_by(self.claim_order)
+                          .values_list('pk', flat=True)[:batch_size])
+        if not candidates:
+            return []
+        claim = ('%s:%s' % (worker_id, uuid.uuid4().hex))[:128]
+        self.claimable(now).filter(unclaimed, pk__in=candidates).update(claimed_by=claim,
+                                                                        claimed_at=now)
+        return list(self.get_query_set().filter(claimed_by=claim))
+
+class InboundBacklinkManager(ClaimableManagerMixin, models.Manager):
+    claim_order = 'received'
+
     def approved(self):
         return self.get_query_set().filter(status__exact=self.model.APPROVED_STATUS)
 
@@ -12,10 +61,160 @@ class InboundBacklinkManager(models.Manager):
             qs = qs.filter(object_id=model._get_pk_val())
         return qs
 
-class OutboundBacklinkManager(models.Manager):
+    def pending(self):
+        return self.get_query_set().filter(status__exact=self.model.PENDING_STATUS)
+
+    def is_registered(self, source_url, target_url, target_object=None):
+        """
+        Return whether a ping from the source URL to the target URL, and to
+        the target object if given, has been recorded. Only the primary key
+        of at most one row is fetched, through the unique index on the
+        record's URL hashes and target object.
+
+        """
+        qs = self.get_query_set().filter(source_url_hash=url_hash(source_url),
+                                         target_url_hash=url_hash(target_url),
+                                         source_url=source_url, target_url=target_url)
+        if target_object is not None:
+            try:
+                ct = ContentType.objects.get_for_model(target_object)
+            except (AttributeError, ContentType.DoesNotExist):
+                pass
+            else:
+                qs = qs.filter(content_type=ct, object_id=target_object.pk)
+        return bool(list(qs.values_list('pk', flat=True)[:1]))
+
+    def claimable(self, now):
+        """
+        Return the records of pings awaiting verification, other than those
+        whose next attempt is not yet due.
+
+        """
+        return self.pending().filter(Q(next_attempt__isnull=True) | Q(next_attempt__lte=now))
+
+class OutboundBacklinkManager(ClaimableManagerMixin, models.Manager):
+    claim_order = 'sent'
+    # Maximum number of target URLs in a single ``IN`` lookup
+    LOOKUP_BATCH_SIZE = 500
+
     def for_model(self, model):
         ct = ContentType.objects.get_for_model(model)
         qs = self.get_query_set().filter(content_type=ct)
         if isinstance(model, models.Model):
             qs = qs.filter(object_id=model._get_pk_val())
         return qs
+
+    def for_targets(self, target_urls, source_object=None):
+        """
+        Return a dict of the existing records for pings from the source
+        object (or from no object) to any of the given target URLs, or to
+        URLs equivalent to them, keyed by the hash of the canonical form of
+        the target URL.
+
+        """
+        if source_object is not None:
+            qs = self.for_model(source_object)
+        else:
+            qs = self.get_query_set().filter(content_type__isnull=True)
+        target_urls = list(target_urls)
+        records = {}
+        for start in range(0, len(target_urls), self.LOOKUP_BATCH_SIZE):
+            batch = target_urls[start:start + self.LOOKUP_BATCH_SIZE]
+            hashes = [canonical_url_hash(target_url) for target_url in batch]
+            for record in qs.filter(target_url_hash__in=hashes).order_by('pk'):
+                records.setdefault(record.target_url_hash, record)
+        return records
+
+    def bulk_save(self, records):
+        """
+        Save the given records using one ``executemany`` ``UPDATE`` for
+        those already stored and one ``executemany`` ``INSERT`` for the new
+        ones, in a single transaction. Primary keys are not set on inserted
+        records.
+
+        A new record whose source object and target URL were stored by a
+        concurrent process in the meantime updates that row instead.
+
+        The records are written with raw SQL: their ``save`` methods are not
+        called and no ``pre_save`` or ``post_save`` signals are sent.
+
+        """
+        opts = self.model._meta
+        qn = connection.ops.quote_name
+        fields = [f for f in opts.local_fields if not isinstance(f, models.AutoField)]
+        columns = [f.column for f in fields]
+        key_columns = [opts.get_field(name).column for name in opts.unique_together[0]]
+        updates, inserts, seen = [], [], set()
+        for record in records:
+            if id(record) in seen:
+                continue
+            seen.add(id(record))
+            add = record.pk is None
+            values = [get_db_prep_save(f, f.pre_save(record, add)) for f in fields]
+            if add:
+                inserts.append(values)
+            else:
+                updates.append(values + [record.pk])
+        if not updates and not inserts:
+            return
+        cursor = connection.cursor()
+        if updates:
+            cursor.executemany('UPDATE %s SET %s WHERE %s = %%s' % (
+                qn(opts.db_table),
+                ', '.join(['%s = %%s' % qn(f.column) for f in fields]),
+                qn(opts.pk.column)), updates)
+        if inserts:
+            insert_sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+                qn(opts.db_table),
+                ', '.join([qn(column) for column in columns]),
+                ', '.join(['%s'] * len(fields)))
+            sid = transaction.savepoint()
+            try:
+                cursor.executemany(insert_sql, inserts)
+            except IntegrityError:
+                transaction.savepoint_rollback(sid)
+                self._insert_or_update(cursor, insert_sql, columns, key_columns, inserts)
+            else:
+                transaction.savepoint_commit(sid)
+        transaction.commit_unless_managed()
+
+    def _insert_or_update(self, cursor, insert_sql, columns, key_columns, inserts):
+        # Inserts the rows one at a time, updating the stored row instead of
+        # any which is already recorded
+        qn = connection.ops.quote_name
+        update_sql = 'UPDATE %s SET %s WHERE %s' % (
+            qn(self.model._meta.db_table),
+            ', '.join(['%s = %%s' % qn(column) for column in columns]),
+            ' AND '.join(['%s = %%s' % qn(column) for column in key_columns]))
+        key_indexes = [columns.index(column) for column in key_columns]
+        for values in inserts:
+            sid = transaction.savepoint()
+            try:
+                cursor.execute(insert_sql, values)
+            except IntegrityError:
+                transaction.savepoint_rollback(sid)
+                cursor.execute(update_sql, values + [values[i] for i in key_indexes])
+            else:
+                transaction.savepoint_commit(sid)
+
+    def pending(self):
+        return self.get_query_set().filter(status__exact=self.model.PENDING_STATUS)
+
+    def due(self, now=None):
+        """
+        Return a ``QuerySet`` of the pending records, and of the unsuccessful
+        records whose next attempt is due.
+
+        """
+        now = now or datetime.datetime.now()
+        return self.get_query_set().filter(
+            Q(status__exact=self.model.PENDING_STATUS) |
+            Q(status__exact=self.model.UNSUCCESSFUL_STATUS, next_attempt__lte=now))
+
+    def claimable(self, now):
+        """
+        Return the pending records, and unsuccessful records due for a
+        retry.
+
+        """
+        return self.due(now)
@@ -0,0 +1,89 @@
+# encoding: utf-8
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+
+        # Adding model 'InboundBacklink'
+        db.create_table('backlinks_inboundbacklink', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('source_url', self.gf('django.db.models.fields.URLField')(max_length=200)),
+            ('target_url', self.gf('django.db.models.fields.URLField')(max_length=200)),
+            ('received', self.gf('django.db.models.fields.DateTimeField')(default=datetime.datetime.now)),
+            ('title', self.gf('django.db.models.fields.CharField')(max_length=1024, blank=True)),
+            ('excerpt', self.gf('django.db.models.fields.TextField')(blank=True)),
+            ('status', self.gf('django.db.models.fields.PositiveIntegerField')(default=2)),
+            ('protocol', self.gf('django.db.models.fields.CharField')(max_length=32, blank=True)),
+            ('content_type', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['contenttypes.ContentType'], null=True, blank=True)),
+            ('object_id', self.gf('django.db.models.fields.PositiveIntegerField')(null=True, blank=True)),
+        ))
+        db.send_create_signal('backlinks', ['InboundBacklink'])
+
+        # Adding model 'OutboundBacklink'
+        db.create_table('backlinks_outboundbacklink', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('target_url', self.gf('django.db.models.fields.URLField')(max_length=200)),
+            ('source_url', self.gf('django.db.models.fields.URLField')(max_length=200)),
+            ('sent', self.gf('django.db.models.fields.DateTimeField')(default=datetime.datetime.now)),
+            ('title', self.gf('django.db.models.fields.CharField')(max_length=1024, blank=True)),
+            ('excerpt', self.gf('django.db.models.fields.TextField')()),
+            ('protocol', self.gf('django.db.models.fields.CharField')(max_length=32, blank=True)),
+            ('status', self.gf('django.db.models.fields.PositiveIntegerField')()),
+            ('message', self.gf('django.db.models.fields.CharField')(max_length=1024, blank=True)),
+            ('content_type', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['contenttypes.ContentType'], null=True, blank=True)),
+            ('object_id', self.gf('django.db.models.fields.PositiveIntegerField')(null=True, blank=True)),
+        ))
+        db.send_create_signal('backlinks', ['OutboundBacklink'])
+
+
+    def backwards(self, orm):
+
+        # Deleting model 'InboundBacklink'
+        db.delete_table('backlinks_inboundbacklink')
+
+        # Deleting model 'OutboundBacklink'
+        db.delete_table('backlinks_outboundbacklink')
+
+
+    models = {
+        'backlinks.inboundbacklink': {
+            'Meta': {'ordering': "['-received']", 'object_name': 'InboundBacklink'},
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']", 'null': 'True', 'blank': 'True'}),
+            'excerpt': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'object_id': ('django.db.models.fields.PositiveIntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'protocol': ('django.db.models.fields.CharField', [], {'max_length': '32', 'blank': 'True'}),
+            'received': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'source_url': ('django.db.models.fields.URLField', [], {'max_length': '200'}),
+            'status': ('django.db.models.fields.PositiveIntegerField', [], {'default': '2'}),
+            'target_url': ('django.db.models.fields.URLField', [], {'max_length': '200'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '1024', 'blank': 'True'})
+        },
+        'backlinks.outboundbacklink': {
+            'Meta': {'object_name': 'OutboundBacklink'},
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']", 'null': 'True', 'blank': 'True'}),
+            'excerpt': ('django.db.models.fields.TextField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'message': ('django.db.models.fields.CharField', [], {'max_length': '1024', 'blank': 'True'}),
+            'object_id': ('django.db.models.fields.PositiveIntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'protocol': ('django.db.models.fields.CharField', [], {'max_length': '32', 'blank': 'True'}),
+            'sent': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'source_url': ('django.db.models.fields.URLField', [], {'max_length': '200'}),
+            'status': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'target_url': ('django.db.models.fields.URLField', [], {'max_length': '200'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '1024', 'blank': 'True'})
+        },
+        'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        }
+    }
+
+    complete_apps = ['backlinks']
@@ -0,0 +1,68 @@
+# encoding: utf-8
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+
+        # Adding field 'OutboundBacklink.num_attempts'
+        db.add_column('backlinks_outboundbacklink', 'num_attempts', self.gf('django.db.models.fields.PositiveIntegerField')(default=0), keep_default=False)
+
+        # Adding field 'OutboundBacklink.next_attempt'
+        db.add_column('backlinks_outboundbacklink', 'next_attempt', self.gf('django.db.models.fields.DateTimeField')(null=True, blank=True), keep_default=False)
+
+
+    def backwards(self, orm):
+
+        # Deleting field 'OutboundBacklink.num_attempts'
+        db.delete_column('backlinks_outboundbacklink', 'num_attempts')
+
+        # Deleting field 'OutboundBacklink.next_attempt'
+        db.delete_column('backlinks_outboundbacklink', 'next_attempt')
+
+
+    models = {
+        'backlinks.inboundbacklink': {
+            'Meta': {'ordering': "['-received']", 'object_name': 'InboundBacklink'},
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']", 'null': 'True', 'blank': 'True'}),
+            'excerpt': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'object_id': ('django.db.models.fields.PositiveIntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'protocol': ('django.db.models.fields.CharField', [], {'max_length': '32', 'blank': 'True'}),
+            'received': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'source_url': ('django.db.models.fields.URLField', [], {'max_length': '200'}),
+            'status': ('django.db.models.fields.PositiveIntegerField', [], {'default': '2'}),
+            'target_url': ('django.db.models.fields.URLField', [], {'max_length': '200'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '1024', 'blank': 'True'})
+        },
+        'backlinks.outboundbacklink': {
+            'Meta': {'object_name': 'OutboundBacklink'},
+            'claimed_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'claimed_by': ('django.db.models.fields.CharField', [], {'max_length': '128', 'blank': 'True'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']", 'null': 'True', 'blank': 'True'}),
+            'excerpt': ('django.db.models.fields.TextField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'message': ('django.db.models.fields.CharField', [], {'max_length': '1024', 'blank': 'True'}),
+            'next_attempt': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'num_attempts': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'object_id': ('django.db.models.fields.PositiveIntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'protocol': ('django.db.models.fields.CharField', [], {'max_length': '32', 'blank': 'True'}),
+            'sent': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'source_url': ('django.db.models.fields.URLField', [], {'max_length': '200'}),
+            'status': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'target_url': ('django.db.models.fields.URLField', [], {'max_length': '200'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '1024', 'blank': 'True'})
+        },
+        'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        }
+    }
+
+    complete_apps = ['backlinks']
@@ -0,0 +1,159 @@
+# encoding: utf-8
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import connection, models
+
+from backlinks.fields import url_hash
+
+# Number of rows updated by a single statement
+BATCH_SIZE = 1000
+
+# Backends whose MD5() of a column matches ``url_hash``, as Django keeps
+# their text in UTF-8
+SQL_MD5_BACKENDS = ('postgres', 'mysql')
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+
+        # Adding field 'InboundBacklink.source_url_hash'
+        db.add_column('backlinks_inboundbacklink', 'source_url_hash', self.gf('backlinks.fields.URLHashField')('source_url', default='', max_length=32), keep_default=False)
+
+        # Adding field 'InboundBacklink.target_url_hash'
+        db.add_column('backlinks_inboundbacklink', 'target_url_hash', self.gf('backlinks.fields.URLHashField')('target_url', default='', max_length=32), keep_default=False)
+
+        # Adding field 'OutboundBacklink.target_url_hash'
+        db.add_column('backlinks_outboundbacklink', 'target_url_hash', self.gf('backlinks.fields.URLHashField')('target_url', default='', max_length=32), keep_default=False)
+
+        if not db.dry_run:
+            self.hash_urls(orm)
+            self.delete_duplicate_backlinks(orm)
+
+        # Adding unique constraint on 'InboundBacklink', fields ['source_url_hash', 'target_url_hash', 'content_type', 'object_id']
+        db.create_unique('backlinks_inboundbacklink', ['source_url_hash', 'target_url_hash', 'content_type_id', 'object_id'])
+
+        # Adding index on 'InboundBacklink', fields ['content_type', 'object_id', 'status', 'received']
+        db.create_index('backlinks_inboundbacklink', ['content_type_id', 'object_id', 'status', 'received'])
+
+        # Adding index on 'OutboundBacklink', fields ['content_type', 'object_id', 'target_url_hash']
+        db.create_index('backlinks_outboundbacklink', ['content_type_id', 'object_id', 'target_url_hash'])
+
+
+    def backwards(self, orm):
+
+        # Removing index on 'OutboundBacklink', fields ['content_type', 'object_id', 'target_url_hash']
+        db.delete_index('backlinks_outboundbacklink', ['content_type_id', 'object_id', 'target_url_hash'])
+
+        # Removing index on 'InboundBacklink', fields ['content_type', 'object_id', 'status', 'received']
+        db.delete_index('backlinks_inboundbacklink', ['content_type_id', 'object_id', 'status', 'received'])
+
+        # Removing unique constraint on 'InboundBacklink', fields ['source_url_hash', 'target_url_hash', 'content_type', 'object_id']
+        db.delete_unique('backlinks_inboundbacklink', ['source_url_hash', 'target_url_hash', 'content_type_id', 'object_id'])
+
+        # Deleting field 'InboundBacklink.source_url_hash'
+        db.delete_column('backlinks_inboundbacklink', 'source_url_hash')
+
+        # Deleting field 'InboundBacklink.target_url_hash'
+        db.delete_column('backlinks_inboundbacklink', 'target_url_hash')
+
+        # Deleting field 'OutboundBacklink.target_url_hash'
+        db.delete_column('backlinks_outboundbacklink', 'target_url_hash')
+
+    def hash_urls(self, orm):
+        cursor = connection.cursor()
+        if db.backend_name in SQL_MD5_BACKENDS:
+            cursor.execute('UPDATE backlinks_inboundbacklink '
+                           'SET source_url_hash = MD5(source_url), target_url_hash = MD5(target_url)')
+            cursor.execute('UPDATE backlinks_outboundbacklink SET target_url_hash = MD5(target_url)')
+            return
+        for batch in self.batches(orm.InboundBacklink, 'source_url', 'target_url'):
+            cursor.executemany('UPDATE backlinks_inboundbacklink '
+                               'SET source_url_hash = %s, target_url_hash = %s WHERE id = %s',
+                               [(url_hash(source_url), url_hash(target_url), pk)
+                                for pk, source_url, target_url in batch])
+        for batch in self.batches(orm.OutboundBacklink, 'target_url'):
+            cursor.executemany('UPDATE backlinks_outboundbacklink '
+                               'SET target_url_hash = %s WHERE id = %s',
+                               [(url_hash(target_url), pk) for pk, target_url in batch])
+
+    def batches(self, model, *fields):
+        # Yield (pk,) + fields rows in pk order, BATCH_SIZE at a time, so
+        # only one batch of rows and hashes is held in memory at once
+        rows = model.objects.order_by('pk')
+        last_pk = None
+        while True:
+            batch = rows
+            if last_pk is not None:
+                batch = batch.filter(pk__gt=last_pk)
+            batch = list(batch.values_list('pk', *fields)[:BATCH_SIZE])
+            if not batch:
+                return
+            last_pk = batch[-1][0]
+            yield batch
+
+    def delete_duplicate_backlinks(self, orm):
+        # Keep the first of any inbound backlinks recorded more than once, as
+        # the unique constraint cannot be added while duplicates remain.
+        # Rows without a target object are left alone: their NULL
+        # content_type and object_id never compare equal, so the constraint
+        # does not apply to them
+        key_fields = ('source_url_hash', 'target_url_hash', 'content_type', 'object_id')
+        rows = orm.InboundBacklink.objects.order_by(*(key_fields + ('pk',)))
+        duplicates, last_key = [], None
+        for row in rows.values_list(*(key_fields + ('pk',))).iterator():
+            key = row[:-1]
+            if key == last_key and None not in key:
+                duplicates.append(row[-1])
+            last_key = key
+        for start in range(0, len(duplicates), 500):
+            orm.InboundBacklink.objects.filter(pk__in=duplicates[start:start + 500]).delete()
+
+
+    models = {
+        'backlinks.inboundbacklink': {
+            'Meta': {'ordering': "['-received']", 'unique_together': "(('source_url_hash', 'target_url_hash', 'content_type', 'object_id'),)", 'object_name': 'InboundBacklink'},
+            'claimed_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'claimed_by': ('django.db.models.fields.CharField', [], {'max_length': '128', 'blank': 'True'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']", 'null': 'True', 'blank': 'True'}),
+            'excerpt': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'object_id': ('django.db.models.fields.PositiveIntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'protocol': ('django.db.models.fields.CharField', [], {'max_length': '32', 'blank': 'True'}),
+            'received': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'source_url': ('django.db.models.fields.URLField', [], {'max_length': '200'}),
+            'source_url_hash': ('backlinks.fields.URLHashField', [], {'url_field': "'source_url'", 'max_length': '32'}),
+            'status': ('django.db.models.fields.PositiveIntegerField', [], {'default': '2'}),
+            'target_url': ('django.db.models.fields.URLField', [], {'max_length': '200'}),
+            'target_url_hash': ('backlinks.fields.URLHashField', [], {'url_field': "'target_url'", 'max_length': '32'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '1024', 'blank': 'True'})
+        },
+        'backlinks.outboundbacklink': {
+            'Meta': {'object_name': 'OutboundBacklink'},
+            'claimed_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'claimed_by': ('django.db.models.fields.CharField', [], {'max_length': '128', 'blank': 'True'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']", 'null': 'True', 'blank': 'True'}),
+            'excerpt': ('django.db.models.fields.TextField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'message': ('django.db.models.fields.CharField', [], {'max_length': '1024', 'blank': 'True'}),
+            'next_attempt': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'num_attempts': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'object_id': ('django.db.models.fields.PositiveIntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'protocol': ('django.db.models.fields.CharField', [], {'max_length': '32', 'blank': 'True'}),
+            'sent': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'source_url': ('django.db.models.fields.URLField', [], {'max_length': '200'}),
+            'status': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'target_url': ('django.db.models.fields.URLField', [], {'max_length': '200'}),
+            'target_url_hash': ('backlinks.fields.URLHashField', [], {'url_field': "'target_url'", 'max_length': '32'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '1024', 'blank': 'True'})
+        },
+        'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        }
+    }
+
+    complete_apps = ['backlinks']
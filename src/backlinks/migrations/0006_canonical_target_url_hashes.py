@@ -0,0 +1,92 @@
+# encoding: utf-8
+import datetime
+from south.db import db
+from south.v2 import DataMigration
+from django.db import connection, models
+
+from backlinks.fields import url_hash, canonical_url_hash
+
+# Number of rows read and updated at a time
+BATCH_SIZE = 1000
+
+class Migration(DataMigration):
+
+    def forwards(self, orm):
+        """
+        Key existing outbound backlinks by the hash of the canonical form of
+        their target URLs, as they are now looked up, so that earlier pings
+        are recognized and not sent again. The target URLs are kept as
+        linked.
+
+        """
+        self.update_hashes(orm, canonical_url_hash)
+
+    def backwards(self, orm):
+        self.update_hashes(orm, url_hash)
+
+    def update_hashes(self, orm, hash_url):
+        cursor = connection.cursor()
+        rows = orm.OutboundBacklink.objects.order_by('pk')
+        last_pk = None
+        while True:
+            batch = rows
+            if last_pk is not None:
+                batch = batch.filter(pk__gt=last_pk)
+            batch = list(batch.values_list('pk', 'target_url', 'target_url_hash')[:BATCH_SIZE])
+            if not batch:
+                break
+            last_pk = batch[-1][0]
+            updates = [(hash_url(target_url), pk) for pk, target_url, target_url_hash in batch
+                       if hash_url(target_url) != target_url_hash]
+            if updates:
+                cursor.executemany('UPDATE backlinks_outboundbacklink '
+                                   'SET target_url_hash = %s WHERE id = %s', updates)
+
+
+    models = {
+        'backlinks.inboundbacklink': {
+            'Meta': {'ordering': "['-received']", 'unique_together': "(('source_url_hash', 'target_url_hash', 'content_type', 'object_id'),)", 'object_name': 'InboundBacklink'},
+            'claimed_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'claimed_by': ('django.db.models.fields.CharField', [], {'max_length': '128', 'blank': 'True'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']", 'null': 'True', 'blank': 'True'}),
+            'excerpt': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'object_id': ('django.db.models.fields.PositiveIntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'protocol': ('django.db.models.fields.CharField', [], {'max_length': '32', 'blank': 'True'}),
+            'received': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'source_url': ('django.db.models.fields.URLField', [], {'max_length': '200'}),
+            'source_url_hash': ('backlinks.fields.URLHashField', [], {'url_field': "'source_url'", 'max_length': '32'}),
+            'status': ('django.db.models.fields.PositiveIntegerField', [], {'default': '2'}),
+            'target_url': ('django.db.models.fields.URLField', [], {'max_length': '200'}),
+            'target_url_hash': ('backlinks.fields.URLHashField', [], {'url_field': "'target_url'", 'max_length': '32'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '1024', 'blank': 'True'})
+        },
+        'backlinks.outboundbacklink': {
+            'Meta': {'object_name': 'OutboundBacklink'},
+            'claimed_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'claimed_by': ('django.db.models.fields.CharField', [], {'max_length': '128', 'blank': 'True'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']", 'null': 'True', 'blank': 'True'}),
+            'excerpt': ('django.db.models.fields.TextField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'message': ('django.db.models.fields.CharField', [], {'max_length': '1024', 'blank': 'True'}),
+            'next_attempt': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'num_attempts': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'object_id': ('django.db.models.fields.PositiveIntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'protocol': ('django.db.models.fields.CharField', [], {'max_length': '32', 'blank': 'True'}),
+            'sent': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'source_url': ('django.db.models.fields.URLField', [], {'max_length': '200'}),
+            'status': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'target_url': ('django.db.models.fields.URLField', [], {'max_length': '200'}),
+            'target_url_hash': ('backlinks.fields.URLHashField', [], {'url_field': "'target_url'", 'canonical': 'True', 'max_length': '32'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '1024', 'blank': 'True'})
+        },
+        'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        }
+    }
+
+    complete_apps = ['backlinks']
@@ -0,0 +1,107 @@
+# encoding: utf-8
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+# Number of rows deleted by a single statement
+BATCH_SIZE = 500
+
+SUCCESSFUL_STATUS = 2
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+
+        if not db.dry_run:
+            self.delete_duplicate_backlinks(orm)
+
+        # Removing index on 'OutboundBacklink', fields ['content_type', 'object_id', 'target_url_hash']
+        db.delete_index('backlinks_outboundbacklink', ['content_type_id', 'object_id', 'target_url_hash'])
+
+        # Adding unique constraint on 'OutboundBacklink', fields ['content_type', 'object_id', 'target_url_hash']
+        db.create_unique('backlinks_outboundbacklink', ['content_type_id', 'object_id', 'target_url_hash'])
+
+
+    def backwards(self, orm):
+
+        # Removing unique constraint on 'OutboundBacklink', fields ['content_type', 'object_id', 'target_url_hash']
+        db.delete_unique('backlinks_outboundbacklink', ['content_type_id', 'object_id', 'target_url_hash'])
+
+        # Adding index on 'OutboundBacklink', fields ['content_type', 'object_id', 'target_url_hash']
+        db.create_index('backlinks_outboundbacklink', ['content_type_id', 'object_id', 'target_url_hash'])
+
+    def delete_duplicate_backlinks(self, orm):
+        # Keep one record of the pings from each source object to each
+        # target: a successful one if there is any, otherwise the one sent
+        # last. Records with no source object are not covered by the unique
+        # constraint, as NULLs never compare equal, and are left alone.
+        key_fields = ('content_type', 'object_id', 'target_url_hash')
+        rows = orm.OutboundBacklink.objects.filter(content_type__isnull=False)\
+            .order_by(*key_fields).values_list(*(key_fields + ('status', 'sent', 'pk')))
+        duplicates, group, last_key = [], [], None
+        for row in rows.iterator():
+            key = row[:3]
+            if key != last_key:
+                duplicates.extend(self.get_duplicates(group))
+                group, last_key = [], key
+            group.append(row)
+        duplicates.extend(self.get_duplicates(group))
+        for start in range(0, len(duplicates), BATCH_SIZE):
+            orm.OutboundBacklink.objects.filter(pk__in=duplicates[start:start + BATCH_SIZE]).delete()
+
+    def get_duplicates(self, group):
+        if len(group) < 2:
+            return []
+        keep = max([(status == SUCCESSFUL_STATUS, sent, pk)
+                    for ct, object_id, hash, status, sent, pk in group])
+        return [row[-1] for row in group if row[-1] != keep[-1]]
+
+
+    models = {
+        'backlinks.inboundbacklink': {
+            'Meta': {'ordering': "['-received']", 'unique_together': "(('source_url_hash', 'target_url_hash', 'content_type', 'object_id'),)", 'object_name': 'InboundBacklink'},
+            'claimed_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'claimed_by': ('django.db.models.fields.CharField', [], {'max_length': '128', 'blank': 'True'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']", 'null': 'True', 'blank': 'True'}),
+            'excerpt': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'object_id': ('django.db.models.fields.PositiveIntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'protocol': ('django.db.models.fields.CharField', [], {'max_length': '32', 'blank': 'True'}),
+            'received': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'source_url': ('django.db.models.fields.URLField', [], {'max_length': '200'}),
+            'source_url_hash': ('backlinks.fields.URLHashField', [], {'url_field': "'source_url'", 'max_length': '32'}),
+            'status': ('django.db.models.fields.PositiveIntegerField', [], {'default': '2'}),
+            'target_url': ('django.db.models.fields.URLField', [], {'max_length': '200'}),
+            'target_url_hash': ('backlinks.fields.URLHashField', [], {'url_field': "'target_url'", 'max_length': '32'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '1024', 'blank': 'True'})
+        },
+        'backlinks.outboundbacklink': {
+            'Meta': {'unique_together': "(('content_type', 'object_id', 'target_url_hash'),)", 'object_name': 'OutboundBacklink'},
+            'claimed_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'claimed_by': ('django.db.models.fields.CharField', [], {'max_length': '128', 'blank': 'True'}),
+            'content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']", 'null': 'True', 'blank': 'True'}),
+            'excerpt': ('django.db.models.fields.TextField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'message': ('django.db.models.fields.CharField', [], {'max_length': '1024', 'blank': 'True'}),
+            'next_attempt': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'num_attempts': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'object_id': ('django.db.models.fields.PositiveIntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'protocol': ('django.db.models.fields.CharField', [], {'max_length': '32', 'blank': 'True'}),
+            'sent': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'source_url': ('django.db.models.fields.URLField', [], {'max_length': '200'}),
+            'status': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'target_url': ('django.db.models.fields.URLField', [], {'max_length': '200'}),
+            'target_url_hash': ('backlinks.fields.URLHashField', [], {'url_field': "'target_url'", 'canonical': 'True', 'max_length': '32'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '1024', 'blank': 'True'})
+        },
+        'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        }
+    }
+
+    complete_apps = ['backlinks']
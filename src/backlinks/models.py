@@ -1,3 +1,4 @@
+import random
 import datetime
 
 from django.db import models
@@ -6,28 +7,73 @@ from django.utils.translation import ugettext_lazy as _
 from django.contrib.contenttypes import generic
 from django.contrib.contenttypes.models import ContentType
 
-from backlinks.managers import InboundBacklinkManager
+from backlinks.conf import settings
+from backlinks.fields import URLHashField
+from backlinks.managers import InboundBacklinkManager, OutboundBacklinkManager
 
-class InboundBacklink(models.Model):
+class RetryMixin(object):
+    """
+    Schedules further attempts at a failed operation on a record with
+    ``num_attempts`` and ``next_attempt`` fields, backing off
+    exponentially according to the ``RETRY_*`` settings.
+
+    """
+    def increment_attempts(self):
+        self.num_attempts = self.num_attempts + 1
+
+    def get_retry_delay(self):
+        """
+        Return the number of seconds to wait before the next attempt, which
+        doubles with each attempt made, up to ``RETRY_MAX_DELAY``, less a
+        random fraction of up to ``RETRY_JITTER`` of it.
+
+        """
+        exponent = min(max(self.num_attempts - 1, 0), 32)
+        delay = min(settings.RETRY_DELAY * (2 ** exponent), settings.RETRY_MAX_DELAY)
+        return delay * (1 - settings.RETRY_JITTER * random.random())
+
+    def schedule_retry(self, now=None):
+        """
+        Set the time of the next attempt, or clear it if ``RETRY_MAX_ATTEMPTS``
+        attempts have been made. Returns whether a retry was scheduled.
+
+        """
+        if self.num_attempts >= settings.RETRY_MAX_ATTEMPTS:
+            self.next_attempt = None
+            return False
+        now = now or datetime.datetime.now()
+        self.next_attempt = now + datetime.timedelta(seconds=self.get_retry_delay())
+        return True
+
+
+class InboundBacklink(RetryMixin, models.Model):
     """
     A record of a link from an external resource to an internal resource.
 
     """
     APPROVED_STATUS = 1
     UNAPPROVED_STATUS = 2
+    PENDING_STATUS = 3
 
     STATUS_CHOICES = (
         (APPROVED_STATUS, _('approved')),
         (UNAPPROVED_STATUS, _('unapproved')),
+        (PENDING_STATUS, _('pending verification')),
     )
 
     source_url = models.URLField(_('linking resource identifier'))
     target_url = models.URLField(_('linked resource identifier'), verify_exists=False)
+    source_url_hash = URLHashField('source_url')
+    target_url_hash = URLHashField('target_url')
     received = models.DateTimeField(_('received'), default=datetime.datetime.now)
     title = models.CharField(_('title of linking resource'), max_length=1024, blank=True)
     excerpt = models.TextField(_('excerpt from linking resource'), blank=True)
     status = models.PositiveIntegerField(_('status'), choices=STATUS_CHOICES, default=UNAPPROVED_STATUS)
     protocol = models.CharField(_('protocol'), max_length=32, blank=True)
+    claimed_by = models.CharField(_('claimed by worker'), max_length=128, blank=True)
+    claimed_at = models.DateTimeField(_('claimed'), blank=True, null=True)
+    num_attempts = models.PositiveIntegerField(_('number of verification attempts'), default=0)
+    next_attempt = models.DateTimeField(_('next verification attempt'), blank=True, null=True)
 
     # Target object
     content_type = models.ForeignKey(ContentType, blank=True, null=True)
@@ -41,13 +87,16 @@ class InboundBacklink(models.Model):
         verbose_name_plural = _('inbound backlinks')
         ordering = ['-received']
         get_latest_by = 'received'
+        # Composite indexes which Meta cannot declare are created by
+        # sql/inboundbacklink.sql, or by the South migrations
+        unique_together = (('source_url_hash', 'target_url_hash', 'content_type', 'object_id'),)
 
 
     def __unicode__(self):
         return _('Inbound backlink from %s to %s') % (self.source_uri, self.target_object or self.target_uri)
 
 
-class OutboundBacklink(models.Model):
+class OutboundBacklink(RetryMixin, models.Model):
     """
     A record of a link from an internal resource to an external resource.
 
@@ -63,6 +112,9 @@ class OutboundBacklink(models.Model):
     )
 
     target_url = models.URLField(_('linked resource'))
+    # Keyed by the canonical form of the target URL, while the URL itself
+    # is kept as linked, to be fetched and pinged
+    target_url_hash = URLHashField('target_url', canonical=True)
     source_url = models.URLField(_('linking resource'))
     sent = models.DateTimeField(_('sent'), default=datetime.datetime.now)
     title = models.CharField(_('sent title'), max_length=1024, blank=True)
@@ -70,14 +122,20 @@ class OutboundBacklink(models.Model):
     protocol = models.CharField(_('protocol'), max_length=32, blank=True)
     status = models.PositiveIntegerField(_('status'), choices=STATUS_CHOICES)
     message = models.CharField(_('server response message'), max_length=1024, blank=True)
+    claimed_by = models.CharField(_('claimed by worker'), max_length=128, blank=True)
+    claimed_at = models.DateTimeField(_('claimed'), blank=True, null=True)
+    num_attempts = models.PositiveIntegerField(_('number of attempts'), default=0)
+    next_attempt = models.DateTimeField(_('next attempt'), blank=True, null=True)
 
     # Source object
     content_type = models.ForeignKey(ContentType, blank=True, null=True)
     object_id = models.PositiveIntegerField(blank=True, null=True)
     source_object = generic.GenericForeignKey('content_type', 'object_id')
 
+    objects = OutboundBacklinkManager()
+
+    class Meta:
+        unique_together = (('content_type', 'object_id', 'target_url_hash'),)
+
     def __unicode__(self):
         return _('Outbound backlink from %s to %s') % (self.source_object or self.source_uri, self.target_uri)
-
-    def increment_attempts(self):
-        self.num_attempts = self.num_attempts + 1
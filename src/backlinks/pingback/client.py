@@ -1,29 +1,74 @@
 import re
 import xmlrpclib
 import urllib
+import urllib2
+import urlparse
 
 from backlinks.exceptions import fault_code_to_client_error, \
     BacklinkClientError, BacklinkClientRemoteError, \
     BacklinkClientConnectionError, BacklinkClientServerDoesNotExist,\
     BacklinkClientAccessDenied, BacklinkClientInvalidResponse
 from backlinks.conf import settings
-from backlinks.utils import url_reader
+from backlinks.utils import url_reader, parse_link_header
+from backlinks.utils.connections import ConnectionPool
+from backlinks.utils.urlreader import TimeoutHTTPConnection, TimeoutHTTPSConnection
 
 # See http://hixie.ch/specs/pingback/pingback#TOC2.3
 PINGBACK_RE = re.compile(r'<link rel="pingback" href="(?P<pingback_url>[^"]+)" ?/?>')
+# The Pingback link element must appear in the document head
+HEAD_END_RE = re.compile(r'</head\s*>|<body[\s>]', re.IGNORECASE)
 
 
-# Override the user agent for xmlrpclib's ServerProxy
+# Override the user agent for xmlrpclib's ServerProxy, and keep a single
+# persistent connection with connect and read timeouts
 class BacklinksTransport(xmlrpclib.Transport):
     user_agent = settings.USER_AGENT_STRING
+    connection_class = TimeoutHTTPConnection
 
-class BacklinksSafeTransport(xmlrpclib.SafeTransport):
-    user_agent = settings.USER_AGENT_STRING
+    def __init__(self, use_datetime=0, connect_timeout=None, read_timeout=None):
+        xmlrpclib.Transport.__init__(self, use_datetime)
+        self.connect_timeout = connect_timeout or settings.PINGBACK_CONNECT_TIMEOUT
+        self.read_timeout = read_timeout or settings.PINGBACK_READ_TIMEOUT
+
+    def get_connection_kwargs(self, x509):
+        return {}
+
+    def make_connection(self, host):
+        if self._connection and host == self._connection[0]:
+            return self._connection[1]
+        chost, self._extra_headers, x509 = self.get_host_info(host)
+        connection = self.connection_class(chost,
+                                           connect_timeout=self.connect_timeout,
+                                           read_timeout=self.read_timeout,
+                                           **self.get_connection_kwargs(x509))
+        self._connection = host, connection
+        return connection
+
+class BacklinksSafeTransport(BacklinksTransport):
+    connection_class = TimeoutHTTPSConnection
+
+    def get_connection_kwargs(self, x509):
+        kwargs = dict(x509 or {})
+        if getattr(self, 'context', None) is not None:
+            kwargs['context'] = self.context
+        return kwargs
+
+# Idle transports, and so their connections, are kept for reuse by host
+transport_pool = ConnectionPool(settings.CONNECTION_POOL_SIZE,
+                                settings.CONNECTION_POOL_IDLE_TIMEOUT)
 
 # Build a nice ServerProxy replacement that will use our transport classes
 class BacklinksServerProxy(xmlrpclib.ServerProxy):
+    """
+    An ``xmlrpclib.ServerProxy`` replacement. Unless a transport is given,
+    requests are made through a transport taken from ``transport_pool`` for
+    the server's host, so that pings to the same host reuse a persistent
+    connection.
+
+    """
     transport_class = BacklinksTransport
     safe_transport_class = BacklinksSafeTransport
+    transport_pool = transport_pool
 
     def __init__(self, uri, transport=None, encoding=None, verbose=0,
                  allow_none=0, use_datetime=0):
@@ -34,11 +79,8 @@ class BacklinksServerProxy(xmlrpclib.ServerProxy):
         if not self.__handler:
             self.__handler = "/RPC2"
 
-        if transport is None:
-            if type == "https":
-                transport = self.safe_transport_class(use_datetime=use_datetime)
-            else:
-                transport = self.transport_class(use_datetime=use_datetime)
+        self.__type = type
+        self.__use_datetime = use_datetime
         self.__transport = transport
 
         self.__encoding = encoding
@@ -51,18 +93,34 @@ class BacklinksServerProxy(xmlrpclib.ServerProxy):
         request = xmlrpclib.dumps(params, methodname, encoding=self.__encoding,
                                   allow_none=self.__allow_none)
 
-        response = self.__transport.request(
-            self.__host,
-            self.__handler,
-            request,
-            verbose=self.__verbose
-            )
+        transport = self.__transport
+        if transport is None:
+            key = (self.__type, self.__host)
+            transport = self.transport_pool.get(key) or self.make_transport()
+        try:
+            response = transport.request(
+                self.__host,
+                self.__handler,
+                request,
+                verbose=self.__verbose
+                )
+        except Exception:
+            if self.__transport is None:
+                transport.close()
+            raise
+        if self.__transport is None:
+            self.transport_pool.put(key, transport)
 
         if len(response) == 1:
             response = response[0]
 
         return response
 
+    def make_transport(self):
+        if self.__type == "https":
+            return self.safe_transport_class(use_datetime=self.__use_datetime)
+        return self.transport_class(use_datetime=self.__use_datetime)
+
     def __repr__(self):
         return (
             "<ServerProxy for %s%s>" %
@@ -76,6 +134,35 @@ class BacklinksServerProxy(xmlrpclib.ServerProxy):
         return xmlrpclib._Method(self.__request, name)
 
 
+class PingbackMarkupScanner(object):
+    """
+    Incrementally searches a markup document for a Pingback ``link``
+    element. ``feed`` is called with each newly read chunk of the document,
+    which is searched along with the end of the previous chunks. The search
+    is ``finished`` once the element or the end of the document head has
+    been found.
+
+    """
+    # Longest tag assumed to straddle two reads
+    OVERLAP = 1024
+
+    def __init__(self):
+        self.tail = ''
+        self.finished = False
+        self.result = None
+
+    def feed(self, chunk):
+        markup = self.tail + chunk
+        self.tail = markup[-self.OVERLAP:]
+        head_end = HEAD_END_RE.search(markup)
+        match = PINGBACK_RE.search(markup)
+        if match and (not head_end or match.start() < head_end.start()):
+            self.result = match.group('pingback_url')
+        if self.result or head_end:
+            self.finished = True
+        return self.result
+
+
 class PingbackClient(object):
     """
     A client for the Pingback protocol.
@@ -87,18 +174,62 @@ class PingbackClient(object):
     def __init__(self, proxy_class=None):
         self.proxy_class = proxy_class or self.proxy_class
 
+    def autodiscover_headers(self, link, response):
+        """
+        Determine the Pingback server URL for a resource from the
+        ``X-Pingback`` or ``Link: <...>; rel="pingback"`` headers of a
+        response, without reading its body.
+
+        """
+        pingback_url = response.headers.getheader('x-pingback', None)
+        if not pingback_url:
+            for url, rels in parse_link_header(response.headers.getheader('link', None)):
+                if 'pingback' in rels:
+                    pingback_url = urlparse.urljoin(response.url, url)
+                    break
+        return pingback_url
+
+    def get_markup_scanner(self, link):
+        """
+        Return an object for incrementally searching a resource's markup for
+        its Pingback server URL.
+
+        """
+        return PingbackMarkupScanner()
+
     def autodiscover(self, link, response):
         """
         Determine the Pingback server URL for a given response for a resource.
 
         """
-        pingback_url = response.headers.getheader('x-pingback', None)
+        pingback_url = self.autodiscover_headers(link, response)
         if not pingback_url:
-            match = PINGBACK_RE.search(response.body)
-            if match:
-                pingback_url = match.group('pingback_url')
+            pingback_url = self.get_markup_scanner(link).feed(response.body)
         return pingback_url
 
+    def get_fault_error(self, fault):
+        """
+        Return the ``BacklinkClientError`` for an XML-RPC fault.
+
+        """
+        exception_class = fault_code_to_client_error.get(int(fault.faultCode),
+                                                         BacklinkClientError)
+        return exception_class(reason=fault.faultString)
+
+    def get_protocol_error(self, code, message):
+        """
+        Return the ``BacklinkClientError`` for an HTTP error response from
+        the Pingback server.
+
+        """
+        if code == 404:
+            return BacklinkClientServerDoesNotExist()
+        elif code == 500:
+            return BacklinkClientRemoteError()
+        elif code in (401, 403):
+            return BacklinkClientAccessDenied()
+        return BacklinkClientConnectionError(reason=message)
+
     def ping(self, ping_url, target_url, source_url, verbose=False, *args, **kwargs):
         """
         Attempt to ping a resource using the given Pingback server URL.
@@ -109,21 +240,50 @@ class PingbackClient(object):
             result = server.pingback.ping(source_url, target_url)
             return True
         except xmlrpclib.Fault, e:
-            exception_class = fault_code_to_client_error.get(int(e.faultCode),
-                                                             BacklinkClientError)
-            raise exception_class(reason=e.faultString)
+            raise self.get_fault_error(e)
         except xmlrpclib.ProtocolError, e:
-            if e.errcode == 404:
-                raise BacklinkClientServerDoesNotExist
-            elif e.errcode == 500:
-                raise BacklinkClientRemoteError
-            elif e.errcode in (401, 403):
-                raise BacklinkClientAccessDenied
-            raise BacklinkClientConnectionError(reason=e.errmsg)
+            raise self.get_protocol_error(e.errcode, e.errmsg)
         except xmlrpclib.ResponseError, e:
             raise BacklinkClientInvalidResponse(reason=e.message)
         except Exception, e:
             raise BacklinkClientError(reason=str(e))
 
-# A default instance of the Pingback client for convenience.
+
+class AsyncPingbackClient(PingbackClient):
+    """
+    A Pingback client which sends pings through an ``AsyncURLReader``.
+
+    """
+    def ping_async(self, reader, ping_url, target_url, source_url,
+                   callback=None, errback=None, *args, **kwargs):
+        """
+        Schedule a Pingback ping on the given ``AsyncURLReader``.
+        ``callback`` is called with ``True`` upon success, and ``errback``
+        with the appropriate ``BacklinkClientError`` upon failure.
+
+        """
+        callback = callback or (lambda result: None)
+        errback = errback or (lambda error: None)
+        request_body = xmlrpclib.dumps((source_url, target_url), 'pingback.ping',
+                                       encoding='utf-8')
+
+        def handle_response(response):
+            try:
+                xmlrpclib.loads(response.body)
+            except xmlrpclib.Fault, e:
+                return errback(self.get_fault_error(e))
+            except Exception, e:
+                return errback(BacklinkClientInvalidResponse(reason=str(e)))
+            callback(True)
+
+        def handle_error(error):
+            if isinstance(error, urllib2.HTTPError):
+                return errback(self.get_protocol_error(error.code, error.msg))
+            errback(BacklinkClientConnectionError(reason=str(error)))
+
+        reader.open(ping_url, request_body, {'Content-Type': 'text/xml'},
+                    callback=handle_response, errback=handle_error)
+
+# Default instances of the Pingback clients for convenience.
 default_client = PingbackClient()
+default_async_client = AsyncPingbackClient()
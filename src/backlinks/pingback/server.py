@@ -2,15 +2,48 @@ import xmlrpclib
 import urlparse
 
 from django.http import HttpResponse, HttpResponseNotAllowed
-from django.core.urlresolvers import resolve, Resolver404, \
+from django.core.urlresolvers import get_resolver, Resolver404, \
     reverse, NoReverseMatch
+try:
+    from django.core.urlresolvers import get_urlconf
+except ImportError:
+    # Django < 1.1 has no per-request URLconfs
+    get_urlconf = lambda: None
 from django.core.exceptions import ObjectDoesNotExist
+from django.db.models.signals import post_save, post_delete
 from django.utils.functional import update_wrapper
 
 from backlinks.server import BacklinksServer
 from backlinks.exceptions import BacklinkServerError, BacklinkTargetDoesNotExist, \
     BacklinkTargetNotPingable, BacklinkSourceDoesNotExist
-from backlinks.utils import get_site_absolute_uri
+from backlinks.conf import settings
+from backlinks.utils import get_site_absolute_uri, canonicalize_url
+from backlinks.utils.cache import LRUCache
+
+class TargetResolution(object):
+    """
+    The registered view a target URI resolves to, with the arguments it
+    was resolved with and the view's object lookup and validator.
+
+    """
+    def __init__(self, target_uri, view, args, kwargs, target_lookup, target_validator):
+        self.target_uri = target_uri
+        self.view = view
+        self.args = args
+        self.kwargs = kwargs
+        self.target_lookup = target_lookup
+        self.target_validator = target_validator
+
+    def get_target_object(self):
+        try:
+            return self.target_lookup(*self.args, **self.kwargs)
+        except ObjectDoesNotExist:
+            raise BacklinkTargetDoesNotExist
+
+    def validate_target(self, target_object):
+        if not self.target_validator(self.target_uri, target_object):
+            raise BacklinkTargetNotPingable
+
 
 class PingbackServer(BacklinksServer):
     """
@@ -28,6 +61,15 @@ class PingbackServer(BacklinksServer):
         self._path = path
         self._absolute_uri = absolute_uri
         self._view_registry = {}
+        self._resolver = None
+        self._resolve_cache = None
+        if settings.RESOLVE_CACHE_SIZE:
+            self._resolve_cache = LRUCache(settings.RESOLVE_CACHE_SIZE)
+        self._pingable_cache = None
+        if settings.PINGABLE_CACHE_SIZE and settings.PINGABLE_CACHE_TIMEOUT:
+            self._pingable_cache = LRUCache(settings.PINGABLE_CACHE_SIZE,
+                                            settings.PINGABLE_CACHE_TIMEOUT)
+        self._watched_models = set()
 
     def get_path(self):
         """
@@ -69,13 +111,12 @@ class PingbackServer(BacklinksServer):
             response = view(request, *args, **kwargs)
             absolute_uri = self.get_absolute_uri(request)
             if absolute_uri:
-                try:
-                    target_uri = request.build_absolute_uri()
-                    target_object = self.get_target_object(target_uri)
-                    self.validate_target(target_uri, target_object)
+                target_uri = request.build_absolute_uri()
+                # The view's own arguments spare resolving the URI again
+                resolution = TargetResolution(target_uri, wrapper, args, kwargs,
+                                              target_lookup, target_validator)
+                if self.is_pingable(target_uri, resolution):
                     response['X-Pingback'] = absolute_uri
-                except BacklinkServerError:
-                    pass
             return response
         wrapper = update_wrapper(wrapper, view)
         self.add_view_to_registry(wrapper, target_lookup, target_validator)
@@ -83,19 +124,35 @@ class PingbackServer(BacklinksServer):
 
     def lookup_view(self, target_uri):
         """
-        Look up a view in the server's registry.
+        Resolve the path of a target URI to a (view, args, kwargs) tuple.
+
+        Results are kept in an LRU cache of ``RESOLVE_CACHE_SIZE`` paths,
+        which is cleared whenever the URLconf in use is reloaded or
+        replaced.
 
         """
-        parsed_uri = urlparse.urlsplit(target_uri)
+        path = urlparse.urlsplit(target_uri)[2]
+        resolver = get_resolver(get_urlconf())
+        cache = self._resolve_cache
+        if cache is not None:
+            if resolver is not self._resolver:
+                cache.clear()
+                self._resolver = resolver
+            result = cache.get(path)
+            if result is not None:
+                return result
         try:
-            view, args, kwargs = resolve(parsed_uri.path)
+            view, args, kwargs = resolver.resolve(path)
         except Resolver404:
             raise BacklinkTargetDoesNotExist
+        if cache is not None:
+            cache.set(path, (view, args, kwargs))
         return view, args, kwargs
 
-    def get_target_object(self, target_uri, *args, **kwargs):
+    def resolve_target(self, target_uri):
         """
-        Look up a target object from an absolute URI.
+        Resolve a target URI to the ``TargetResolution`` of its registered
+        view.
 
         """
         view, args, kwargs = self.lookup_view(target_uri)
@@ -103,24 +160,88 @@ class PingbackServer(BacklinksServer):
             target_lookup, target_validator = self._view_registry[view]
         except KeyError:
             raise BacklinkTargetNotPingable
-        try:
-            return target_lookup(*args, **kwargs)
-        except ObjectDoesNotExist:
-            raise BacklinkTargetDoesNotExist
+        return TargetResolution(target_uri, view, args, kwargs,
+                                target_lookup, target_validator)
+
+    def get_target(self, target_uri=None, target_object=None):
+        """
+        Resolve a target URI once, and use the resolution both to look up
+        and to validate the target object.
+
+        """
+        if target_uri and not target_object:
+            self.validate_target_uri(target_uri)
+            resolution = self.resolve_target(target_uri)
+            target_object = resolution.get_target_object()
+            resolution.validate_target(target_object)
+            return target_uri, target_object
+        return super(PingbackServer, self).get_target(target_uri, target_object)
+
+    def get_target_object(self, target_uri, *args, **kwargs):
+        """
+        Look up a target object from an absolute URI.
+
+        """
+        return self.resolve_target(target_uri).get_target_object()
 
     def validate_target(self, target_uri, target_object):
         """
         Validate a target object.
 
         """
-        view, args, kwargs = self.lookup_view(target_uri)
+        self.resolve_target(target_uri).validate_target(target_object)
+
+
+    def is_pingable(self, target_uri, resolution=None):
+        """
+        Return whether a target URI is pingable, given its
+        ``TargetResolution`` if already known.
+
+        Answers are kept in an LRU cache of ``PINGABLE_CACHE_SIZE`` target
+        URIs for ``PINGABLE_CACHE_TIMEOUT`` seconds, and the cache is
+        cleared whenever an instance of a model found as a target is saved
+        or deleted. Targets whose lookup found no object are not cached, as
+        no model is known to watch for the object being created.
+
+        """
+        key = canonicalize_url(target_uri)
+        cache = self._pingable_cache
+        if cache is not None:
+            pingable = cache.get(key)
+            if pingable is not None:
+                return pingable
+        target_object = None
         try:
-            target_lookup, target_validator = self._view_registry[view]
-            if not target_validator(target_uri, target_object):
-                raise BacklinkTargetNotPingable
-        except KeyError:
-            raise BacklinkTargetNotPingable
+            if resolution is None:
+                resolution = self.resolve_target(target_uri)
+            target_object = resolution.get_target_object()
+            resolution.validate_target(target_object)
+            pingable = True
+        except BacklinkTargetDoesNotExist:
+            return False
+        except BacklinkServerError:
+            pingable = False
+        if cache is not None:
+            if target_object is not None:
+                self.watch_target_model(target_object.__class__)
+            cache.set(key, pingable)
+        return pingable
+
+    def watch_target_model(self, model):
+        """
+        Clear the cached pingability of targets whenever an instance of the
+        given model is saved or deleted.
+
+        """
+        if model in self._watched_models:
+            return
+        self._watched_models.add(model)
+        post_save.connect(self.target_changed, sender=model)
+        post_delete.connect(self.target_changed, sender=model)
 
+    def target_changed(self, sender, **kwargs):
+        if self._pingable_cache is not None:
+            self._pingable_cache.clear()
 
     def xmlrpc_dispatch(self, request):
         """
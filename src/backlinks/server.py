@@ -1,4 +1,8 @@
+import os
 import re
+import sys
+import socket
+import httplib
 import urllib2
 from urlparse import urljoin
 
@@ -7,15 +11,18 @@ try:
 except ImportError:
     from django.core.validators import URLValidator
     url_re = URLValidator.regex
-from django.contrib.contenttypes.models import ContentType
+from django.db import transaction, IntegrityError
+from django.core.urlresolvers import get_mod_func
 
 from backlinks.exceptions import BacklinkServerError, \
     BacklinkTargetDoesNotExist, BacklinkSourceDoesNotExist, \
-    BacklinkSourceDoesNotLink, BacklinkAlreadyRegistered
+    BacklinkSourceDoesNotLink, BacklinkAlreadyRegistered, \
+    BacklinkSourceUnavailable
 from backlinks.models import InboundBacklink
 from backlinks.conf import settings
 from backlinks.utils import get_site_absolute_uri, url_reader, \
-    document_has_target_link, parse_title, parse_excerpt
+    ParsedDocument, SourceDocument
+from backlinks.utils.cache import get_default_source_cache
 
 
 INVALID_SOURCE_CONTENT_TYPE_RE = re.compile('(audio|image|video|model)', re.IGNORECASE)
@@ -27,6 +34,7 @@ class BacklinksServer(object):
 
     """
     url_reader = url_reader
+    source_cache = None
     protocol = ''
 
     def __init__(self):
@@ -52,7 +60,7 @@ class BacklinksServer(object):
             raise BacklinkTargetDoesNotExist
 
         if not target_uri.startswith(get_site_absolute_uri()):
-            raise BacklinkServerTargetDoesNotExist
+            raise BacklinkTargetDoesNotExist
 
     def validate_source_uri(self, source_uri):
         """
@@ -93,42 +101,77 @@ class BacklinksServer(object):
         """
         raise NotImplementedError
 
+    def get_target(self, target_uri=None, target_object=None):
+        """
+        Given a target URI or a target object, return the validated
+        (target-uri, target-object) pair of a ping.
+
+        """
+        if not target_uri and not target_object:
+            raise BacklinkTargetDoesNotExist
+        elif target_uri and not target_object:
+            self.validate_target_uri(target_uri)
+            target_object = self.get_target_object(target_uri)
+        else:
+            target_uri = self.get_target_uri(target_object)
+        self.validate_target(target_uri, target_object)
+        return target_uri, target_object
+
     def validate_unregistered(self, source_uri, target_uri, target_object):
         """
         Ensure a ping with the given parameters has not been registered.
 
         """
-        target_content_type = None
-        try:
-            target_content_type = ContentType.objects.get_for_model(target_object)
-        except (AttributeError, ContentType.DoesNotExist):
-            pass
+        if InboundBacklink.objects.is_registered(source_uri, target_uri, target_object):
+            raise BacklinkAlreadyRegistered
+
+    def save_backlink(self, backlink):
+        """
+        Save a new ``InboundBacklink`` record, raising
+        ``BacklinkAlreadyRegistered`` if a concurrent ping recorded the same
+        backlink first.
+
+        """
+        sid = transaction.savepoint()
         try:
-            if target_content_type:
-                backlink = InboundBacklink.objects.get(source_url=source_uri,
-                                                       target_url=target_uri,
-                                                       content_type=target_content_type,
-                                                       object_id=target_object.pk)
-            else:
-                backlink = InboundBacklink.objects.get(source_url=source_uri,
-                                                       target_url=target_uri)
+            backlink.save()
+        except IntegrityError:
+            transaction.savepoint_rollback(sid)
             raise BacklinkAlreadyRegistered
-        except InboundBacklink.DoesNotExist:
-            pass
+        transaction.savepoint_commit(sid)
+
+    def get_source_cache(self):
+        """
+        Return the ``SourceCache`` holding fetched source documents, which
+        is shared by all servers unless one was set.
+
+        """
+        if self.source_cache is None:
+            return get_default_source_cache()
+        return self.source_cache
 
     def get_source(self, source_uri):
         """
-        Retrieve and return a handle to the given source resource.
+        Retrieve and return the given source resource as a
+        ``SourceDocument``, sharing recent and in-progress fetches of the
+        same source between pings.
+
+        """
+        return self.get_source_cache().get(source_uri, self.fetch_source)
+
+    def fetch_source(self, source_uri):
+        """
+        Retrieve the given source resource.
 
         """
         try:
-            return self.url_reader.open(source_uri)
+            return SourceDocument(self.url_reader.open(source_uri))
         except urllib2.HTTPError, e:
-            if e.code == 404:
+            if e.code in (404, 410):
                 raise BacklinkSourceDoesNotExist
-            raise BacklinkServerError('Could not connect to given source')
-        except (urllib2.URLError, IOError):
-            raise BacklinkServerError
+            raise BacklinkSourceUnavailable('Could not connect to given source')
+        except (urllib2.URLError, IOError, httplib.HTTPException):
+            raise BacklinkSourceUnavailable
 
     def validate_source_is_markup(self, source):
         """
@@ -144,7 +187,7 @@ class BacklinksServer(object):
         Ensure the source markup document links to the target resource.
 
         """
-        if not document_has_target_link(source.body, target_uri):
+        if not source.has_link(target_uri):
             raise BacklinkSourceDoesNotLink
 
     def validate_source(self, source, target_uri):
@@ -155,19 +198,25 @@ class BacklinksServer(object):
         self.validate_source_is_markup(source)
         self.validate_source_links(source, target_uri)
 
-    def get_title(self, markup, charset=None):
+    def get_title(self, markup, charset=None, document=None):
         """
-        Return a title parsed from the given markup.
+        Return a title parsed from the given markup, or taken from its
+        ``ParsedDocument`` if given.
 
         """
-        return parse_title(markup, charset)
+        if document is None:
+            document = ParsedDocument(markup, charset)
+        return document.title
 
-    def get_excerpt(self, markup, target_url, charset=None):
+    def get_excerpt(self, markup, target_url, charset=None, document=None):
         """
-        Return a contextual excerpt parsed from the given markup.
+        Return a contextual excerpt parsed from the given markup, or taken
+        from its ``ParsedDocument`` if given.
 
         """
-        return parse_excerpt(markup, target_url, settings.MAX_EXCERPT_WORDS, charset)
+        if document is None:
+            document = ParsedDocument(markup, charset)
+        return document.get_excerpt(target_url, settings.MAX_EXCERPT_WORDS)
 
     def record_successful_ping(self, source_uri, target_uri,
                                target_object=None,
@@ -183,7 +232,7 @@ class BacklinksServer(object):
         backlink.excerpt = excerpt
         backlink.protocol = self.protocol
         backlink.target_object = target_object
-        backlink.save()
+        self.save_backlink(backlink)
 
     def record_unsuccessful_ping(self, source_uri, target_uri,
                                  target_object=None,
@@ -194,29 +243,152 @@ class BacklinksServer(object):
         """
         pass
 
+    def record_pending_ping(self, source_uri, target_uri,
+                            target_object=None,
+                            title='', excerpt=''):
+        """
+        Record a ping whose source is yet to be verified.
+
+        """
+        backlink = InboundBacklink()
+        backlink.source_url = source_uri
+        backlink.target_url = target_uri
+        backlink.title = title or ''
+        backlink.excerpt = excerpt or ''
+        backlink.protocol = self.protocol
+        backlink.status = InboundBacklink.PENDING_STATUS
+        backlink.target_object = target_object
+        self.save_backlink(backlink)
+
+    def get_worker_id(self):
+        """
+        Return a string identifying this process when claiming pending pings.
+
+        """
+        return '%s:%d' % (socket.gethostname(), os.getpid())
+
+    def verify_pending_ping(self, backlink):
+        """
+        Fetch and validate the source of a pending ``InboundBacklink``
+        record. The record is made an ordinary unapproved backlink if the
+        source is valid, or deleted if it is not. If the source could not
+        be fetched, the record is left pending for ``retry_pending_ping``.
+        Returns whether the source was valid.
+
+        """
+        source_uri, target_uri = backlink.source_url, backlink.target_url
+        try:
+            source = self.get_source(source_uri)
+            self.validate_source(source, target_uri)
+            if not backlink.title:
+                backlink.title = self.get_title(source.body, source.charset, source.document)
+            if not backlink.excerpt:
+                backlink.excerpt = self.get_excerpt(source.body, target_uri, source.charset,
+                                                    source.document)
+        except BacklinkSourceUnavailable, e:
+            self.retry_pending_ping(backlink, e.message)
+            return False
+        except BacklinkServerError, e:
+            self.record_unsuccessful_ping(source_uri, target_uri, backlink.target_object,
+                                          backlink.title, backlink.excerpt, e.message)
+            backlink.delete()
+            return False
+        backlink.status = InboundBacklink.UNAPPROVED_STATUS
+        backlink.claimed_by = ''
+        backlink.claimed_at = None
+        backlink.next_attempt = None
+        backlink.save()
+        return True
+
+    def retry_pending_ping(self, backlink, reason=''):
+        """
+        Release the claim on a pending ``InboundBacklink`` record whose
+        source could not be verified for a temporary reason, to be verified
+        again after the ``RETRY_DELAY`` backoff. The record is given up on,
+        and deleted, once ``RETRY_MAX_ATTEMPTS`` attempts have been made.
+
+        """
+        backlink.increment_attempts()
+        if not backlink.schedule_retry():
+            self.record_unsuccessful_ping(backlink.source_url, backlink.target_url,
+                                          backlink.target_object, backlink.title,
+                                          backlink.excerpt, reason)
+            backlink.delete()
+            return
+        backlink.claimed_by = ''
+        backlink.claimed_at = None
+        backlink.save()
+
+    def get_protocol_server(self, protocol):
+        """
+        Return the server which verifies pending pings received over the
+        given protocol: this server if it implements the protocol, else the
+        server installed for it in ``INSTALLED_SERVERS``, falling back to
+        this server.
+
+        """
+        if protocol == self.protocol:
+            return self
+        for name, server_name in settings.INSTALLED_SERVERS:
+            if name != protocol:
+                continue
+            try:
+                module_name, obj = get_mod_func(server_name)
+                mod = __import__(module_name)
+                return getattr(sys.modules[module_name], obj)
+            except (ImportError, AttributeError):
+                break
+        return self
+
+    def process_pending_pings(self, batch_size=None, worker_id=None):
+        """
+        Claim a batch of pending ``InboundBacklink`` records, recorded by
+        ``register_ping`` when verification is deferred, and verify each
+        with the server for its protocol. Returns the number of records
+        processed.
+
+        """
+        backlinks = InboundBacklink.objects.claim_pending(worker_id or self.get_worker_id(),
+                                                          batch_size or settings.QUEUE_BATCH_SIZE,
+                                                          settings.QUEUE_CLAIM_TIMEOUT)
+        for backlink in backlinks:
+            server = self.get_protocol_server(backlink.protocol)
+            try:
+                server.verify_pending_ping(backlink)
+            except Exception, e:
+                # An unexpected error with one record must not leave the
+                # rest of the batch claimed, nor stop the worker for good
+                server.retry_pending_ping(backlink, repr(e))
+        return len(backlinks)
+
     def register_ping(self, source_uri, target_uri=None, target_object=None,
-                      title='', excerpt=''):
+                      title='', excerpt='', defer=None):
         """
         Validate ping parameters and record the attempt.
 
+        If ``defer`` (or the ``DEFER_PING_VERIFICATION`` setting) is true,
+        the source is not fetched: the ping is recorded as pending, to be
+        verified later by ``process_pending_pings``.
+
         """
+        if defer is None:
+            defer = settings.DEFER_PING_VERIFICATION
         try:
             self.validate_source_uri(source_uri)
-            if not target_uri and not target_object:
-                raise BacklinkServerTargetDoesNotExist
-            elif target_uri and not target_object:
-                self.validate_target_uri(target_uri)
-                target_object = self.get_target_object(target_uri)
-            else:
-                target_uri = self.get_target_uri(target_object)
-            self.validate_target(target_uri, target_object)
+            target_uri, target_object = self.get_target(target_uri, target_object)
             self.validate_unregistered(source_uri, target_uri, target_object)
+            if defer:
+                self.record_pending_ping(source_uri,
+                                         target_uri, target_object,
+                                         title, excerpt)
+                return 'Ping from %s to %s accepted' % (source_uri, target_uri)
             source = self.get_source(source_uri)
             self.validate_source(source, target_uri)
             if not title:
-                title = self.get_title(source.body, source.charset)
+                title = self.get_title(source.body, source.charset, source.document)
             if not excerpt:
-                excerpt = self.get_excerpt(source.body, target_uri, source.charset)
+                excerpt = self.get_excerpt(source.body, target_uri, source.charset,
+                                           source.document)
             self.record_successful_ping(source_uri,
                                         target_uri, target_object,
                                         title, excerpt)
@@ -0,0 +1 @@
+CREATE INDEX backlinks_inboundbacklink_target_status ON backlinks_inboundbacklink (content_type_id, object_id, status, received);
@@ -2,7 +2,7 @@ import unittest
 
 from backlinks.tests.server import PingbackServerTestCase, TrackBackServerTestCase
 from backlinks.tests.client import PingbackClientTestCase, TrackBackClientTestCase, \
-    BacklinksClientTestCase
+    BacklinksClientTestCase, PersistentConnectionTestCase, AsyncBacklinksClientTestCase
 
 def suite():
     suite = unittest.TestSuite()
@@ -15,6 +15,8 @@ def suite():
     suite.addTest(PingbackServerTestCase('testNonExistentRPCMethod'))
     suite.addTest(PingbackServerTestCase('testBadPostData'))
     suite.addTest(PingbackServerTestCase('testPingbackResponseHeader'))
+    suite.addTest(PingbackServerTestCase('testPingbackResponseHeaderCache'))
+    suite.addTest(PingbackServerTestCase('testPingableCacheLookupMiss'))
     suite.addTest(PingbackServerTestCase('testPingNonExistentTargetURI'))
     suite.addTest(PingbackServerTestCase('testPingNonPingableTargetURI'))
     suite.addTest(PingbackServerTestCase('testPingNonExistentSourceURI'))
@@ -22,6 +24,12 @@ def suite():
     suite.addTest(PingbackServerTestCase('testPingNonLinkingSourceURI'))
     suite.addTest(PingbackServerTestCase('testPingSourceURILinks'))
     suite.addTest(PingbackServerTestCase('testPingAlreadyRegistered'))
+    suite.addTest(PingbackServerTestCase('testTargetResolution'))
+    suite.addTest(PingbackServerTestCase('testSourceCache'))
+    suite.addTest(PingbackServerTestCase('testDeferredPingVerification'))
+    suite.addTest(PingbackServerTestCase('testDeferredPingRetry'))
+    suite.addTest(PingbackServerTestCase('testDeferredPingProtocolServer'))
+    suite.addTest(PingbackServerTestCase('testDuplicatePing'))
     suite.addTest(PingbackServerTestCase('testPingbackLinkTemplateTag'))
     # TrackBack Server Tests
     suite.addTest(TrackBackServerTestCase('testDisallowedMethod'))
@@ -46,5 +54,42 @@ def suite():
     suite.addTest(TrackBackClientTestCase('testSuccessfulPing'))
     # BacklinksClient Tests
     suite.addTest(BacklinksClientTestCase('testClientLoad'))
+    suite.addTest(BacklinksClientTestCase('testCanonicalLinks'))
+    suite.addTest(BacklinksClientTestCase('testParsedDocument'))
+    suite.addTest(BacklinksClientTestCase('testParserBackends'))
+    suite.addTest(BacklinksClientTestCase('testChunkedUnterminatedComment'))
+    suite.addTest(BacklinksClientTestCase('testExternalLinksWithoutSite'))
+    suite.addTest(BacklinksClientTestCase('testLinkParser'))
+    suite.addTest(BacklinksClientTestCase('testDiscoverBacklinks'))
+    suite.addTest(BacklinksClientTestCase('testConcurrentDiscoverBacklinks'))
+    suite.addTest(BacklinksClientTestCase('testQueuedPingAll'))
+    suite.addTest(BacklinksClientTestCase('testIncrementalPingAll'))
+    suite.addTest(BacklinksClientTestCase('testPingLinkAsWritten'))
+    suite.addTest(BacklinksClientTestCase('testBulkSavePingRecords'))
+    suite.addTest(BacklinksClientTestCase('testConcurrentBulkSave'))
+    suite.addTest(BacklinksClientTestCase('testClaimPendingPings'))
+    suite.addTest(BacklinksClientTestCase('testRetryFailedPings'))
+    suite.addTest(BacklinksClientTestCase('testRetryDiscoveryFailures'))
+    suite.addTest(BacklinksClientTestCase('testRetryBackoff'))
+    suite.addTest(BacklinksClientTestCase('testDiscoveryCache'))
+    suite.addTest(BacklinksClientTestCase('testHeadRequestDiscovery'))
+    suite.addTest(BacklinksClientTestCase('testLinkHeaderDiscovery'))
+    suite.addTest(BacklinksClientTestCase('testStreamingDiscovery'))
+    suite.addTest(BacklinksClientTestCase('testRateLimiter'))
+    suite.addTest(BacklinksClientTestCase('testResponseBodyBuffer'))
+    suite.addTest(BacklinksClientTestCase('testDecompressingStream'))
+    suite.addTest(BacklinksClientTestCase('testLRUCache'))
+    # Persistent connection Tests
+    suite.addTest(PersistentConnectionTestCase('testConnectionReuse'))
+    suite.addTest(PersistentConnectionTestCase('testClosedConnectionRetry'))
+    suite.addTest(PersistentConnectionTestCase('testRequestTimeouts'))
+    suite.addTest(PersistentConnectionTestCase('testPingbackTransportReuse'))
+    suite.addTest(PersistentConnectionTestCase('testConnectionPool'))
+    # AsyncBacklinksClient Tests
+    suite.addTest(AsyncBacklinksClientTestCase('testAsyncURLReader'))
+    suite.addTest(AsyncBacklinksClientTestCase('testAsyncHostResolution'))
+    suite.addTest(AsyncBacklinksClientTestCase('testAsyncHTTPS'))
+    suite.addTest(AsyncBacklinksClientTestCase('testAsyncRateLimit'))
+    suite.addTest(AsyncBacklinksClientTestCase('testAsyncPingAll'))
     return suite
     
@@ -1,17 +1,42 @@
-from urllib import urlencode
+import datetime
+import gzip
+import httplib
+import socket
+import threading
+import time
+import zlib
+from StringIO import StringIO
+from urllib import urlencode, addinfourl
 from urllib2 import HTTPError
 
 from django import test
 from django.test.client import Client
+from django.contrib.sites.models import Site
 
 from backlinks.exceptions import BacklinkClientError,\
     BacklinkClientConnectionError, BacklinkClientRemoteError,\
     BacklinkClientServerDoesNotExist, BacklinkClientInvalidResponse,\
     BacklinkClientAlreadyRegistered
-from backlinks.client import BacklinksClient
-from backlinks.pingback.client import PingbackClient
+from backlinks.conf import settings
+from backlinks.models import OutboundBacklink
+from backlinks.fields import url_hash
+from backlinks.client import BacklinksClient, AsyncBacklinksClient, is_temporary_fetch_error, \
+    opener_supports_method
+from backlinks.utils import LimitedURLReader, LimitedAsyncURLReader, \
+    canonicalize_url, parse_external_links, ParsedDocument, url_reader
+from backlinks.utils.connections import ConnectionPool
+from backlinks.utils.urlreader import ResponseWrapper, DecompressingStream, \
+    DecompressionError
+from backlinks.utils.asyncreader import HostResolver
+from backlinks.utils.parsers import TOKENIZERS, DocumentParser, HttpLinkParser
+from backlinks.utils.ratelimit import HostRateLimiter
+from backlinks.utils.cache import LRUCache, DiscoveryCache, \
+    get_default_discovery_cache
+from backlinks.pingback.client import PingbackClient, transport_pool
 from backlinks.trackback.client import TrackBackClient
-from backlinks.tests.mock import mock_reader
+from backlinks.tests.mock import mock_reader, discovery_reader, \
+    DISCOVERY_SOURCE, NON_LINKING_SOURCE, PINGBACK_LINK_DOCUMENT, \
+    MockReader, MockHTTPServer, MockProtocolClient
 from backlinks.tests.xmlrpc import TestClientServerProxy
 
 class PingbackClientTestCase(test.TestCase):
@@ -125,9 +150,684 @@ class BacklinksClientTestCase(test.TestCase):
     urls = 'backlinks.tests.client_urls'
 
     def setUp(self):
+        get_default_discovery_cache().clear()
         self.backlinks_client = BacklinksClient()
+
+    def tearDown(self):
+        get_default_discovery_cache().clear()
     
     def testClientLoad(self):
         self.assertEquals(len(self.backlinks_client.clients),
                           2,
                           'BacklinksClient did not discover two protocol clients')
+
+    def testCanonicalLinks(self):
+        self.assertEquals(canonicalize_url('HTTP://Example.COM:80/a?utm_source=feed&id=1&fbclid=x#comments'),
+                          'http://example.com/a?id=1')
+        self.assertEquals(canonicalize_url('https://example.com:443'), 'https://example.com/')
+        self.assertEquals(canonicalize_url('http://example.com:8080/A?Q=1'), 'http://example.com:8080/A?Q=1')
+        markup = '<a href="http://Example.org/a#x">1</a> <a href="http://example.org/a">2</a> ' \
+                 '<a href="http://example.org/a?utm_source=rss">3</a> <a href="http://example.org/b">4</a>'
+        self.assertEquals(parse_external_links(markup), ['http://Example.org/a#x', 'http://example.org/b'],
+                          'parse_external_links did not keep the first of equivalent links as written')
+
+    def testParsedDocument(self):
+        document = self.backlinks_client.parse_document(DISCOVERY_SOURCE)
+        self.assertEquals(document.title, u'Test Discovery Source Document')
+        self.assertEquals(len(document.external_links), 5,
+                          'ParsedDocument did not exclude links to the current site')
+        excerpt = document.get_excerpt('http://trackback-rdf.com/entry/', 32)
+        self.assertTrue(u'three' in excerpt,
+                        'ParsedDocument did not build an excerpt around the link')
+        self.assertEquals(document.get_excerpt('http://Trackback-RDF.com/entry/#x', 32), excerpt,
+                          'ParsedDocument did not match the target link canonically')
+        self.assertEquals(self.backlinks_client.get_excerpt(document, 'http://trackback-rdf.com/entry/'),
+                          self.backlinks_client.get_excerpt(DISCOVERY_SOURCE, 'http://trackback-rdf.com/entry/'))
+        self.assertEquals(document.get_excerpt('http://unlinked.com/', 32), u'')
+
+    def testParserBackends(self):
+        markup = DISCOVERY_SOURCE + '<script>document.write("<a href=\'http://script.com/\'>")</script>' \
+                 '<p>Caf&eacute; &amp; <a href="http://example.org/?a=1&amp;b=2" title=x>bar</a></p>' \
+                 '<!-- a <a href="http://comment.com/">comment</a> > b --><br/><a href="http://c.com/">c</a>'
+        results = []
+        for backend in sorted(TOKENIZERS.keys()):
+            parser = DocumentParser(backend=backend)
+            parser.feed(markup)
+            parser.close()
+            results.append((parser.links, parser.get_title(), parser.parts))
+            # Feeding the markup in pieces gives the same result
+            parser = DocumentParser(backend=backend)
+            for i in range(0, len(markup), 7):
+                parser.feed(markup[i:i+7])
+            parser.close()
+            self.assertEquals((parser.links, ''.join(parser.parts)),
+                              (results[-1][0], ''.join(results[-1][2])),
+                              'The %s parser backend did not parse markup fed in pieces' % backend)
+        links, title, parts = results[0]
+        self.assertTrue('http://example.org/?a=1&amp;b=2' in links)
+        self.assertFalse('http://script.com/' in links)
+        self.assertFalse('http://comment.com/' in links)
+        self.assertTrue('http://c.com/' in links)
+        self.assertTrue(u'Caf\xe9 &amp; bar' in ''.join(parts))
+        for result in results[1:]:
+            self.assertEquals(result, results[0], 'The parser backends did not agree')
+        self.assertRaises(ValueError, DocumentParser, backend='unknown')
+
+    def testExternalLinksWithoutSite(self):
+        Site.objects.all().delete()
+        Site.objects.clear_cache()
+        self.assertRaises(Site.DoesNotExist, parse_external_links, DISCOVERY_SOURCE)
+
+    def testChunkedUnterminatedComment(self):
+        chunks = ['x' * 63 + ' ' for i in range(2000)] + ['<b>y</b> ' * 8 for i in range(200)]
+        markup = '<p><a href="http://a.com/">a</a></p><!-- ' + ''.join(chunks) + '<a href="http://b.com/">b</a>'
+        for backend in sorted(TOKENIZERS.keys()):
+            parser = DocumentParser(backend=backend)
+            start = time.time()
+            for i in range(0, len(markup), 64):
+                parser.feed(markup[i:i+64])
+            parser.close()
+            self.assertTrue(time.time() - start < 1,
+                            'The %s parser backend took quadratic time over an open comment' % backend)
+            whole = DocumentParser(backend=backend)
+            whole.feed(markup)
+            whole.close()
+            self.assertEquals((parser.links, ''.join(parser.parts)), (whole.links, ''.join(whole.parts)))
+            self.assertEquals(parser.links, ['http://a.com/'])
+
+    def testLinkParser(self):
+        markup = ''.join(['<a href="http://example.com/%d/">%d</a> <a href="/local/">l</a> ' % (i % 50, i)
+                          for i in range(200)])
+        self.assertEquals(HttpLinkParser().parse(markup),
+                          ['http://example.com/%d/' % i for i in range(50)],
+                          'HttpLinkParser did not keep the first-seen order of unique links')
+        parser = HttpLinkParser()
+        links = parser.iterparse(markup, chunk_size=64)
+        self.assertEquals(links.next(), 'http://example.com/0/')
+        self.assertTrue(len(parser.links) < 10,
+                        'HttpLinkParser.iterparse parsed beyond the first link found')
+
+    def testDiscoverBacklinks(self):
+        opened = []
+        def url_opener(url):
+            opened.append(url)
+            return discovery_reader.open(url)
+        client = BacklinksClient(url_opener=url_opener, discovery_cache=DiscoveryCache(0, 60, 60))
+        discovered = [(target_url, ping_url, name) for target_url, ping_url, c, name
+                      in client.discover_backlinks(DISCOVERY_SOURCE, workers=1)]
+        self.assertEquals(len(opened), 5)
+        self.assertEquals(discovered,
+                          [('http://pingback-header.com/entry/', 'http://pingback-header.com/xmlrpc/', 'pingback'),
+                           ('http://pingback-link.com/entry/', 'http://pingback-link.com/xmlrpc/', 'pingback'),
+                           ('http://trackback-rdf.com/entry/', 'http://trackback-rdf.com/trackback/1/', 'trackback')],
+                          'BacklinksClient did not discover the expected backlink servers')
+
+    def testConcurrentDiscoverBacklinks(self):
+        opened, active, max_active = [], [0], [0]
+        lock = threading.Lock()
+        def url_opener(url):
+            lock.acquire()
+            opened.append(url)
+            active[0] = active[0] + 1
+            max_active[0] = max(max_active[0], active[0])
+            lock.release()
+            try:
+                time.sleep(0.05)
+                return discovery_reader.open(url)
+            finally:
+                lock.acquire()
+                active[0] = active[0] - 1
+                lock.release()
+        client = BacklinksClient(url_opener=url_opener, discovery_cache=DiscoveryCache(0, 60, 60))
+        sequential = client.discover_backlinks(DISCOVERY_SOURCE, workers=1)
+        self.assertEquals((len(opened), max_active[0]), (5, 1))
+        concurrent = client.discover_backlinks(DISCOVERY_SOURCE, workers=4)
+        self.assertEquals(concurrent, sequential,
+                          'Concurrent discovery did not match sequential discovery')
+        self.assertEquals(len(opened), 10, 'Concurrent discovery did not fetch every link')
+        self.assertTrue(max_active[0] > 1, 'Links were not fetched concurrently')
+
+    def getRecordingClient(self):
+        clients = [('pingback', 'Pingback', MockProtocolClient(PingbackClient())),
+                   ('trackback', 'TrackBack', MockProtocolClient(TrackBackClient()))]
+        return BacklinksClient(clients=clients, url_opener=discovery_reader.open,
+                               rate_limiter=HostRateLimiter(None))
+
+    def testQueuedPingAll(self):
+        client = self.getRecordingClient()
+        client.ping_all(DISCOVERY_SOURCE, source_url='http://example.com/source/', defer=True)
+        self.assertEquals(OutboundBacklink.objects.pending().count(), 5,
+                          'ping_all did not queue a pending ping for every external link')
+        self.assertEquals(sum([len(c.pings) for n, d, c in client.clients]), 0,
+                          'ping_all sent pings when deferring')
+        self.assertEquals(client.process_pending_pings(batch_size=10), 5)
+        self.assertEquals(OutboundBacklink.objects.pending().count(), 0)
+        self.assertEquals(OutboundBacklink.objects.filter(status=OutboundBacklink.SUCCESSFUL_STATUS).count(), 3,
+                          'Processing the queue did not ping all discovered targets')
+        self.assertEquals(sum([len(c.pings) for n, d, c in client.clients]), 3)
+
+    def testIncrementalPingAll(self):
+        client = self.getRecordingClient()
+        source = Site.objects.get_current()
+        def count_pings():
+            return sum([len(c.pings) for n, d, c in client.clients])
+        client.ping_all(DISCOVERY_SOURCE, source_url='http://example.com/source/',
+                        source_object=source, incremental=True)
+        self.assertEquals(count_pings(), 3)
+        client.ping_all(DISCOVERY_SOURCE, source_url='http://example.com/source/',
+                        source_object=source, incremental=True)
+        self.assertEquals(count_pings(), 3,
+                          'Incremental ping_all pinged already pinged targets again')
+        OutboundBacklink.objects.filter(target_url='http://trackback-rdf.com/entry/')\
+            .update(status=OutboundBacklink.UNSUCCESSFUL_STATUS)
+        client.ping_all(DISCOVERY_SOURCE, source_url='http://example.com/source/',
+                        source_object=source, incremental=True)
+        self.assertEquals(count_pings(), 4,
+                          'Incremental ping_all did not retry a previously failed target')
+        client.ping_all(DISCOVERY_SOURCE, source_url='http://example.com/source/',
+                        source_object=source, incremental=False)
+        self.assertEquals(count_pings(), 7)
+
+    def testPingLinkAsWritten(self):
+        link = 'http://Pingback-Link.com/entry/?utm_source=feed#c'
+        reader = MockReader(url_mappings={link: (PINGBACK_LINK_DOCUMENT, None)})
+        recording_client = MockProtocolClient(PingbackClient())
+        client = BacklinksClient(clients=[('pingback', 'Pingback', recording_client)],
+                                 url_opener=reader.open, rate_limiter=HostRateLimiter(None))
+        source = Site.objects.get_current()
+        markup = '<a href="%s">one</a> <a href="http://pingback-link.com/entry/">two</a>' % link
+        client.ping_all(markup, source_url='http://example.com/source/', source_object=source)
+        self.assertEquals(recording_client.pings,
+                          [('http://pingback-link.com/xmlrpc/', link, 'http://example.com/source/')],
+                          'ping_all did not ping the link as written in the source')
+        self.assertTrue(link in ParsedDocument(markup).links)
+        record = OutboundBacklink.objects.for_model(source).get()
+        self.assertEquals(record.target_url, link)
+        self.assertEquals(record.target_url_hash, url_hash(canonicalize_url(link)))
+        client.ping_all('<a href="http://pingback-link.com/entry/">two</a>',
+                        source_url='http://example.com/source/', source_object=source,
+                        incremental=True)
+        self.assertEquals(len(recording_client.pings), 1,
+                          'Incremental ping_all pinged an equivalent link again')
+
+    def testBulkSavePingRecords(self):
+        client = self.getRecordingClient()
+        source = Site.objects.get_current()
+        for i in range(2):
+            client.ping_all(DISCOVERY_SOURCE, source_url='http://example.com/source/',
+                            source_object=source, title='Source')
+            records = OutboundBacklink.objects.for_model(source)
+            self.assertEquals(records.count(), 3,
+                              'ping_all did not update existing records in place')
+        self.assertEquals(sorted(records.values_list('target_url', flat=True)),
+                          ['http://pingback-header.com/entry/',
+                           'http://pingback-link.com/entry/',
+                           'http://trackback-rdf.com/entry/'])
+        record = records.get(target_url='http://trackback-rdf.com/entry/')
+        self.assertEquals((record.status, record.protocol, record.source_url, record.title),
+                          (OutboundBacklink.SUCCESSFUL_STATUS, 'trackback',
+                           'http://example.com/source/', 'Source'))
+        self.assertEquals(record.source_object, source)
+
+    def testConcurrentBulkSave(self):
+        client = self.getRecordingClient()
+        source = Site.objects.get_current()
+        targets = ['http://example.com/one/', 'http://example.com/two/']
+        def build_records(title):
+            records = client.get_ping_records(targets, source)
+            for record in records:
+                record.source_url = 'http://example.com/source/'
+                record.title = title
+                record.status = OutboundBacklink.PENDING_STATUS
+            return records
+        # Both processes found no existing records before either saved
+        first, second = build_records('First'), build_records('Second')
+        OutboundBacklink.objects.bulk_save(first[:1])
+        OutboundBacklink.objects.bulk_save(second)
+        records = OutboundBacklink.objects.for_model(source)
+        self.assertEquals(sorted(records.values_list('target_url', 'title')),
+                          [(targets[0], 'Second'), (targets[1], 'Second')],
+                          'Concurrently saved ping records were duplicated')
+
+    def testClaimPendingPings(self):
+        client = self.getRecordingClient()
+        client.ping_all(DISCOVERY_SOURCE, source_url='http://example.com/source/', defer=True)
+        first = OutboundBacklink.objects.claim_pending('worker-one', 2, 600)
+        second = OutboundBacklink.objects.claim_pending('worker-two', 10, 600)
+        third = OutboundBacklink.objects.claim_pending('worker-three', 10, 600)
+        self.assertEquals((len(first), len(second), len(third)), (2, 3, 0))
+        claimed = [record.pk for record in first + second]
+        self.assertEquals(len(set(claimed)), 5,
+                          'The same pending ping was claimed twice')
+
+    def testRetryFailedPings(self):
+        error = BacklinkClientConnectionError()
+        clients = [('pingback', 'Pingback', MockProtocolClient(PingbackClient(), error)),
+                   ('trackback', 'TrackBack', MockProtocolClient(TrackBackClient(), error))]
+        client = BacklinksClient(clients=clients, url_opener=discovery_reader.open,
+                                 rate_limiter=HostRateLimiter(None))
+        client.ping_all(DISCOVERY_SOURCE, source_url='http://example.com/source/')
+        failed = OutboundBacklink.objects.filter(status=OutboundBacklink.UNSUCCESSFUL_STATUS)
+        self.assertEquals(failed.count(), 3)
+        for record in failed:
+            self.assertEquals(record.num_attempts, 1)
+            self.assertTrue(record.next_attempt > datetime.datetime.now(),
+                            'A failed ping was not scheduled for a retry')
+        self.assertEquals(client.process_pending_pings(), 0,
+                          'A ping was retried before it was due')
+        for attempt in range(2, settings.RETRY_MAX_ATTEMPTS + 1):
+            failed.update(next_attempt=datetime.datetime.now())
+            self.assertEquals(client.process_pending_pings(), 3)
+        record = failed[0]
+        self.assertEquals((record.num_attempts, record.next_attempt),
+                          (settings.RETRY_MAX_ATTEMPTS, None),
+                          'A ping was retried more than the maximum number of times')
+        for n, d, c in clients:
+            c.error = BacklinkClientAlreadyRegistered()
+        client.ping_all(DISCOVERY_SOURCE, source_url='http://example.com/source/')
+        self.assertEquals(failed.filter(next_attempt__isnull=False).count(), 0,
+                          'A permanently failed ping was scheduled for a retry')
+
+    def testRetryDiscoveryFailures(self):
+        client = self.getRecordingClient()
+        client.ping_all(DISCOVERY_SOURCE, source_url='http://example.com/source/', defer=True)
+        self.assertEquals(client.process_pending_pings(batch_size=10), 5)
+        unreachable = OutboundBacklink.objects.get(target_url='http://non-existent.com/entry/')
+        self.assertEquals(unreachable.status, OutboundBacklink.UNSUCCESSFUL_STATUS)
+        self.assertTrue(unreachable.message.startswith('Could not fetch'))
+        self.assertTrue(unreachable.next_attempt is not None,
+                        'A target which could not be fetched was not scheduled for a retry')
+        serverless = OutboundBacklink.objects.get(target_url='http://not-pingable.com/entry/')
+        self.assertEquals((serverless.status, serverless.message, serverless.next_attempt),
+                          (OutboundBacklink.UNSUCCESSFUL_STATUS, 'No backlink server found', None),
+                          'A target with no backlink server was scheduled for a retry')
+        self.assertFalse(is_temporary_fetch_error(HTTPError('http://example.com/', 404, 'Not Found', {}, None)))
+        self.assertTrue(is_temporary_fetch_error(HTTPError('http://example.com/', 503, 'Unavailable', {}, None)))
+        self.assertTrue(is_temporary_fetch_error(socket.timeout('timed out')))
+
+    def testRetryBackoff(self):
+        record = OutboundBacklink(num_attempts=1)
+        delays = []
+        for attempts in range(1, 5):
+            record.num_attempts = attempts
+            delays.append(record.get_retry_delay())
+        for attempts, delay in enumerate(delays):
+            maximum = settings.RETRY_DELAY * 2 ** attempts
+            self.assertTrue(maximum * (1 - settings.RETRY_JITTER) <= delay <= maximum,
+                            'Retry delays did not back off exponentially')
+
+    def testDiscoveryCache(self):
+        opened = []
+        def url_opener(url):
+            opened.append(url)
+            return discovery_reader.open(url)
+        client = BacklinksClient(url_opener=url_opener,
+                                 discovery_cache=DiscoveryCache(100, 60, 60))
+        first = client.discover_backlinks(DISCOVERY_SOURCE)
+        self.assertEquals(len(opened), 5)
+        second = client.discover_backlinks(DISCOVERY_SOURCE)
+        self.assertEquals(second, first,
+                          'Cached discovery results did not match fetched results')
+        self.assertEquals(opened[5:], ['http://non-existent.com/entry/'],
+                          'Discovery did not use cached positive and negative results')
+
+    def testHeadRequestDiscovery(self):
+        methods = []
+        def url_opener(url, method='GET'):
+            methods.append(method)
+            return discovery_reader.open(url)
+        client = BacklinksClient(url_opener=url_opener, discovery_cache=DiscoveryCache(0, 60, 60),
+                                 rate_limiter=HostRateLimiter(None))
+        client.head_request = True
+        target_url, ping_url, c, name = client.discover_link('http://pingback-header.com/entry/')
+        self.assertEquals((ping_url, methods), ('http://pingback-header.com/xmlrpc/', ['HEAD']),
+                          'BacklinksClient did not discover a server from a HEAD request')
+        # MockReader.open takes no method argument
+        self.assertFalse(opener_supports_method(discovery_reader.open))
+        client = BacklinksClient(url_opener=discovery_reader.open,
+                                 discovery_cache=DiscoveryCache(0, 60, 60),
+                                 rate_limiter=HostRateLimiter(None))
+        client.head_request = True
+        target_url, ping_url, c, name = client.discover_link('http://pingback-header.com/entry/')
+        self.assertEquals(ping_url, 'http://pingback-header.com/xmlrpc/',
+                          'BacklinksClient did not use GET for an opener without HEAD support')
+        def failing_opener(url, **kwargs):
+            raise TypeError('opener bug')
+        client = BacklinksClient(url_opener=failing_opener, discovery_cache=DiscoveryCache(0, 60, 60),
+                                 rate_limiter=HostRateLimiter(None))
+        client.head_request = True
+        self.assertRaises(TypeError, client.discover_link, 'http://pingback-header.com/entry/')
+        def declared_opener(url, *args):
+            return discovery_reader.open(url)
+        declared_opener.supports_method = False
+        self.assertFalse(opener_supports_method(declared_opener))
+        self.assertTrue(opener_supports_method(url_reader.open))
+
+    def testLinkHeaderDiscovery(self):
+        reader = MockReader(url_mappings={
+            'http://link-header.com/entry/': (NON_LINKING_SOURCE,
+                                              {'Link': '<http://link-header.com/webmention/>; rel="webmention", '
+                                                       '</xmlrpc/>; rel="pingback"'}),
+        })
+        client = BacklinksClient(url_opener=reader.open, discovery_cache=DiscoveryCache(0, 60, 60))
+        target_url, ping_url, c, name = client.discover_link('http://link-header.com/entry/')
+        self.assertEquals((ping_url, name), ('http://link-header.com/xmlrpc/', 'pingback'),
+                          'BacklinksClient did not discover a Pingback server from a Link header')
+
+    def testStreamingDiscovery(self):
+        padding = '<p>%s</p>' % ('padding ' * 4096)
+        document = PINGBACK_LINK_DOCUMENT.replace('<p>Content</p>', padding)
+        reads = []
+        def url_opener(url):
+            response = MockReader(url_mappings={url: (document, None)}).open(url)
+            read = response.read
+            def counting_read(max_length=None):
+                chunk = read(max_length)
+                reads.append(len(chunk))
+                return chunk
+            response.read = counting_read
+            return response
+        client = BacklinksClient(url_opener=url_opener, discovery_cache=DiscoveryCache(0, 60, 60))
+        target_url, ping_url, c, name = client.discover_link('http://pingback-link.com/entry/')
+        self.assertEquals(ping_url, 'http://pingback-link.com/xmlrpc/')
+        self.assertEquals(sum(reads), settings.DISCOVERY_CHUNK_SIZE,
+                          'Discovery read past the chunk holding the Pingback link element')
+
+        reads[:] = []
+        document = NON_LINKING_SOURCE.replace('</p>', padding + '</p>')
+        self.assertEquals(client.discover_link('http://not-pingable.com/entry/'), None)
+        self.assertEquals(sum(reads), settings.MAX_URL_READ_LENGTH,
+                          'Discovery did not stop at the maximum read length')
+
+    def testRateLimiter(self):
+        limiter = HostRateLimiter(2.0, 3)
+        delays = [limiter.reserve('example.com', 100.0) for i in range(5)]
+        self.assertEquals(delays, [0, 0, 0, 0.5, 1.0],
+                          'HostRateLimiter did not space out requests after a burst')
+        self.assertEquals(limiter.reserve('example.org', 100.0), 0,
+                          'HostRateLimiter limited requests to a different host')
+        self.assertEquals(limiter.reserve('example.com', 102.0), 0,
+                          'HostRateLimiter did not refill a bucket over time')
+
+        class Cache(dict):
+            def add(self, key, value, timeout):
+                self.setdefault(key, value)
+            def incr(self, key):
+                self[key] = self[key] + 1
+                return self[key]
+        shared = Cache()
+        first, second = HostRateLimiter(2.0, 2, shared), HostRateLimiter(2.0, 2, shared)
+        delays = [first.reserve_shared('example.com', 100.0),
+                  second.reserve_shared('example.com', 100.0),
+                  first.reserve_shared('example.com', 100.5)]
+        self.assertEquals(delays, [0, 0, 0.5],
+                          'HostRateLimiter did not share its limit through the cache')
+
+    def testResponseBodyBuffer(self):
+        def wrap(body, max_length=None):
+            headers = httplib.HTTPMessage(StringIO('Content-Type: text/html\r\n\r\n'))
+            return ResponseWrapper(addinfourl(StringIO(body), headers, 'http://example.com/'),
+                                   max_length)
+        body = ''.join(['<p>%d</p>' % i for i in range(100)])
+        response = wrap(body)
+        while response.read(3):
+            pass
+        self.assertEquals(len(response.buffer.chunks), len(body) / 3 + 1)
+        self.assertEquals(response.body, body)
+        self.assertEquals(len(response.buffer.chunks), 1,
+                          'BodyBuffer did not join its chunks once')
+        self.assertEquals((response.bytes_read, response.truncated), (len(body), False))
+        self.assertEquals(response.buffer.getview(3, 4).tobytes(), '0')
+
+        response = wrap(body, 100)
+        response.read(60)
+        self.assertEquals(len(response.read(60)), 40, 'ResponseWrapper read past its limit')
+        self.assertEquals((response.body, response.bytes_read, response.truncated),
+                          (body[:100], 100, True))
+        response = wrap(body, len(body))
+        self.assertEquals((response.body, response.truncated), (body, False))
+
+    def testDecompressingStream(self):
+        body = ''.join(['<p>Paragraph %d</p>' % i for i in range(2000)])
+        gzipped = StringIO()
+        gzip_file = gzip.GzipFile(fileobj=gzipped, mode='wb')
+        gzip_file.write(body)
+        gzip_file.close()
+        encoded = [('gzip', gzipped.getvalue()),
+                   ('deflate', zlib.compress(body)),
+                   ('deflate', zlib.compress(body)[2:-4])]
+        for encoding, data in encoded:
+            stream = DecompressingStream(StringIO(data), encoding)
+            pieces = []
+            while True:
+                piece = stream.read(1000)
+                if not piece:
+                    break
+                pieces.append(piece)
+            self.assertEquals(''.join(pieces), body,
+                              'DecompressingStream did not decode %s data' % encoding)
+
+        headers = httplib.HTTPMessage(StringIO('Content-Encoding: deflate\r\n\r\n'))
+        response = ResponseWrapper(addinfourl(StringIO(zlib.compress(body)), headers,
+                                              'http://example.com/'))
+        self.assertEquals(response.body, body)
+
+        bomb = zlib.compress('\0' * (10 * 1024 * 1024), 9)
+        stream = DecompressingStream(StringIO(bomb), 'deflate', max_ratio=100)
+        self.assertTrue(len(stream.read()) < 1024 * 1024)
+        self.assertTrue(stream.limit_exceeded and stream.bytes_read <= stream.WINDOW,
+                        'DecompressingStream did not stop at the maximum compression ratio')
+        stream = DecompressingStream(StringIO(zlib.compress(body)), 'deflate', max_size=1000)
+        self.assertEquals(stream.read(), body[:1000])
+        self.assertTrue(stream.limit_exceeded)
+        stream = DecompressingStream(StringIO('not compressed'), 'gzip')
+        self.assertRaises(DecompressionError, stream.read)
+
+    def testLRUCache(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEquals((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3),
+                          'LRUCache did not evict the least recently used entry')
+        cache.set('a', 1, timeout=-1)
+        self.assertEquals(cache.get('a'), None, 'LRUCache returned an expired entry')
+
+class PersistentConnectionTestCase(test.TestCase):
+    def setUp(self):
+        self.server = MockHTTPServer()
+        self.server.start()
+        self.base_url = self.server.base_url
+
+    def tearDown(self):
+        self.server.stop()
+
+    def testConnectionReuse(self):
+        reader = LimitedURLReader({})
+        for path in ('pingback-entry/', 'redirect/', 'trackback-entry/'):
+            response = reader.open(self.base_url + path)
+            response.read()
+            response.close()
+        self.assertRaises(HTTPError, reader.open, self.base_url + 'missing/')
+        response = reader.open(self.base_url + 'trackback/', {'url': 'http://example.com/'})
+        self.assertTrue('<error>0</error>' in response.body)
+        response.close()
+        self.assertEquals(self.server.connection_count, 1,
+                          'URLReader did not reuse a persistent connection')
+        self.assertEquals(len(reader.connection_pool), 1)
+        reader.connection_pool.clear()
+        self.assertEquals(len(reader.connection_pool), 0)
+
+    def testClosedConnectionRetry(self):
+        reader = LimitedURLReader({}, timeout=0.3)
+        def open_reused(path, data=None):
+            response = reader.open(self.base_url + 'trackback-entry/')
+            response.read()
+            response.close()
+            self.assertEquals(len(reader.connection_pool), 1)
+            del self.server.dropped_requests[:]
+            self.assertRaises(IOError, reader.open, self.base_url + path, data)
+            return list(self.server.dropped_requests)
+        self.assertEquals(open_reused('drop/'), ['GET', 'GET'],
+                          'A GET over a closed, reused connection was not retried')
+        self.assertEquals(open_reused('drop/', {'url': 'http://example.com/'}), ['POST'],
+                          'A POST over a closed, reused connection was retried')
+        start = time.time()
+        self.assertEquals(open_reused('stall/'), ['GET'], 'A timed out GET was retried')
+        self.assertTrue(time.time() - start < 0.9)
+
+    def testRequestTimeouts(self):
+        default_timeout = socket.getdefaulttimeout()
+        reader = LimitedURLReader({}, timeout=5, connect_timeout=2)
+        response = reader.open(self.base_url + 'trackback-entry/')
+        response.read()
+        self.assertEquals(socket.getdefaulttimeout(), default_timeout,
+                          'URLReader changed the process-wide socket timeout')
+        response.close()
+        start = time.time()
+        response = reader.open(self.base_url + 'slow-redirect/', deadline=0.5)
+        self.assertRaises(IOError, response.read)
+        response.close()
+        self.assertTrue(time.time() - start < 1.5,
+                        'URLReader did not stop reading at the deadline after a redirect')
+
+    def testPingbackTransportReuse(self):
+        client = PingbackClient()
+        for i in range(3):
+            self.assertTrue(client.ping(self.base_url + 'xmlrpc/',
+                                        'http://example.com/target/%d/' % i,
+                                        'http://example.com/source/'))
+        self.assertEquals(self.server.connection_count, 1,
+                          'Pingback pings to one host did not reuse a persistent connection')
+        transport = transport_pool.get(('http', self.base_url[7:-1]))
+        host, connection = transport._connection
+        self.assertEquals(connection.sock.gettimeout(), settings.PINGBACK_READ_TIMEOUT)
+        transport.close()
+
+    def testConnectionPool(self):
+        class Connection(object):
+            closed = False
+            def close(self):
+                self.closed = True
+        pool = ConnectionPool(max_size=2, idle_timeout=30)
+        first, second, third = Connection(), Connection(), Connection()
+        pool.put('a', first)
+        pool.put('b', second)
+        pool.put('b', third)
+        self.assertTrue(first.closed, 'ConnectionPool did not evict the least recently used connection')
+        self.assertEquals((pool.get('a'), pool.get('b'), pool.get('b')), (None, third, second))
+        pool.idle_timeout = -1
+        pool.put('a', first)
+        self.assertEquals(pool.get('a'), None, 'ConnectionPool reused an expired connection')
+
+class AsyncBacklinksClientTestCase(test.TestCase):
+    fixtures = ['backlinks_test_data.json']
+
+    def setUp(self):
+        self.server = MockHTTPServer()
+        self.server.start()
+        self.base_url = self.server.base_url
+
+    def tearDown(self):
+        self.server.stop()
+
+    def testAsyncURLReader(self):
+        reader = LimitedAsyncURLReader()
+        responses, errors = {}, {}
+        for path in ('pingback-entry/', 'redirect/', 'missing/'):
+            reader.open(self.base_url + path,
+                        callback=lambda response, path=path: responses.__setitem__(path, response),
+                        errback=lambda error, path=path: errors.__setitem__(path, error))
+        reader.run()
+        self.assertEquals(sorted(responses.keys()), ['pingback-entry/', 'redirect/'])
+        body = responses['pingback-entry/'].body
+        self.assertTrue(body.startswith('<html><head><title>Entry</title>'),
+                        'Async reader did not decompress a gzipped response')
+        self.assertTrue(len(body) <= settings.MAX_URL_READ_LENGTH,
+                        'Async reader did not limit the response length')
+        self.assertEquals(responses['redirect/'].url, self.base_url + 'pingback-entry/',
+                          'Async reader did not follow a redirect')
+        self.assertEquals(errors['missing/'].code, 404)
+
+    def testAsyncRateLimit(self):
+        rate_limiter = HostRateLimiter(10, burst=1)
+        client = AsyncBacklinksClient(rate_limiter=rate_limiter)
+        self.assertTrue(client.reader.rate_limiter is rate_limiter,
+                        'AsyncBacklinksClient did not share its rate limiter with its reader')
+        started = []
+        def opened(response):
+            started.append(time.time())
+        for i in range(3):
+            client.reader.open(self.base_url + 'trackback-entry/', callback=opened)
+        start = time.time()
+        client.run()
+        self.assertEquals(len(started), 3)
+        self.assertTrue(started[-1] - start >= 0.18,
+                        'Async requests to one host were not spaced out by the rate limiter')
+        client = AsyncBacklinksClient(rate_limiter=HostRateLimiter(10, burst=3))
+        for i in range(3):
+            client.reader.open(self.base_url + 'trackback-entry/')
+        start = time.time()
+        client.run()
+        self.assertTrue(time.time() - start < 0.15, 'A burst of async requests was delayed')
+
+    def testAsyncHostResolution(self):
+        class SlowResolver(HostResolver):
+            def lookup(self, host, port):
+                if host == 'slow.example.com':
+                    time.sleep(2)
+                return ('127.0.0.1', port)
+        resolver = SlowResolver()
+        reader = LimitedAsyncURLReader(connect_timeout=0.5, resolver=resolver)
+        port = int(self.base_url.rstrip('/').rsplit(':', 1)[1])
+        responses, errors = {}, {}
+        for host in ('slow.example.com', 'localhost'):
+            reader.open('http://%s:%d/pingback-entry/' % (host, port),
+                        callback=lambda response, host=host: responses.__setitem__(host, response),
+                        errback=lambda error, host=host: errors.__setitem__(host, error))
+        start = time.time()
+        reader.run()
+        self.assertTrue(time.time() - start < 1.5,
+                        'A slow host name lookup blocked the event loop')
+        self.assertEquals(responses.keys(), ['localhost'])
+        self.assertTrue(isinstance(errors['slow.example.com'], socket.timeout),
+                        'A host name lookup did not time out')
+        self.assertEquals(resolver.get_cached('localhost', port), ('127.0.0.1', port))
+        self.assertEquals(resolver.get_cached('127.0.0.1', port), ('127.0.0.1', port))
+
+    def testAsyncHTTPS(self):
+        import ssl
+        from backlinks.utils.asyncreader import get_default_ssl_context
+        context = get_default_ssl_context()
+        self.assertEquals(context.verify_mode, ssl.CERT_REQUIRED)
+        self.assertTrue(context.check_hostname)
+        wrapped = []
+        class RecordingContext(object):
+            def wrap_socket(self, sock, **kwargs):
+                wrapped.append(kwargs)
+                raise ssl.SSLError('certificate verify failed')
+        reader = LimitedAsyncURLReader(ssl_context=RecordingContext())
+        port = int(self.base_url.rstrip('/').rsplit(':', 1)[1])
+        responses, errors = [], []
+        reader.open('https://localhost:%d/pingback-entry/' % port,
+                    callback=responses.append, errback=errors.append)
+        reader.run()
+        self.assertEquals(wrapped, [{'server_hostname': 'localhost',
+                                     'do_handshake_on_connect': False}],
+                          'Async reader did not send the host name for SNI and verification')
+        self.assertEquals(responses, [])
+        self.assertTrue(isinstance(errors[0], ssl.SSLError),
+                        'A failed TLS handshake did not fail the request')
+
+    def testAsyncPingAll(self):
+        markup = '<p><a href="%spingback-entry/">one</a> <a href="%strackback-entry/">two</a> <a href="%smissing/">three</a></p>' % \
+            (self.base_url, self.base_url, self.base_url)
+        client = AsyncBacklinksClient()
+        client.ping_all(markup, source_url='http://example.com/source/')
+        client.run()
+        records = OutboundBacklink.objects.order_by('protocol')
+        self.assertEquals([(record.target_url, record.protocol, record.status) for record in records],
+                          [(self.base_url + 'pingback-entry/', 'pingback', OutboundBacklink.SUCCESSFUL_STATUS),
+                           (self.base_url + 'trackback-entry/', 'trackback', OutboundBacklink.SUCCESSFUL_STATUS)],
+                          'Async client did not ping all discovered targets')
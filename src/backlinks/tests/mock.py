@@ -1,6 +1,13 @@
 import re
+import gzip
+import socket
+import threading
+import time
 from StringIO import StringIO
 from urllib2 import HTTPError, URLError
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from SimpleXMLRPCServer import SimpleXMLRPCDispatcher
 
 from django.core.handlers.wsgi import STATUS_CODE_TEXT
 
@@ -35,6 +42,9 @@ class MockResponseWrapper(object):
         self._body = self._body + c
         return c
     
+    def close(self):
+        self.fp.close()
+
     def get_body(self):
         if not self._body:
             self.read()
@@ -59,7 +69,7 @@ class MockReader(object):
             content = content()
         if not hasattr(content, 'read'):
             f = StringIO(content)
-        headers = self.headers
+        headers = dict(self.headers)
         if not headers_dict and headers_dict != {}:
             headers_dict = {}
         headers.update(headers_dict)
@@ -93,6 +103,61 @@ url_mappings = {
 
 mock_reader = MockReader(url_mappings=url_mappings)
 
+# Mock discovery targets
+
+PINGBACK_LINK_DOCUMENT = '<html><head><title>Pingback Link</title><link rel="pingback" href="http://pingback-link.com/xmlrpc/"></head><body><p>Content</p></body></html>'
+
+TRACKBACK_RDF_DOCUMENT = '''<html><head><title>TrackBack RDF</title></head><body>
+<!--
+<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+         xmlns:dc="http://purl.org/dc/elements/1.1/"
+         xmlns:trackback="http://madskills.com/public/xml/rss/module/trackback/">
+<rdf:Description
+    rdf:about="http://trackback-rdf.com/entry/"
+    dc:identifier="http://trackback-rdf.com/entry/"
+    dc:title="TrackBack RDF"
+    trackback:ping="http://trackback-rdf.com/trackback/1/" />
+</rdf:RDF>
+-->
+<p>Content</p></body></html>'''
+
+discovery_url_mappings = {
+    'http://pingback-header.com/entry/': (NON_LINKING_SOURCE, {'X-Pingback': 'http://pingback-header.com/xmlrpc/'}),
+    'http://pingback-link.com/entry/': (PINGBACK_LINK_DOCUMENT, None),
+    'http://trackback-rdf.com/entry/': (TRACKBACK_RDF_DOCUMENT, None),
+    'http://not-pingable.com/entry/': (NON_LINKING_SOURCE, None),
+}
+
+DISCOVERY_SOURCE = HTML_TEMPLATE % {'title': 'Test Discovery Source Document',
+                                    'content': 'Links to <a href="http://pingback-header.com/entry/">one</a>, '
+                                               '<a href="http://pingback-link.com/entry/">two</a>, '
+                                               '<a href="http://trackback-rdf.com/entry/">three</a>, '
+                                               '<a href="http://not-pingable.com/entry/">four</a>, '
+                                               '<a href="http://non-existent.com/entry/">five</a> and '
+                                               '<a href="http://example.com/internal/">six</a>.'}
+
+discovery_reader = MockReader(url_mappings=discovery_url_mappings)
+
+class MockProtocolClient(object):
+    """
+    Wraps a protocol client, recording pings rather than sending them.
+    Pings raise ``error``, if given.
+
+    """
+    def __init__(self, client, error=None):
+        self.client = client
+        self.error = error
+        self.pings = []
+
+    def autodiscover(self, link, response):
+        return self.client.autodiscover(link, response)
+
+    def ping(self, ping_url, target_url, source_url, *args, **kwargs):
+        self.pings.append((ping_url, target_url, source_url))
+        if self.error is not None:
+            raise self.error
+        return True
+
 # Mock targets
 
 class MockBlogEntry(object):
@@ -108,3 +173,116 @@ available_entries = {
     'pingable-entry': MockBlogEntry(slug='pingable-entry'),
     'non-pingable-entry': MockBlogEntry(slug='non-pingable-entry', is_pingable=False),
 }
+
+# Mock HTTP server for exercising real network clients
+
+def gzip_compress(content):
+    buf = StringIO()
+    f = gzip.GzipFile(fileobj=buf, mode='wb')
+    f.write(content)
+    f.close()
+    return buf.getvalue()
+
+class MockHTTPRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connection_count = self.server.connection_count + 1
+
+    def log_message(self, *args):
+        pass
+
+    def send_content(self, content, headers=None, code=200):
+        self.send_response(code)
+        headers = headers or {}
+        headers.setdefault('Content-Type', 'text/html; charset=utf-8')
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def drop_request(self):
+        # Closes the connection without responding
+        self.server.dropped_requests.append(self.command)
+        self.close_connection = 1
+
+    def do_GET(self):
+        base_url = self.server.base_url
+        if self.path == '/drop/':
+            self.drop_request()
+        elif self.path == '/stall/':
+            self.drop_request()
+            time.sleep(1)
+        elif self.path == '/pingback-entry/':
+            padding = '<p>%s</p>' % ('Lorem ipsum dolor sit amet. ' * 2000)
+            document = '<html><head><title>Entry</title><link rel="pingback" href="%sxmlrpc/"></head><body>%s</body></html>' % (base_url, padding)
+            self.send_content(gzip_compress(document), {'Content-Encoding': 'gzip'})
+        elif self.path == '/redirect/':
+            self.send_content('', {'Location': base_url + 'pingback-entry/'}, 302)
+        elif self.path == '/slow-redirect/':
+            self.send_content('', {'Location': base_url + 'slow/'}, 302)
+        elif self.path == '/slow/':
+            # Sends a byte every tenth of a second
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            self.send_header('Content-Length', '20')
+            self.end_headers()
+            try:
+                self.wfile.flush()
+                for i in range(20):
+                    self.connection.sendall('x')
+                    time.sleep(0.1)
+            except socket.error:
+                pass
+        elif self.path == '/trackback-entry/':
+            document = TRACKBACK_RDF_DOCUMENT.replace('http://trackback-rdf.com/entry/', base_url + 'trackback-entry/')
+            document = document.replace('http://trackback-rdf.com/trackback/1/', base_url + 'trackback/')
+            self.send_content(document)
+        else:
+            self.send_content('not found', code=404)
+
+    def do_POST(self):
+        data = self.rfile.read(int(self.headers.getheader('content-length', 0)))
+        if self.path == '/drop/':
+            self.drop_request()
+        elif self.path == '/xmlrpc/':
+            self.send_content(self.server.dispatcher._marshaled_dispatch(data),
+                              {'Content-Type': 'text/xml'})
+        elif self.path == '/trackback/':
+            self.send_content('<?xml version="1.0" encoding="utf-8"?><response><error>0</error></response>',
+                              {'Content-Type': 'text/xml'})
+        else:
+            self.send_content('not found', code=404)
+
+class MockHTTPServer(ThreadingMixIn, HTTPServer):
+    """
+    A local HTTP/1.1 server, run in background threads, serving linkable
+    entries and Pingback and TrackBack endpoints. ``connection_count``
+    counts the connections accepted, and ``dropped_requests`` lists the
+    methods of requests which were not answered in time.
+
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), MockHTTPRequestHandler)
+        self.base_url = 'http://127.0.0.1:%d/' % self.server_address[1]
+        self.connection_count = 0
+        self.dropped_requests = []
+        try:
+            self.dispatcher = SimpleXMLRPCDispatcher()
+        except TypeError:
+            self.dispatcher = SimpleXMLRPCDispatcher(allow_none=False, encoding=None)
+        self.dispatcher.register_function(lambda source, target: 'Ping registered',
+                                          'pingback.ping')
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.setDaemon(True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
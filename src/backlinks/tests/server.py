@@ -1,4 +1,7 @@
 import re
+import datetime
+import threading
+import time
 from xmlrpclib import Fault, loads
 from urllib import urlencode
 
@@ -6,7 +9,14 @@ from django import test
 from django.test.client import Client
 from django import template
 
+from backlinks.fields import url_hash
 from backlinks.models import InboundBacklink
+from backlinks.exceptions import BacklinkSourceDoesNotExist, BacklinkAlreadyRegistered, \
+    BacklinkTargetDoesNotExist, BacklinkTargetNotPingable
+from backlinks.server import BacklinksServer
+from backlinks.conf import settings
+from backlinks.utils.cache import SourceCache
+from backlinks.tests.mock import mock_reader
 from backlinks.tests.xmlrpc import TestClientServerProxy
 
 TRACKBACK_CONTENT_TYPE = 'application/x-www-form-urlencoded; charset=utf-8'
@@ -74,6 +84,41 @@ class PingbackServerTestCase(test.TestCase):
                          'Server incorrectly added X-Pingback response header for '
                          'registered view representing a non-pingable resource')
 
+    def testPingbackResponseHeaderCache(self):
+        from django.db.models.signals import post_save
+        from backlinks.tests.mock import available_entries
+        from backlinks.tests.server_urls import mock_pingback_server
+        entry = available_entries['pingable-entry']
+        mock_pingback_server.target_changed(None)
+        try:
+            response = self.client.get('/blog/pingable-entry/')
+            self.assertTrue(bool(response.get('X-Pingback', False)))
+            entry.is_pingable = False
+            response = self.client.get('/blog/pingable-entry/?utm_source=feed')
+            self.assertTrue(bool(response.get('X-Pingback', False)),
+                            'Pingability of the target was not cached')
+            post_save.send(sender=entry.__class__, instance=entry)
+            response = self.client.get('/blog/pingable-entry/')
+            self.assertFalse(response.get('X-Pingback', False),
+                             'Saving the target did not clear its cached pingability')
+        finally:
+            entry.is_pingable = True
+            mock_pingback_server.target_changed(None)
+
+    def testPingableCacheLookupMiss(self):
+        from backlinks.tests.mock import available_entries, MockBlogEntry
+        from backlinks.tests.server_urls import mock_pingback_server
+        target_uri = 'http://example.com/blog/new-entry/'
+        mock_pingback_server.target_changed(None)
+        try:
+            self.assertFalse(mock_pingback_server.is_pingable(target_uri))
+            available_entries['new-entry'] = MockBlogEntry(slug='new-entry')
+            self.assertTrue(mock_pingback_server.is_pingable(target_uri),
+                            'A target which did not exist yet was cached as not pingable')
+        finally:
+            available_entries.pop('new-entry', None)
+            mock_pingback_server.target_changed(None)
+
     def testPingNonExistentTargetURI(self):
         self.assertRaises(Fault,
                           self.xmlrpc_client.pingback.ping,
@@ -160,6 +205,214 @@ class PingbackServerTestCase(test.TestCase):
                              48,
                              'Server did not return "ping already registered" error')
 
+    def testTargetResolution(self):
+        from django.core.urlresolvers import clear_url_caches
+        from backlinks.tests.server_urls import mock_pingback_server as server
+        target_uri = 'http://example.com/blog/pingable-entry/'
+        lookups = []
+        def lookup_view(target_uri):
+            lookups.append(target_uri)
+            return server.__class__.lookup_view(server, target_uri)
+        server.lookup_view = lookup_view
+        try:
+            uri, target_object = server.get_target(target_uri)
+        finally:
+            del server.lookup_view
+        self.assertEquals(uri, target_uri)
+        self.assertEquals(target_object.slug, 'pingable-entry')
+        self.assertEquals(len(lookups), 1, 'Target URI was resolved more than once')
+
+        first = server.lookup_view(target_uri)
+        self.assertTrue(server.lookup_view(target_uri + '?page=2') is first,
+                        'Resolved path was not cached')
+        clear_url_caches()
+        reloaded = server.lookup_view(target_uri)
+        self.assertFalse(reloaded is first, 'Path cache was not cleared with the URLconf')
+        self.assertEquals(reloaded[1:], first[1:])
+        self.assertRaises(BacklinkTargetDoesNotExist, server.resolve_target,
+                          'http://example.com/no-such-page/')
+        self.assertRaises(BacklinkTargetNotPingable, server.resolve_target,
+                          'http://example.com/pingback/')
+
+    def testSourceCache(self):
+        from backlinks.tests.server_urls import MockPingbackServer
+        opened = []
+        class CountingReader(object):
+            def open(self, url):
+                opened.append(url)
+                time.sleep(0.2)
+                return mock_reader.open(url)
+        server = MockPingbackServer()
+        server.url_reader = CountingReader()
+        server.source_cache = SourceCache(10, 60)
+        results = []
+        def get_source():
+            results.append(server.get_source('http://example.com/good-source-document/'))
+        threads = [threading.Thread(target=get_source) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals(len(opened), 1, 'Concurrent pings did not share one fetch')
+        self.assertEquals(len(results), 5)
+        for source in results:
+            self.assertTrue(source is results[0])
+        self.assertTrue(source.has_link('http://example.com/blog/pingable-entry/'))
+        self.assertTrue(server.get_source('http://example.com/good-source-document/#comments') is source,
+                        'Source document was not cached by canonical URL')
+        self.assertEquals(len(opened), 1)
+
+        errors = []
+        def get_missing_source():
+            try:
+                server.get_source('http://example.com/non-existent-resource/')
+            except BacklinkSourceDoesNotExist:
+                errors.append(True)
+        threads = [threading.Thread(target=get_missing_source) for i in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals(len(errors), 3, 'Waiting pings did not get the fetch error')
+        self.assertEquals(len(opened), 2)
+        self.assertRaises(BacklinkSourceDoesNotExist, server.get_source,
+                          'http://example.com/non-existent-resource/')
+        self.assertEquals(len(opened), 3, 'Failed fetch was cached')
+
+    def testDeferredPingVerification(self):
+        opened = []
+        class CountingReader(object):
+            def open(self, url):
+                opened.append(url)
+                return mock_reader.open(url)
+        class DeferredServer(BacklinksServer):
+            protocol = 'pingback'
+            url_reader = CountingReader()
+            source_cache = SourceCache(0, 0)
+            def get_target_object(self, target_uri):
+                return None
+            def validate_target(self, target_uri, target_object):
+                return True
+        server = DeferredServer()
+        target_uri = 'http://example.com/blog/pingable-entry/'
+        server.register_ping('http://example.com/good-source-document/', target_uri, defer=True)
+        server.register_ping('http://example.com/bad-source-document/', target_uri, defer=True)
+        self.assertEquals(opened, [], 'Deferred ping fetched its source')
+        self.assertEquals(InboundBacklink.objects.pending().count(), 2)
+        self.assertEquals(InboundBacklink.objects.approved().filter(target_url=target_uri).count(), 0)
+        self.assertRaises(BacklinkAlreadyRegistered, server.register_ping,
+                          'http://example.com/good-source-document/', target_uri, defer=True)
+
+        self.assertEquals(server.process_pending_pings(), 2)
+        self.assertEquals(len(opened), 2)
+        self.assertEquals(InboundBacklink.objects.pending().count(), 0)
+        backlink = InboundBacklink.objects.get(source_url='http://example.com/good-source-document/')
+        self.assertEquals(backlink.status, InboundBacklink.UNAPPROVED_STATUS)
+        self.assertEquals(backlink.title, 'Test Pingback Good Source Document')
+        self.assertEquals(backlink.protocol, 'pingback')
+        self.assertEquals(backlink.claimed_by, '')
+        self.assertEquals(InboundBacklink.objects.filter(source_url='http://example.com/bad-source-document/').count(), 0,
+                          'Ping from a non-linking source was kept')
+        self.assertEquals(server.process_pending_pings(), 0)
+
+    def testDeferredPingRetry(self):
+        errors = {}
+        class FailingReader(object):
+            def open(self, url):
+                if url in errors:
+                    raise errors[url]
+                return mock_reader.open(url)
+        class DeferredServer(BacklinksServer):
+            protocol = 'pingback'
+            url_reader = FailingReader()
+            source_cache = SourceCache(0, 0)
+        server = DeferredServer()
+        target_uri = 'http://example.com/blog/pingable-entry/'
+        source_uri = 'http://example.com/good-source-document/'
+        other_source_uri = 'http://example.com/another-good-source-document/'
+        server.record_pending_ping(source_uri, target_uri)
+        errors[source_uri] = IOError('Connection refused')
+        self.assertEquals(server.process_pending_pings(), 1)
+        backlink = InboundBacklink.objects.get(source_url=source_uri)
+        self.assertEquals(backlink.status, InboundBacklink.PENDING_STATUS,
+                          'Pending ping was not kept after a connection error')
+        self.assertEquals((backlink.num_attempts, backlink.claimed_by), (1, ''))
+        self.assertTrue(backlink.next_attempt is not None)
+        self.assertEquals(server.process_pending_pings(), 0,
+                          'Pending ping was retried before it was due')
+
+        # An unexpected error is retried too, and the rest of the batch verified
+        InboundBacklink.objects.filter(pk=backlink.pk).update(next_attempt=datetime.datetime.now())
+        server.record_pending_ping(other_source_uri, target_uri)
+        errors[source_uri] = ValueError('Unexpected')
+        self.assertEquals(server.process_pending_pings(), 2)
+        backlink = InboundBacklink.objects.get(source_url=source_uri)
+        self.assertEquals((backlink.status, backlink.num_attempts, backlink.claimed_by),
+                          (InboundBacklink.PENDING_STATUS, 2, ''))
+        self.assertEquals(InboundBacklink.objects.pending().filter(source_url=other_source_uri).count(), 0,
+                          'An error verifying one pending ping stopped the rest of the batch')
+
+        # The ping is given up on after the last attempt
+        InboundBacklink.objects.filter(pk=backlink.pk).update(
+            next_attempt=datetime.datetime.now(), num_attempts=settings.RETRY_MAX_ATTEMPTS - 1)
+        errors[source_uri] = IOError('Connection refused')
+        self.assertEquals(server.process_pending_pings(), 1)
+        self.assertEquals(InboundBacklink.objects.filter(source_url=source_uri).count(), 0,
+                          'Pending ping was kept after its last attempt')
+
+    def testDeferredPingProtocolServer(self):
+        from backlinks.tests.server_urls import mock_pingback_server
+        class UnreachableReader(object):
+            def open(self, url):
+                raise AssertionError('Pending ping verified by the wrong server')
+        class VerifyingServer(BacklinksServer):
+            url_reader = UnreachableReader()
+        server = VerifyingServer()
+        target_uri = 'http://example.com/blog/pingable-entry/'
+        mock_pingback_server.record_pending_ping('http://example.com/good-source-document/', target_uri)
+        settings.attributes['INSTALLED_SERVERS'] = [
+            ('pingback', 'backlinks.tests.server_urls.mock_pingback_server'),
+        ]
+        try:
+            self.assertTrue(server.get_protocol_server('pingback') is mock_pingback_server)
+            self.assertTrue(server.get_protocol_server('trackback') is server)
+            self.assertEquals(server.process_pending_pings(), 1)
+        finally:
+            del settings.attributes['INSTALLED_SERVERS']
+        backlink = InboundBacklink.objects.get(source_url='http://example.com/good-source-document/')
+        self.assertEquals(backlink.status, InboundBacklink.UNAPPROVED_STATUS)
+        self.assertEquals(backlink.title, 'Test Pingback Good Source Document')
+
+    def testDuplicatePing(self):
+        from django.contrib.sites.models import Site
+        class RacingServer(BacklinksServer):
+            url_reader = mock_reader
+            source_cache = SourceCache(0, 0)
+            def get_target_object(self, target_uri):
+                return Site.objects.get_current()
+            def validate_target(self, target_uri, target_object):
+                return True
+            def validate_unregistered(self, source_uri, target_uri, target_object):
+                # As if a concurrent ping had been checked at the same time
+                pass
+        server = RacingServer()
+        source_uri = 'http://example.com/good-source-document/'
+        target_uri = 'http://example.com/blog/pingable-entry/'
+        site = Site.objects.get_current()
+        self.assertFalse(InboundBacklink.objects.is_registered(source_uri, target_uri, site))
+        server.register_ping(source_uri, target_uri)
+        self.assertTrue(InboundBacklink.objects.is_registered(source_uri, target_uri, site))
+        self.assertTrue(InboundBacklink.objects.is_registered(source_uri, target_uri))
+        self.assertRaises(BacklinkAlreadyRegistered, BacklinksServer().validate_unregistered,
+                          source_uri, target_uri, site)
+        self.assertRaises(BacklinkAlreadyRegistered, server.register_ping, source_uri, target_uri)
+        self.assertEquals(InboundBacklink.objects.filter(source_url=source_uri,
+                                                         target_url=target_uri).count(), 1,
+                          'A duplicate ping was recorded')
+        backlink = InboundBacklink.objects.get(source_url=source_uri, target_url=target_uri)
+        self.assertEquals(backlink.source_url_hash, url_hash(source_uri))
+        self.assertEquals(backlink.target_url_hash, url_hash(target_uri))
+
     def testPingbackLinkTemplateTag(self):
         t = template.Template("{% load pingback_tags %}{% pingback_link pingback_path %}")
         c = template.Context({'pingback_path': '/pingback/'})
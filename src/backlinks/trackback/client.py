@@ -11,6 +11,8 @@ from backlinks.exceptions import BacklinkClientError, \
 
 
 RDF_RE = re.compile(r'(<rdf:RDF .*?</rdf:RDF>)', re.DOTALL)
+RDF_START = '<rdf:RDF '
+RDF_END = '</rdf:RDF>'
 TRACKBACK_PING_CONTENT_TYPE = 'application/x-www-form-urlencoded; charset=utf-8'
 
 class RDFHandler(ContentHandler):
@@ -65,6 +67,51 @@ class TrackBackResponseHandler(ContentHandler):
             self.message = content
 
 
+class TrackBackMarkupScanner(object):
+    """
+    Incrementally searches a markup document for a TrackBack autodiscovery
+    RDF document identifying the given link. ``feed`` is called with each
+    newly read chunk of the document; only the start of an RDF document cut
+    off at the end of a chunk is kept for the next. The search is
+    ``finished`` once a matching RDF document has been found.
+
+    """
+    def __init__(self, link):
+        self.link = link
+        self.pending = ''
+        self.finished = False
+        self.result = None
+
+    def get_ping_url(self, rdf):
+        try:
+            handler = RDFHandler()
+            parseString(rdf, handler)
+            if handler.ping_url and handler.identifier == self.link:
+                return handler.ping_url
+        except SAXParseException:
+            pass
+        return None
+
+    def feed(self, chunk):
+        markup = self.pending + chunk
+        position = 0
+        while not self.finished:
+            start = markup.find(RDF_START, position)
+            if start == -1:
+                position = max(position, len(markup) - len(RDF_START))
+                break
+            end = markup.find(RDF_END, start)
+            if end == -1:
+                # Wait for the rest of the RDF document
+                position = start
+                break
+            position = end + len(RDF_END)
+            self.result = self.get_ping_url(markup[start:position])
+            self.finished = bool(self.result)
+        self.pending = markup[position:]
+        return self.result
+
+
 class TrackBackClient(object):
     """
     A TrackBack protocol client.
@@ -74,6 +121,22 @@ class TrackBackClient(object):
         self.url_opener = url_opener
         self.response_handler = response_handler
 
+    def autodiscover_headers(self, link, response):
+        """
+        TrackBack defines no header based autodiscovery, so this always
+        returns ``None``.
+
+        """
+        return None
+
+    def get_markup_scanner(self, link):
+        """
+        Return an object for incrementally searching a resource's markup for
+        its TrackBack server URL.
+
+        """
+        return TrackBackMarkupScanner(link)
+
     def autodiscover(self, link, response):
         """
         Attempt to determine the TrackBack server URL for a resource by
@@ -81,19 +144,7 @@ class TrackBackClient(object):
         RDF document.
 
         """
-        trackback_url = None
-        rdfs = RDF_RE.findall(response.body)
-        for rdf in rdfs:
-            try:
-                handler = RDFHandler()
-                parseString(rdf, handler)
-                if handler.ping_url:
-                    if handler.identifier == link:
-                        trackback_url = handler.ping_url
-                        break
-            except SAXParseException:
-                pass
-        return trackback_url
+        return self.get_markup_scanner(link).feed(response.body)
 
     def do_ping_request(self, ping_url, data):
         """
@@ -118,34 +169,84 @@ class TrackBackClient(object):
             raise BacklinkClientInvalidResponse
 
 
-    def ping(self, ping_url, target_url, source_url, title=None, excerpt=None, *args, **kwargs):
+    def get_ping_params(self, source_url, title=None, excerpt=None):
         """
-        Perform a TrackBack ping request.
+        Build the TrackBack ping request parameters.
 
         """
-        # Build ping parameters
         ping_params = {'url': source_url}
         if title:
             ping_params['title'] = title
         if excerpt:
             ping_params['excerpt'] = excerpt
+        return ping_params
+
+    def get_http_error(self, error):
+        """
+        Return the ``BacklinkClientError`` for an error raised while making
+        the ping request.
+
+        """
+        if isinstance(error, HTTPError):
+            if error.code == 404:
+                return BacklinkClientServerDoesNotExist()
+            elif error.code == 500:
+                return BacklinkClientRemoteError()
+            elif error.code in (403, 401):
+                return BacklinkClientAccessDenied()
+            return BacklinkClientConnectionError(reason=error.msg)
+        elif isinstance(error, URLError):
+            return BacklinkClientConnectionError(reason=error.reason)
+        return BacklinkClientConnectionError(reason=str(error))
+
+    def ping(self, ping_url, target_url, source_url, title=None, excerpt=None, *args, **kwargs):
+        """
+        Perform a TrackBack ping request.
+
+        """
+        ping_params = self.get_ping_params(source_url, title, excerpt)
 
         # Attempt the ping
         try:
             response = self.do_ping_request(ping_url, ping_params)
-        except HTTPError, e:
-            if e.code == 404:
-                raise BacklinkClientServerDoesNotExist
-            elif e.code == 500:
-                raise BacklinkClientRemoteError
-            elif e.code in (403, 401):
-                raise BaclinkClientAccessDenied
-            raise BacklinkClientConnectionError(reason=e.msg)
-        except URLError, e:
-            raise BacklinkClientConnectionError(reason=e.reason)
+        except (HTTPError, URLError), e:
+            raise self.get_http_error(e)
 
         # Validate the response
         return self.validate_response(response)
 
-# A default client instance for convenience
+
+class AsyncTrackBackClient(TrackBackClient):
+    """
+    A TrackBack client which sends pings through an ``AsyncURLReader``.
+
+    """
+    def ping_async(self, reader, ping_url, target_url, source_url,
+                   callback=None, errback=None, title=None, excerpt=None,
+                   *args, **kwargs):
+        """
+        Schedule a TrackBack ping on the given ``AsyncURLReader``.
+        ``callback`` is called with ``True`` upon success, and ``errback``
+        with the appropriate ``BacklinkClientError`` upon failure.
+
+        """
+        callback = callback or (lambda result: None)
+        errback = errback or (lambda error: None)
+
+        def handle_response(response):
+            try:
+                self.validate_response(response)
+            except BacklinkClientError, e:
+                return errback(e)
+            callback(True)
+
+        def handle_error(error):
+            errback(self.get_http_error(error))
+
+        reader.open(ping_url, self.get_ping_params(source_url, title, excerpt),
+                    {'Content-Type': TRACKBACK_PING_CONTENT_TYPE},
+                    callback=handle_response, errback=handle_error)
+
+# Default client instances for convenience
 default_client = TrackBackClient()
+default_async_client = AsyncTrackBackClient()
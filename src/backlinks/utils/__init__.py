@@ -1,3 +1,4 @@
+import re
 import urllib
 import urlparse
 
@@ -5,8 +6,9 @@ from django.contrib.sites.models import Site, RequestSite
 
 from backlinks.utils.unicodifier import unicodify
 from backlinks.utils.urlreader import ResponseWrapper, URLReader
-from backlinks.utils.parsers import HttpLinkParser, TitleParser, \
-    ContextualExcerptParser
+from backlinks.utils.asyncreader import AsyncURLReader
+from backlinks.utils.parsers import HttpLinkParser, DocumentParser, \
+    build_excerpts, PARSE_ERRORS
 from backlinks.conf import settings
 
 def get_site_absolute_uri(request=None):
@@ -22,42 +24,252 @@ def get_site_absolute_uri(request=None):
     scheme, domain, path, querystring, fragment = urlparse.urlsplit(domain)
     return urlparse.urlunsplit((scheme, domain, path, None, None))
 
+def get_url_host(url):
+    return urlparse.urlsplit(url)[1].lower()
+
+DEFAULT_PORTS = {'http': '80', 'https': '443'}
+
+def is_stripped_param(name, patterns):
+    for pattern in patterns:
+        if pattern.endswith('*'):
+            if name.startswith(pattern[:-1]):
+                return True
+        elif name == pattern:
+            return True
+    return False
+
+def canonicalize_url(url):
+    """
+    Return the canonical form of an URL, used to recognize links to the same
+    resource, according to the ``CANONICAL_URL_*`` settings.
+
+    """
+    scheme, netloc, path, query, fragment = urlparse.urlsplit(url.strip())
+    scheme = scheme.lower()
+    userinfo, at, host = netloc.rpartition('@')
+    if settings.CANONICAL_URL_LOWERCASE_HOST:
+        host = host.lower()
+    if settings.CANONICAL_URL_DROP_DEFAULT_PORT and scheme in DEFAULT_PORTS:
+        hostname, colon, port = host.rpartition(':')
+        if colon and port == DEFAULT_PORTS[scheme]:
+            host = hostname
+    netloc = userinfo + at + host
+    if netloc and not path:
+        path = '/'
+    if query and settings.CANONICAL_URL_STRIP_PARAMS:
+        params = [param for param in query.split('&')
+                  if not is_stripped_param(urllib.unquote_plus(param.split('=', 1)[0]),
+                                           settings.CANONICAL_URL_STRIP_PARAMS)]
+        query = '&'.join(params)
+    if settings.CANONICAL_URL_DROP_FRAGMENT:
+        fragment = ''
+    return urlparse.urlunsplit((scheme, netloc, path, query, fragment))
+
+LINK_HEADER_RE = re.compile(r'<([^>]*)>((?:\s*;\s*[^;,]*)*)')
+
+def parse_link_header(value):
+    """
+    Parse an HTTP ``Link`` header value into a list of (url, rel-values)
+    tuples.
+
+    """
+    links = []
+    for match in LINK_HEADER_RE.finditer(value or ''):
+        url, params = match.groups()
+        rels = []
+        for param in params.split(';'):
+            name, sep, param_value = param.partition('=')
+            if name.strip().lower() == 'rel':
+                rels.extend(param_value.strip().strip('"\'').lower().split())
+        links.append((url.strip(), rels))
+    return links
+
 class LimitedResponseWrapper(ResponseWrapper):
-    def read(self, max_length=settings.MAX_URL_READ_LENGTH):
-        return super(LimitedResponseWrapper, self).read(max_length)
+    MAX_LENGTH = settings.MAX_URL_READ_LENGTH
+    MAX_DECOMPRESSED_LENGTH = settings.MAX_DECOMPRESSED_LENGTH
+    MAX_COMPRESSION_RATIO = settings.MAX_COMPRESSION_RATIO
 
 class LimitedURLReader(URLReader):
     RESPONSE_CLASS = LimitedResponseWrapper
+    DEFAULT_TIMEOUT = settings.FETCH_READ_TIMEOUT
+    CONNECT_TIMEOUT = settings.FETCH_CONNECT_TIMEOUT
+    DEADLINE = settings.FETCH_DEADLINE
+    POOL_SIZE = settings.CONNECTION_POOL_SIZE
+    POOL_IDLE_TIMEOUT = settings.CONNECTION_POOL_IDLE_TIMEOUT
 
 url_reader = LimitedURLReader({'User-Agent': settings.USER_AGENT_STRING,})
 
+class LimitedAsyncURLReader(AsyncURLReader):
+    RESPONSE_CLASS = LimitedResponseWrapper
+    MAX_READ_LENGTH = settings.MAX_URL_READ_LENGTH
+    CONNECT_TIMEOUT = settings.FETCH_CONNECT_TIMEOUT
+
+    def __init__(self, extra_headers=None, *args, **kwargs):
+        headers = {'User-Agent': settings.USER_AGENT_STRING}
+        headers.update(extra_headers or {})
+        super(LimitedAsyncURLReader, self).__init__(headers, *args, **kwargs)
+
+class ParsedDocument(object):
+    """
+    A markup document tokenized once, giving its external links, its title
+    and contextual excerpts for any number of target URLs.
+
+    """
+    def __init__(self, markup, charset=None):
+        self.markup = markup
+        self.charset = charset
+        self.parser = DocumentParser()
+        try:
+            self.parser.feed(markup)
+            self.parser.close()
+        except Exception:
+            # Keep whatever was parsed before the markup became unparseable
+            pass
+        self._external_links = None
+        self._spans = None
+
+    def convert(self, text):
+        converted, original_encoding = unicodify(text, self.charset and [self.charset] or [])
+        return converted
+
+    def _get_links(self):
+        """
+        The ``http`` links in the document, once each, in document order.
+
+        """
+        links, seen = [], set()
+        for link in self.parser.links:
+            if link.lower().startswith('http://') and link not in seen:
+                seen.add(link)
+                links.append(link)
+        return links
+    links = property(_get_links)
+
+    def _get_external_links(self):
+        """
+        The links to other sites, once per canonical form, as first written.
+
+        """
+        if self._external_links is None:
+            self._external_links = list(filter_external_links(self.links))
+        return self._external_links
+    external_links = property(_get_external_links)
+
+    def _get_title(self):
+        try:
+            return self.convert(self.parser.get_title())
+        except Exception:
+            return ''
+    title = property(_get_title)
+
+    def get_excerpts(self, target_url, max_words):
+        """
+        Return the excerpts of up to ``max_words`` words around each link to
+        the target URL, compared in canonical form.
+
+        """
+        if self._spans is None:
+            # Built aside so that a document shared between threads is
+            # never seen half indexed
+            spans = {}
+            for href, start, end in self.parser.link_spans:
+                spans.setdefault(canonicalize_url(href), []).append((start, end))
+            self._spans = spans
+        spans = self._spans.get(canonicalize_url(target_url), [])
+        return build_excerpts(self.parser.parts, spans, max_words)
+
+    def get_excerpt(self, target_url, max_words):
+        """
+        Return the first excerpt around a link to the target URL, or ``''``.
+
+        """
+        try:
+            excerpts = self.get_excerpts(target_url, max_words)
+            if excerpts:
+                return self.convert(excerpts[0])
+        except Exception:
+            pass
+        return ''
+
+class SourceDocument(object):
+    """
+    A fetched document, read in full from its response so that it may be
+    cached and shared, and parsed into a ``ParsedDocument`` on first use.
+
+    """
+    def __init__(self, response):
+        self.url = response.url
+        self.headers = response.headers
+        try:
+            self.body = response.body
+            self.charset = response.charset
+        finally:
+            response.close()
+        self._document = None
+
+    def _get_document(self):
+        if self._document is None:
+            self._document = ParsedDocument(self.body, self.charset)
+        return self._document
+    document = property(_get_document)
+
+    def has_link(self, target_link):
+        return target_link in self.document.links
+
+def filter_external_links(links):
+    """
+    Yields each of the links which is to another site, as first written,
+    skipping links whose canonical form was seen before.
+
+    The canonical form only recognizes equivalent links; the link itself
+    is what appears in the document, and so what must be pinged.
+
+    """
+    site_uri = canonicalize_url(get_site_absolute_uri())
+    seen = set()
+    for link in links:
+        canonical_link = canonicalize_url(link)
+        if canonical_link not in seen and not canonical_link.startswith(site_uri):
+            seen.add(canonical_link)
+            yield link
+
+def iter_parsed_links(document):
+    """
+    Yields the ``http`` links of the document as they are parsed, stopping
+    with the links found so far if the markup becomes unparseable.
+
+    """
+    links = HttpLinkParser().iterparse(document)
+    while True:
+        try:
+            link = links.next()
+        except StopIteration:
+            return
+        except PARSE_ERRORS:
+            # Keep whatever was parsed before the markup became unparseable
+            return
+        yield link
+
+def iter_external_links(document):
+    """
+    Yields the external links of the document as they are parsed, so that
+    parsing stops if the caller stops iterating.
+
+    """
+    for link in filter_external_links(iter_parsed_links(document)):
+        yield link
+
 def parse_external_links(document):
-    parser = HttpLinkParser()
-    links = parser.parse(document)
-    site_uri = get_site_absolute_uri()
-    return [link for link in links if not link.startswith(site_uri)]
+    return list(iter_external_links(document))
 
 def document_has_target_link(markup, target_link):
-    links = HttpLinkParser().parse(markup)
-    return target_link in links
+    for link in HttpLinkParser().iterparse(markup):
+        if link == target_link:
+            return True
+    return False
 
 def parse_title(markup, charset=None):
-    parser = TitleParser()
-    try:
-        title = parser.parse(markup)
-        converted, original_encoding = unicodify(markup, [charset] or [])
-        return converted
-    except:
-        return ''
+    return ParsedDocument(markup, charset).title
 
 def parse_excerpt(markup, target_url, max_words, charset=None):
-    parser = ContextualExcerptParser()
-    try:
-        found_excerpts = parser.parse(markup, max_words)
-    except:
-        return ''
-    if found_excerpts:
-         excerpt = found_excerpts[0]
-         converted, original_encoding = unicodify(excerpt, [charset] or [])
-         return converted
-    return ''
+    return ParsedDocument(markup, charset).get_excerpt(target_url, max_words)
@@ -0,0 +1,528 @@
+import asyncore
+import errno
+import heapq
+import httplib
+import itertools
+import socket
+import sys
+import threading
+import time
+import urllib
+import urllib2
+import urlparse
+from collections import deque
+from Queue import Queue
+from StringIO import StringIO
+
+try:
+    import ssl
+except ImportError:
+    ssl = None
+
+from backlinks.utils.urlreader import ResponseWrapper, URLReader
+
+REDIRECT_CODES = (301, 302, 303, 307)
+
+
+def get_request_address(request):
+    """
+    Return the (host, port) tuple a ``urllib2.Request`` is sent to.
+
+    """
+    host, port = urllib.splitport(request.get_host())
+    if request.get_type() == 'https':
+        return host, int(port or httplib.HTTPS_PORT)
+    return host, int(port or httplib.HTTP_PORT)
+
+_ssl_context = None
+
+def get_default_ssl_context():
+    """
+    Return the ``ssl.SSLContext`` shared by asynchronous HTTPS requests,
+    which verifies certificates and host names against the system's
+    trusted certificates, or ``None`` where ``ssl.create_default_context``
+    is unavailable (before Python 2.7.9).
+
+    """
+    global _ssl_context
+    if _ssl_context is None and hasattr(ssl, 'create_default_context'):
+        _ssl_context = ssl.create_default_context()
+    return _ssl_context
+
+
+class HostResolver(object):
+    """
+    Looks up the addresses of host names on a pool of at most
+    ``num_threads`` threads, so that a slow DNS lookup does not block an
+    event loop, and caches the addresses found for ``cache_timeout``
+    seconds.
+
+    A resolver may be shared by any number of threads.
+
+    """
+    NUM_THREADS = 4
+    CACHE_TIMEOUT = 5 * 60
+    MAX_CACHE_SIZE = 1000
+
+    def __init__(self, num_threads=None, cache_timeout=None):
+        self.num_threads = num_threads or self.NUM_THREADS
+        self.cache_timeout = cache_timeout
+        if cache_timeout is None:
+            self.cache_timeout = self.CACHE_TIMEOUT
+        self._cache = {}
+        self._requests = Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def lookup(self, host, port):
+        """
+        Return the address to connect to for the host and port, blocking
+        until it is known.
+
+        """
+        return socket.getaddrinfo(host, port, socket.AF_INET, socket.SOCK_STREAM)[0][4]
+
+    def get_cached(self, host, port):
+        """
+        Return the cached address for the host and port, or ``None``.
+
+        """
+        try:
+            socket.inet_aton(host)
+        except socket.error:
+            pass
+        else:
+            if host.count('.') == 3:
+                return (host, port)
+        self._lock.acquire()
+        try:
+            address, expires = self._cache.get((host, port), (None, None))
+            if address is not None and expires <= time.time():
+                del self._cache[(host, port)]
+                return None
+            return address
+        finally:
+            self._lock.release()
+
+    def resolve(self, host, port, callback):
+        """
+        Look up the address of the host and port on a resolver thread, and
+        call ``callback`` with the address and ``None``, or ``None`` and the
+        ``socket.error`` raised. The callback is called on the resolver
+        thread.
+
+        """
+        self._lock.acquire()
+        try:
+            if len(self._threads) < self.num_threads:
+                thread = threading.Thread(target=self._work)
+                thread.setDaemon(True)
+                thread.start()
+                self._threads.append(thread)
+        finally:
+            self._lock.release()
+        self._requests.put((host, port, callback))
+
+    def _work(self):
+        while True:
+            host, port, callback = self._requests.get()
+            try:
+                address = self.lookup(host, port)
+            except socket.error, e:
+                callback(None, e)
+                continue
+            self._lock.acquire()
+            try:
+                if len(self._cache) >= self.MAX_CACHE_SIZE:
+                    self._cache.clear()
+                self._cache[(host, port)] = (address, time.time() + self.cache_timeout)
+            finally:
+                self._lock.release()
+            callback(address, None)
+
+
+_default_resolver = None
+
+def get_default_resolver():
+    """
+    Return the process-wide ``HostResolver``.
+
+    """
+    global _default_resolver
+    if _default_resolver is None:
+        _default_resolver = HostResolver()
+    return _default_resolver
+
+
+class AsyncFetch(asyncore.dispatcher):
+    """
+    A single non-blocking HTTP request driven by an ``AsyncURLReader``.
+
+    Requests are made with HTTP/1.0 so that the response body is delimited
+    by the server closing the connection. At most ``max_read_length`` bytes
+    of the (possibly compressed) body are read before the connection is
+    closed.
+
+    ``address`` is the (host, port) tuple to connect to. If it is not given,
+    the request's host name is looked up, blocking the event loop.
+
+    """
+    def __init__(self, reader, request, timeout, callback, errback, redirects=0,
+                 address=None):
+        asyncore.dispatcher.__init__(self, map=reader._map)
+        self.reader = reader
+        self.request = request
+        self.timeout = timeout
+        self.deadline = time.time() + timeout
+        self.max_read_length = reader.max_read_length
+        self.callback = callback
+        self.errback = errback
+        self.redirects = redirects
+        self.finished = False
+        self._handshaking = False
+        self._in_buffer = []
+        self._in_length = 0
+        self._header_data = None
+        self._out_buffer = self.build_request()
+
+        self.use_ssl = (request.get_type() == 'https')
+        if self.use_ssl and ssl is None:
+            raise urllib2.URLError('HTTPS is not supported')
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            self.connect(address or get_request_address(request))
+        except socket.error:
+            self.close()
+            raise
+
+    def build_request(self):
+        request = self.request
+        lines = ['%s %s HTTP/1.0' % (request.get_method(), request.get_selector())]
+        headers = {'Host': request.get_host(), 'Connection': 'close'}
+        for name, value in request.headers.items():
+            headers[name.title()] = value
+        data = request.get_data()
+        if data is not None:
+            headers.setdefault('Content-Type', 'application/x-www-form-urlencoded')
+            headers['Content-Length'] = str(len(data))
+        for name, value in headers.items():
+            lines.append('%s: %s' % (name, value))
+        return '\r\n'.join(lines) + '\r\n\r\n' + (data or '')
+
+    # Dispatcher event handlers
+
+    def handle_connect(self):
+        if self.use_ssl:
+            self.socket = self.wrap_socket(self.socket)
+            self._handshaking = True
+            self.do_handshake()
+
+    def wrap_socket(self, sock):
+        """
+        Wrap the connected socket for TLS, sending the request's host name
+        for SNI and verifying the server's certificate against it, as the
+        synchronous URL reader does.
+
+        """
+        context = self.reader.ssl_context or get_default_ssl_context()
+        if context is None:
+            # No SNI or certificate verification before Python 2.7.9
+            return ssl.wrap_socket(sock, do_handshake_on_connect=False)
+        host = urllib.splitport(self.request.get_host())[0]
+        return context.wrap_socket(sock, server_hostname=host,
+                                   do_handshake_on_connect=False)
+
+    def do_handshake(self):
+        try:
+            self.socket.do_handshake()
+            self._handshaking = False
+        except ssl.SSLError, e:
+            if e.args[0] not in (ssl.SSL_ERROR_WANT_READ, ssl.SSL_ERROR_WANT_WRITE):
+                raise
+
+    def ssl_wants_io(self, error):
+        return ssl is not None and isinstance(error, ssl.SSLError) and \
+            error.args[0] in (ssl.SSL_ERROR_WANT_READ, ssl.SSL_ERROR_WANT_WRITE)
+
+    def writable(self):
+        return not self.connected or self._handshaking or bool(self._out_buffer)
+
+    def handle_write(self):
+        if self._handshaking:
+            return self.do_handshake()
+        try:
+            sent = self.send(self._out_buffer)
+        except socket.error, e:
+            if self.ssl_wants_io(e):
+                return
+            raise
+        self._out_buffer = self._out_buffer[sent:]
+
+    def handle_read(self):
+        if self._handshaking:
+            return self.do_handshake()
+        try:
+            data = self.recv(8192)
+        except socket.error, e:
+            if self.ssl_wants_io(e):
+                return
+            raise
+        if data:
+            self._in_buffer.append(data)
+            self._in_length = self._in_length + len(data)
+            if self._header_data is None:
+                self.find_headers()
+            if self._header_data is not None and self.max_read_length and \
+                    self._in_length >= self.max_read_length:
+                self.finish()
+
+    def handle_close(self):
+        self.finish()
+
+    def handle_error(self):
+        exc_type, exc_value = sys.exc_info()[:2]
+        if not isinstance(exc_value, (IOError, socket.error, httplib.HTTPException)):
+            exc_value = urllib2.URLError(exc_value)
+        self.fail(exc_value)
+
+    # Response handling
+
+    def find_headers(self):
+        data = ''.join(self._in_buffer)
+        index = data.find('\r\n\r\n')
+        if index == -1:
+            return
+        self._header_data = data[:index]
+        body = data[index + 4:]
+        self._in_buffer = [body]
+        self._in_length = len(body)
+
+    def fail(self, error):
+        if not self.finished:
+            self.finished = True
+            self.close()
+            self.reader._complete(self.errback, error)
+
+    def finish(self):
+        if self.finished:
+            return
+        self.finished = True
+        self.close()
+        if self._header_data is None:
+            return self.reader._complete(self.errback,
+                                         urllib2.URLError('Incomplete response'))
+        status_line, header_data = (self._header_data.split('\r\n', 1) + [''])[:2]
+        try:
+            version, code, reason = (status_line.split(None, 2) + [''])[:3]
+            code = int(code)
+        except ValueError:
+            return self.reader._complete(self.errback,
+                                         httplib.BadStatusLine(status_line))
+        headers = httplib.HTTPMessage(StringIO(header_data + '\r\n\r\n'))
+        body = ''.join(self._in_buffer)
+        url = self.request.get_full_url()
+
+        location = headers.getheader('location') or headers.getheader('uri')
+        if code in REDIRECT_CODES and location:
+            return self.reader._redirect(self, urlparse.urljoin(url, location), code)
+        if not 200 <= code < 300:
+            return self.reader._complete(self.errback,
+                                         urllib2.HTTPError(url, code, reason.strip(),
+                                                           headers, StringIO(body)))
+        response = urllib.addinfourl(StringIO(body), headers, url, code)
+        self.reader._complete(self.callback, self.reader.RESPONSE_CLASS(response))
+
+
+class AsyncURLReader(object):
+    """
+    A single-threaded, non-blocking counterpart to ``URLReader`` built on the
+    ``asyncore`` event loop.
+
+    ``open`` schedules a request and returns immediately; ``callback`` is
+    later called with a ``ResponseWrapper`` like object, or ``errback`` with
+    the ``urllib2.URLError``, ``urllib2.HTTPError`` or ``IOError`` raised
+    while fetching. Scheduled requests are performed, with at most
+    ``max_concurrent`` connections open at once, when ``run`` is called.
+    Each request, including any redirects followed, must complete within
+    ``timeout`` seconds.
+
+    Host names are looked up by a ``HostResolver``, off the event loop
+    thread. A lookup which takes longer than ``connect_timeout`` seconds
+    fails the request with ``socket.timeout``. Requests waiting on a lookup
+    count towards ``max_concurrent``.
+
+    If a ``rate_limiter``, such as a ``HostRateLimiter``, is given, each
+    request, including redirects, reserves a slot with its ``reserve``
+    method for the request's host and is only started once that slot
+    comes.
+
+    HTTPS requests are made through ``ssl_context``, or by default through
+    the context of ``get_default_ssl_context``, which verifies certificates.
+
+    """
+    DEFAULT_HEADERS = URLReader.DEFAULT_HEADERS
+    DEFAULT_TIMEOUT = URLReader.DEFAULT_TIMEOUT
+    CONNECT_TIMEOUT = None
+    RESPONSE_CLASS = ResponseWrapper
+    MAX_CONCURRENT = 100
+    MAX_REDIRECTS = 5
+    MAX_READ_LENGTH = None
+    # How often, in seconds, the event loop checks for finished lookups
+    RESOLVE_POLL_INTERVAL = 0.01
+
+    def __init__(self, extra_headers={}, timeout=None, max_concurrent=None,
+                 max_read_length=None, connect_timeout=None, resolver=None,
+                 rate_limiter=None, ssl_context=None):
+        self._headers = dict(extra_headers)
+        self._headers.update(self.DEFAULT_HEADERS)
+        self.timeout = timeout or self.DEFAULT_TIMEOUT
+        self.max_concurrent = max_concurrent or self.MAX_CONCURRENT
+        self.max_read_length = max_read_length or self.MAX_READ_LENGTH
+        self.connect_timeout = connect_timeout or self.CONNECT_TIMEOUT
+        self.resolver = resolver or get_default_resolver()
+        self.rate_limiter = rate_limiter
+        self.ssl_context = ssl_context
+        self._map = {}
+        self._queue = deque()
+        self._delayed = []
+        self._delayed_order = itertools.count()
+        # (deadline, lookup) tuples keyed by a lookup number, as callbacks
+        # need not be hashable
+        self._resolving = {}
+        self._lookup_order = itertools.count()
+        self._resolved = deque()
+        self._completed = []
+
+    def build_request(self, url, data=None, extra_headers={}):
+        request_headers = {}
+        request_headers.update(extra_headers)
+        request_headers.update(self._headers)
+        if data and not isinstance(data, basestring):
+            data = urllib.urlencode(data)
+        return urllib2.Request(url, data, request_headers)
+
+    def open(self, url, data=None, extra_headers={}, timeout=None,
+             callback=None, errback=None):
+        """
+        Schedule a request for the given URL. ``data`` may be a dict, which
+        is URL encoded, or a string which is sent as the request body.
+
+        """
+        request = self.build_request(url, data, extra_headers)
+        self._schedule((request, timeout or self.timeout, callback, errback, 0))
+
+    def _schedule(self, entry, first=False):
+        delay = 0
+        if self.rate_limiter is not None:
+            delay = self.rate_limiter.reserve(entry[0].get_host().lower())
+        if delay:
+            heapq.heappush(self._delayed, (time.time() + delay,
+                                           self._delayed_order.next(), entry))
+        elif first:
+            self._queue.appendleft(entry)
+        else:
+            self._queue.append(entry)
+
+    def _start(self, request, timeout, callback, errback, redirects):
+        host, port = get_request_address(request)
+        address = self.resolver.get_cached(host, port)
+        if address is not None:
+            return self._connect(address, request, timeout, callback, errback, redirects)
+        started = time.time()
+        lookup_id = self._lookup_order.next()
+        lookup = (request, timeout, callback, errback, redirects, started)
+        self._resolving[lookup_id] = (started + min(timeout, self.connect_timeout or timeout),
+                                      lookup)
+        self.resolver.resolve(host, port, lambda address, error:
+                                  self._resolved.append((lookup_id, address, error)))
+
+    def _connect(self, address, request, timeout, callback, errback, redirects):
+        try:
+            AsyncFetch(self, request, timeout, callback, errback, redirects, address)
+        except (IOError, socket.error), e:
+            self._complete(errback, e)
+
+    def _finish_lookups(self):
+        while self._resolved:
+            lookup_id, address, error = self._resolved.popleft()
+            if lookup_id not in self._resolving:
+                # The lookup has already timed out
+                continue
+            deadline, lookup = self._resolving.pop(lookup_id)
+            request, timeout, callback, errback, redirects, started = lookup
+            if error is not None:
+                self._complete(errback, error)
+                continue
+            self._connect(address, request, timeout - (time.time() - started),
+                          callback, errback, redirects)
+
+    def _redirect(self, fetch, url, code):
+        if fetch.redirects >= self.MAX_REDIRECTS:
+            return self._complete(fetch.errback,
+                                  urllib2.HTTPError(url, code, 'Too many redirects',
+                                                    {}, StringIO('')))
+        request = fetch.request
+        data = None
+        if code == 307:
+            data = request.get_data()
+        new_request = urllib2.Request(url, data, request.headers)
+        # The redirected request gets what is left of the original's timeout
+        remaining = fetch.deadline - time.time()
+        if remaining <= 0:
+            return self._complete(fetch.errback, socket.timeout('timed out'))
+        self._schedule((new_request, remaining, fetch.callback,
+                        fetch.errback, fetch.redirects + 1), first=True)
+
+    def _complete(self, handler, result):
+        self._completed.append((handler, result))
+
+    def _check_timeouts(self):
+        now = time.time()
+        for fetch in self._map.values():
+            if now >= fetch.deadline:
+                fetch.fail(socket.timeout('timed out'))
+        for lookup_id, (deadline, lookup) in self._resolving.items():
+            if now >= deadline:
+                del self._resolving[lookup_id]
+                self._complete(lookup[3], socket.timeout('timed out'))
+
+    def run(self):
+        """
+        Perform all scheduled requests, calling their callbacks as they
+        complete. Requests scheduled from callbacks are performed as well.
+        Returns once no requests remain.
+
+        """
+        while self._queue or self._delayed or self._map or self._resolving or \
+                self._completed:
+            now = time.time()
+            while self._delayed and self._delayed[0][0] <= now:
+                self._queue.append(heapq.heappop(self._delayed)[2])
+            while self._queue and \
+                    len(self._map) + len(self._resolving) < self.max_concurrent:
+                self._start(*self._queue.popleft())
+            deadlines = [fetch.deadline for fetch in self._map.values()]
+            deadlines.extend([deadline for deadline, lookup in self._resolving.values()])
+            if self._delayed:
+                deadlines.append(self._delayed[0][0])
+            if deadlines:
+                poll_timeout = max(0.0, min(1.0, min(deadlines) - time.time()))
+                if self._completed:
+                    poll_timeout = 0.0
+                if self._resolving:
+                    # Finished lookups cannot wake the loop up
+                    poll_timeout = min(poll_timeout, self.RESOLVE_POLL_INTERVAL)
+                if self._map:
+                    try:
+                        asyncore.loop(timeout=poll_timeout, map=self._map, count=1)
+                    except socket.error, e:
+                        if e.args[0] != errno.EINTR:
+                            raise
+                else:
+                    time.sleep(poll_timeout)
+                self._finish_lookups()
+                self._check_timeouts()
+            completed, self._completed = self._completed, []
+            for handler, result in completed:
+                if handler:
+                    handler(result)
@@ -0,0 +1,298 @@
+import sys
+import threading
+import time
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+from backlinks.conf import settings
+from backlinks.utils import canonicalize_url
+
+# Indexes into the linked list entries of LRUCache
+PREV, NEXT, KEY, VALUE, EXPIRES = 0, 1, 2, 3, 4
+
+
+class LRUCache(object):
+    """
+    A thread-safe, size-bounded mapping whose entries may expire. When full,
+    the least recently used entry is evicted.
+
+    """
+    def __init__(self, max_size, timeout=None):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._entries = {}
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None, None]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _unlink(self, entry):
+        entry[PREV][NEXT] = entry[NEXT]
+        entry[NEXT][PREV] = entry[PREV]
+
+    def _link(self, entry):
+        # Link the entry in as the most recently used
+        root = self._root
+        last = root[PREV]
+        entry[PREV], entry[NEXT] = last, root
+        last[NEXT] = root[PREV] = entry
+
+    def get(self, key, default=None):
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if entry[EXPIRES] is not None and entry[EXPIRES] <= time.time():
+                self._unlink(entry)
+                del self._entries[key]
+                return default
+            self._unlink(entry)
+            self._link(entry)
+            return entry[VALUE]
+        finally:
+            self._lock.release()
+
+    def set(self, key, value, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        expires = None
+        if timeout is not None:
+            expires = time.time() + timeout
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._unlink(entry)
+            elif len(self._entries) >= self.max_size:
+                oldest = self._root[NEXT]
+                self._unlink(oldest)
+                del self._entries[oldest[KEY]]
+            entry = [None, None, key, value, expires]
+            self._link(entry)
+            self._entries[key] = entry
+        finally:
+            self._lock.release()
+
+    def delete(self, key):
+        self._lock.acquire()
+        try:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._unlink(entry)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._entries.clear()
+            self._root[:] = [self._root, self._root, None, None, None]
+        finally:
+            self._lock.release()
+
+
+class DiscoveryCache(object):
+    """
+    Caches autodiscovery results by canonical target URL.
+
+    Entries hold the (resource-url, ping-url, protocol-name) discovered for
+    a target, or record that the target has no backlink server. Positive
+    and negative entries expire after ``timeout`` and ``negative_timeout``
+    seconds. Entries are kept in an in-process ``LRUCache`` of ``max_size``
+    entries and, if given, in a shared Django ``cache`` object.
+
+    """
+    NO_ENDPOINT = ('', '', '')
+    KEY_PREFIX = 'backlinks.discovery.'
+
+    def __init__(self, max_size, timeout, negative_timeout, cache=None):
+        self.timeout = timeout
+        self.negative_timeout = negative_timeout
+        self.local = None
+        if max_size:
+            self.local = LRUCache(max_size)
+        self.cache = cache
+
+    def normalize_url(self, url):
+        return canonicalize_url(url)
+
+    def get_cache_key(self, key):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return self.KEY_PREFIX + md5(key).hexdigest()
+
+    def get(self, url):
+        """
+        Return the cached (resource-url, ping-url, protocol-name) tuple for
+        the URL, ``NO_ENDPOINT`` if it is known to have no backlink server,
+        or ``None`` if nothing is cached.
+
+        """
+        key = self.normalize_url(url)
+        if self.local is not None:
+            result = self.local.get(key)
+            if result is not None:
+                return result
+        if self.cache is not None:
+            result = self.cache.get(self.get_cache_key(key))
+            if result is not None:
+                result = tuple(result)
+                if self.local is not None:
+                    timeout = self.timeout
+                    if result == self.NO_ENDPOINT:
+                        timeout = self.negative_timeout
+                    self.local.set(key, result, timeout)
+                return result
+        return None
+
+    def set(self, url, resource_url, ping_url, protocol):
+        self._set(url, (resource_url, ping_url, protocol), self.timeout)
+
+    def set_no_endpoint(self, url):
+        self._set(url, self.NO_ENDPOINT, self.negative_timeout)
+
+    def _set(self, url, result, timeout):
+        key = self.normalize_url(url)
+        if self.local is not None:
+            self.local.set(key, result, timeout)
+        if self.cache is not None:
+            self.cache.set(self.get_cache_key(key), result, timeout)
+
+    def clear(self):
+        if self.local is not None:
+            self.local.clear()
+
+
+class PendingFetch(object):
+    """
+    A fetch in progress, which other threads may wait on for its result.
+
+    """
+    def __init__(self):
+        self.result = None
+        self.exc_info = None
+        self._done = threading.Event()
+
+    def wait(self):
+        self._done.wait()
+        if self.exc_info is not None:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.result
+
+    def finish(self, result=None, exc_info=None):
+        self.result = result
+        self.exc_info = exc_info
+        self._done.set()
+
+
+class SourceCache(object):
+    """
+    Caches fetched source documents by canonical URL for ``timeout``
+    seconds, in an in-process ``LRUCache`` of ``max_size`` entries.
+
+    Concurrent requests for the same URL are coalesced: while one thread
+    fetches it, others wait for and share its result, or the exception it
+    raised. Failed fetches are not cached.
+
+    """
+    def __init__(self, max_size, timeout):
+        self.timeout = timeout
+        self.local = None
+        if max_size and timeout:
+            self.local = LRUCache(max_size, timeout)
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def normalize_url(self, url):
+        return canonicalize_url(url)
+
+    def get(self, url, fetch):
+        """
+        Return the cached document for the URL, calling ``fetch`` with the
+        URL to retrieve it if it is neither cached nor being fetched.
+
+        """
+        key = self.normalize_url(url)
+        if self.local is not None:
+            result = self.local.get(key)
+            if result is not None:
+                return result
+        self._lock.acquire()
+        try:
+            pending = self._pending.get(key)
+            if pending is None:
+                if self.local is not None:
+                    # It may have been cached since it was looked up above
+                    result = self.local.get(key)
+                    if result is not None:
+                        return result
+                pending = self._pending[key] = PendingFetch()
+                fetching = True
+            else:
+                fetching = False
+        finally:
+            self._lock.release()
+        if not fetching:
+            return pending.wait()
+
+        result, exc_info = None, None
+        try:
+            try:
+                result = fetch(url)
+                if self.local is not None and result is not None:
+                    self.local.set(key, result)
+            except:
+                exc_info = sys.exc_info()
+                raise
+        finally:
+            self._lock.acquire()
+            try:
+                del self._pending[key]
+            finally:
+                self._lock.release()
+            pending.finish(result, exc_info)
+        return result
+
+    def clear(self):
+        if self.local is not None:
+            self.local.clear()
+
+
+_default_discovery_cache = None
+
+def get_default_discovery_cache():
+    """
+    Return the process-wide ``DiscoveryCache`` configured by the
+    ``DISCOVERY_CACHE_*`` settings.
+
+    """
+    global _default_discovery_cache
+    if _default_discovery_cache is None:
+        cache = None
+        if settings.DISCOVERY_CACHE_USE_DJANGO_CACHE:
+            from django.core.cache import cache
+        _default_discovery_cache = DiscoveryCache(settings.DISCOVERY_CACHE_SIZE,
+                                                  settings.DISCOVERY_CACHE_TIMEOUT,
+                                                  settings.DISCOVERY_CACHE_NEGATIVE_TIMEOUT,
+                                                  cache)
+    return _default_discovery_cache
+
+_default_source_cache = None
+
+def get_default_source_cache():
+    """
+    Return the process-wide ``SourceCache`` configured by the
+    ``SOURCE_CACHE_*`` settings.
+
+    """
+    global _default_source_cache
+    if _default_source_cache is None:
+        _default_source_cache = SourceCache(settings.SOURCE_CACHE_SIZE,
+                                            settings.SOURCE_CACHE_TIMEOUT)
+    return _default_source_cache
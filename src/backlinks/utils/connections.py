@@ -0,0 +1,92 @@
+import threading
+import time
+
+
+class ConnectionPool(object):
+    """
+    A thread-safe store of idle, persistent connections keyed by host.
+
+    At most ``max_size`` idle connections are kept in total, the least
+    recently used being closed to make room. Connections idle for more than
+    ``idle_timeout`` seconds are closed rather than reused.
+
+    """
+    def __init__(self, max_size=10, idle_timeout=30):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum([len(connections) for connections in self._idle.values()])
+
+    def get(self, key):
+        """
+        Return an idle connection for the key, or ``None`` if there is none.
+
+        """
+        expired = []
+        connection = None
+        self._lock.acquire()
+        try:
+            connections = self._idle.get(key, [])
+            oldest = time.time() - self.idle_timeout
+            while connections:
+                connection, last_used = connections.pop()
+                if last_used >= oldest:
+                    break
+                expired.append(connection)
+                connection = None
+            if not connections:
+                self._idle.pop(key, None)
+        finally:
+            self._lock.release()
+        for expired_connection in expired:
+            expired_connection.close()
+        return connection
+
+    def put(self, key, connection):
+        """
+        Return a connection, which must have no outstanding response, to the
+        pool for later reuse.
+
+        """
+        evicted = []
+        self._lock.acquire()
+        try:
+            if self.max_size:
+                self._idle.setdefault(key, []).append((connection, time.time()))
+                while len(self) > self.max_size:
+                    evicted.append(self._pop_least_recently_used())
+            else:
+                evicted.append(connection)
+        finally:
+            self._lock.release()
+        for evicted_connection in evicted:
+            evicted_connection.close()
+
+    def _pop_least_recently_used(self):
+        # Called with the lock held
+        oldest_key = None
+        for key, connections in self._idle.items():
+            if oldest_key is None or connections[0][1] < self._idle[oldest_key][0][1]:
+                oldest_key = key
+        connections = self._idle[oldest_key]
+        connection, last_used = connections.pop(0)
+        if not connections:
+            del self._idle[oldest_key]
+        return connection
+
+    def clear(self):
+        """
+        Close all idle connections.
+
+        """
+        self._lock.acquire()
+        try:
+            idle, self._idle = self._idle, {}
+        finally:
+            self._lock.release()
+        for connections in idle.values():
+            for connection, last_used in connections:
+                connection.close()
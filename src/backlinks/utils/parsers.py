@@ -1,20 +1,330 @@
-import sgmllib
 import re
+import math
 import htmlentitydefs
 import urlparse
 
+try:
+    import sgmllib
+except ImportError:
+    sgmllib = None
 
-# make sgmllib behave better
-sgmllib.tagfind = re.compile(r'[a-zA-Z][-_.:a-zA-Z0-9]*')
-sgmllib.charref = re.compile(r'&#(?:([0-9]+)[^0-9])|(?:(x[0-9A-Fa-f]+)[^0-9A-Fa-f])')
+from backlinks.conf import settings
 
 
-class BaseParser(sgmllib.SGMLParser):
+class RegexTokenizer(object):
+    """
+    Tokenizes markup by matching each tag, reference and run of text with a
+    single regular expression, passing them on to a ``BaseParser``.
+
+    Markup which may be cut off at the end of the data fed so far, such as
+    an unclosed tag or reference, is held back until more data is fed or
+    the tokenizer is closed. While a tag or comment is held back, only the
+    newly fed data is searched for its end, so feeding a document in many
+    small chunks takes time linear in its length.
+
+    """
+    TEXT_RE = re.compile(r'[^<&]+')
+    STARTTAG_RE = re.compile(r'<([a-zA-Z][-_.:a-zA-Z0-9]*)((?:[^>"\']|"[^"]*"|\'[^\']*\')*)>')
+    PARTIAL_STARTTAG_RE = re.compile(r'<[a-zA-Z][-_.:a-zA-Z0-9]*(?:[^>"\']|"[^"]*"|\'[^\']*\')*(?:("[^"]*)|(\'[^\']*))?\Z')
+    LOOSE_STARTTAG_RE = re.compile(r'<([a-zA-Z][-_.:a-zA-Z0-9]*)([^>]*)>')
+    ENDTAG_RE = re.compile(r'</([a-zA-Z][-_.:a-zA-Z0-9]*)[^>]*>')
+    COMMENT_RE = re.compile(r'<!--.*?-->', re.S)
+    DECLARATION_RE = re.compile(r'<[!?][^>]*>')
+    ATTRIBUTE_RE = re.compile(r'([^\s"\'=/<>]+)(?:\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]*)))?')
+    REF_RE = re.compile(r'&(?:#(x?[0-9a-fA-F]+)|([a-zA-Z][-.a-zA-Z0-9]*));?')
+    PARTIAL_REF_RE = re.compile(r'&(?:#x?[0-9a-fA-F]*|[a-zA-Z][-.a-zA-Z0-9]*)?\Z')
+    MARKUP_START_CHARS = '/!?abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+    def __init__(self, parser):
+        self.parser = parser
+        self.reset()
+
+    def reset(self):
+        self.rawdata = ''
+        self.literal_tag = None
+        self.literal_end_re = None
+        # The string ending a held back construct, the data fed since it was
+        # held back, and the end of the data already searched for it
+        self.wait_for = None
+        self.pending = []
+        self.searched_tail = ''
+
+    def feed(self, data):
+        if self.wait_for is not None:
+            window = self.searched_tail + data
+            if self.wait_for not in window:
+                self.pending.append(data)
+                self.searched_tail = window[len(window) - len(self.wait_for) + 1:]
+                return
+            data = ''.join(self.pending) + data
+            self.wait_for = None
+            self.pending = []
+        self.rawdata = self.rawdata + data
+        self.goahead(False)
+
+    def close(self):
+        if self.pending:
+            self.rawdata = self.rawdata + ''.join(self.pending)
+            self.pending = []
+        self.wait_for = None
+        self.goahead(True)
+
+    def hold(self, rawdata, wait_for):
+        # Called when the data from the held back construct on has been
+        # searched for ``wait_for`` without success
+        self.wait_for = wait_for
+        self.searched_tail = rawdata[len(rawdata) - len(wait_for) + 1:]
+
+    def set_literal(self, tag):
+        self.literal_tag = tag
+        self.literal_end_re = re.compile(r'</%s\s*>' % re.escape(tag), re.I)
+
+    def clear_literal(self):
+        self.literal_tag = None
+        self.literal_end_re = None
+
+    def is_partial_literal_end(self, data):
+        end_tag = '</' + self.literal_tag
+        data = data.lower()
+        return end_tag.startswith(data) or \
+            (data.startswith(end_tag) and not data[len(end_tag):].strip())
+
+    def parse_attributes(self, attributes):
+        attrs = []
+        convert_refs = self.parser.convert_refs
+        for match in self.ATTRIBUTE_RE.finditer(attributes):
+            name, double, single, unquoted = match.groups()
+            value = double
+            if value is None:
+                value = single
+            if value is None:
+                value = unquoted
+            if value is None:
+                # like sgmllib, give valueless attributes their own name
+                value = name
+            attrs.append((name.lower(), convert_refs(value)))
+        return attrs
+
+    def goahead(self, end):
+        rawdata = self.rawdata
+        parser = self.parser
+        i, n = 0, len(rawdata)
+        while i < n:
+            if self.literal_end_re is not None:
+                match = self.literal_end_re.search(rawdata, i)
+                if match is None:
+                    j = n
+                    if not end:
+                        # the end tag may be cut off
+                        j = rawdata.rfind('<', i)
+                        if j == -1 or not self.is_partial_literal_end(rawdata[j:]):
+                            j = n
+                    if j > i:
+                        parser.handle_data(rawdata[i:j])
+                    i = j
+                    break
+                if match.start() > i:
+                    parser.handle_data(rawdata[i:match.start()])
+                i = match.end()
+                parser.handle_endtag(self.literal_tag)
+                continue
+            match = self.TEXT_RE.match(rawdata, i)
+            if match is not None:
+                parser.handle_data(match.group())
+                i = match.end()
+                continue
+            if rawdata[i] == '&':
+                if not end and self.PARTIAL_REF_RE.match(rawdata, i):
+                    break
+                match = self.REF_RE.match(rawdata, i)
+                if match is None:
+                    parser.handle_data('&')
+                    i = i + 1
+                elif match.group(1):
+                    parser.handle_charref(match.group(1))
+                    i = match.end()
+                else:
+                    parser.handle_entityref(match.group(2))
+                    i = match.end()
+                continue
+            next_char = rawdata[i+1:i+2]
+            if next_char and next_char not in self.MARKUP_START_CHARS:
+                parser.handle_data('<')
+                i = i + 1
+                continue
+            if next_char == '/':
+                match = self.ENDTAG_RE.match(rawdata, i)
+                if match is not None:
+                    parser.handle_endtag(match.group(1).lower())
+            elif next_char == '!' and rawdata.startswith('<!--', i):
+                match = self.COMMENT_RE.match(rawdata, i)
+                if match is None:
+                    if not end:
+                        self.hold(rawdata, '-->')
+                        break
+                    i = n
+                    continue
+            elif next_char in ('!', '?'):
+                match = self.DECLARATION_RE.match(rawdata, i)
+            elif next_char:
+                match = self.STARTTAG_RE.match(rawdata, i)
+                if match is None and not end:
+                    partial = self.PARTIAL_STARTTAG_RE.match(rawdata, i)
+                    if partial is not None:
+                        # wait for an open quote to be closed, or the tag
+                        if partial.group(1) is not None:
+                            self.hold(rawdata, '"')
+                        elif partial.group(2) is not None:
+                            self.hold(rawdata, "'")
+                        else:
+                            self.hold(rawdata, '>')
+                        break
+                match = match or self.LOOSE_STARTTAG_RE.match(rawdata, i)
+                if match is not None:
+                    parser.handle_starttag(match.group(1).lower(),
+                                           self.parse_attributes(match.group(2)))
+            if match is not None:
+                i = match.end()
+            elif not end and rawdata.find('>', i) == -1:
+                # an incomplete tag
+                self.hold(rawdata, '>')
+                break
+            else:
+                parser.handle_data('<')
+                i = i + 1
+        self.rawdata = rawdata[i:]
+
+
+if sgmllib is not None:
+    # make sgmllib behave better
+    sgmllib.tagfind = re.compile(r'[a-zA-Z][-_.:a-zA-Z0-9]*')
+    sgmllib.charref = re.compile(r'&#(?:([0-9]+)[^0-9])|(?:(x[0-9A-Fa-f]+)[^0-9A-Fa-f])')
+
+    class SGMLTokenizer(sgmllib.SGMLParser):
+        """
+        Tokenizes markup with ``sgmllib.SGMLParser``. Slower than
+        ``RegexTokenizer``, and missing from newer Pythons, but kept as a
+        fallback for markup it copes with better.
+
+        """
+        MALFORMED_SELF_CLOSING_RE = re.compile('(<[^<>]*)/>')
+        MALFORMED_COMMENT_RE = re.compile('<!\s+([^<>]*)>')
+        DELIMITER_RE = re.compile('[<>]')
+
+        def __init__(self, parser):
+            self.parser = parser
+            self.entity_or_charref = parser.entity_or_charref
+            sgmllib.SGMLParser.__init__(self)
+
+        def reset(self):
+            # Data from the last '<' not followed by a '>', not yet corrected
+            self.unfixed = []
+            sgmllib.SGMLParser.reset(self)
+
+        def fix(self, data):
+            data = self.MALFORMED_SELF_CLOSING_RE.sub(lambda x: x.group(1) + ' />', data)
+            return self.MALFORMED_COMMENT_RE.sub(lambda x: '<!' + x.group(1) + '>', data)
+
+        def feed(self, data):
+            """
+            Corrects several minor defects which can halt ``sgmllib.SGMLParser``.
+
+            Each correction is confined to the text between a '<' and the
+            next '>', so data is corrected as it arrives, except for a tag
+            or comment left open at its end. That is held back, and only
+            corrected once data containing the next '<' or '>' arrives, so
+            that each character is corrected once. Likewise, while a comment
+            is open, ``sgmllib`` only looks for its end again once data
+            containing '-->' arrives.
+
+            """
+            head = ''
+            if self.unfixed:
+                match = self.DELIMITER_RE.search(data)
+                if match is None:
+                    self.unfixed.append(data)
+                    return
+                head = ''.join(self.unfixed)
+                self.unfixed = []
+                if match.group() == '>':
+                    head = self.fix(head + data[:match.end()])
+                    data = data[match.end():]
+            start = data.rfind('<')
+            if start != -1 and data.find('>', start) == -1:
+                self.unfixed.append(data[start:])
+                data = data[:start]
+            data = head + self.fix(data)
+            self.rawdata = self.rawdata + data
+            if self.rawdata.startswith('<!--') and \
+                    '-->' not in self.rawdata[-len(data) - 2:]:
+                return
+            self.goahead(0)
+
+        def close(self):
+            self.rawdata = self.rawdata + ''.join(self.unfixed)
+            self.unfixed = []
+            sgmllib.SGMLParser.close(self)
+
+        def finish_starttag(self, tag, attrs):
+            self.parser.handle_starttag(tag, attrs)
+
+        def finish_endtag(self, tag):
+            if tag:
+                self.parser.handle_endtag(tag)
+
+        def handle_data(self, data):
+            self.parser.handle_data(data)
+
+        def handle_charref(self, name):
+            self.parser.handle_charref(name)
+
+        def handle_entityref(self, name):
+            self.parser.handle_entityref(name)
+
+        def _convert_ref(self, match):
+            return self.parser._convert_ref(match)
+
+        def set_literal(self, tag):
+            self.literal = True
+
+        def clear_literal(self):
+            self.literal = False
+
+
+TOKENIZERS = {
+    'regex': RegexTokenizer,
+}
+if sgmllib is not None:
+    TOKENIZERS['sgmllib'] = SGMLTokenizer
+
+# Errors raised by the tokenizer backends on markup they cannot parse
+PARSE_ERRORS = ()
+if sgmllib is not None:
+    PARSE_ERRORS = (sgmllib.SGMLParseError,)
+
+
+def get_tokenizer_class(backend=None):
+    """
+    Returns the tokenizer class for the named backend, ``'regex'`` or
+    ``'sgmllib'``, defaulting to the ``PARSER_BACKEND`` setting.
+
+    """
+    backend = backend or settings.PARSER_BACKEND
+    try:
+        return TOKENIZERS[backend]
+    except KeyError:
+        raise ValueError('Unknown or unavailable parser backend: %r' % backend)
+
+
+class BaseParser(object):
     """
     A more robust base markup parser.
 
-    Fixes several common markup errors that cause SGMLParser to choke. Treats text
-    enclosed in ``script`` and ``textarea`` as data. Normalizes entity references.
+    Markup is tokenized by one of the ``TOKENIZERS`` backends, and tags are
+    dispatched to ``start_<tag>`` and ``end_<tag>`` methods, or else to
+    ``unknown_starttag`` and ``unknown_endtag``, as with ``sgmllib``. Treats
+    text enclosed in ``script`` and ``textarea`` as data. Normalizes entity
+    references.
 
     """
     entity_or_charref = re.compile(r'&(?:'
@@ -34,40 +344,70 @@ class BaseParser(sgmllib.SGMLParser):
         'x3e': 'gt',
     }
 
-    MALFORMED_SELF_CLOSING_RE = re.compile('(<[^<>]*)/>')
-    MALFORMED_COMMENT_RE = re.compile('<!\s+([^<>]*)>')
-    
-    def __init__(self, quote_tags=('script', 'textarea')):
+    def __init__(self, quote_tags=('script', 'textarea'), backend=None):
         self.quote_tags = quote_tags
-        sgmllib.SGMLParser.__init__(self)
+        self.tokenizer = get_tokenizer_class(backend)(self)
+        self.reset()
 
     def reset(self):
-        sgmllib.SGMLParser.reset(self)
+        self.tokenizer.reset()
         self.quote_tag_stack = []
+        self.literal = False
 
     def feed(self, data):
-        """
-        Corrects several minor defects which can halt ``sgmllib.SGMLParser``.
+        self.tokenizer.feed(data)
 
-        """
-        self.rawdata = self.rawdata + data
-        self.rawdata = self.MALFORMED_SELF_CLOSING_RE.sub(lambda x: x.group(1) + ' />', self.rawdata)
-        self.rawdata = self.MALFORMED_COMMENT_RE.sub(lambda x: '<!' + x.group(1) + '>', self.rawdata)
-        self.goahead(0)
+    def close(self):
+        self.tokenizer.close()
+
+    def handle_starttag(self, tag, attrs):
+        method = getattr(self, 'start_' + tag, None)
+        if method is not None:
+            method(attrs)
+        else:
+            self.unknown_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        method = getattr(self, 'end_' + tag, None)
+        if method is not None:
+            method()
+        else:
+            self.unknown_endtag(tag)
+
+    def handle_data(self, data):
+        pass
+
+    def handle_charref(self, name):
+        replacement = self.convert_charref(name)
+        if replacement is not None:
+            self.handle_data(replacement)
+
+    def handle_entityref(self, name):
+        replacement = self.convert_entityref(name)
+        if replacement is not None:
+            self.handle_data(replacement)
 
     def unknown_starttag(self, tag, attrs):
         if tag in self.quote_tags:
             self.quote_tag_stack.append(tag)
             self.literal = True
+            self.tokenizer.set_literal(tag)
 
     def unknown_endtag(self, tag):
         if self.quote_tag_stack and self.quote_tag_stack[-1] == tag:
             self.quote_tag_stack.pop()
             self.literal = (len(self.quote_tag_stack) > 0)
+            if not self.literal:
+                self.tokenizer.clear_literal()
 
     def convert_codepoint(self, codepoint):
         return unichr(codepoint)
 
+    def convert_refs(self, value):
+        if '&' not in value:
+            return value
+        return self.entity_or_charref.sub(self._convert_ref, value)
+
     def _convert_ref(self, match):
         if match.group(2):
             return self.convert_charref(match.group(2)) or \
@@ -109,26 +449,51 @@ class BaseParser(sgmllib.SGMLParser):
 
 class LinkParser(BaseParser):
     """
-    Parses out the value of the ``href`` attribute in all found ``a`` tags.
+    Parses out the value of the ``href`` attribute in all found ``a`` tags,
+    once each, in the order they are first found.
 
     """
-    def __init__(self):
-        BaseParser.__init__(self)
+    CHUNK_SIZE = 8192
+
+    def __init__(self, backend=None):
+        BaseParser.__init__(self, backend=backend)
 
     def reset(self):
         BaseParser.reset(self)
         self.links = []
+        self.seen_links = set()
 
     def start_a(self, attrs):
         for k, v in attrs:
             if k.lower() == 'href':
-                if v not in self.links:
+                if v not in self.seen_links:
+                    self.seen_links.add(v)
                     self.links.append(v)
 
     def parse(self, doc):
         self.feed(doc)
+        self.close()
         return self.links
 
+    def iterparse(self, doc, chunk_size=None):
+        """
+        Feeds the document ``chunk_size`` characters at a time, yielding the
+        links found in each chunk before parsing the next, so that callers
+        may stop parsing once they have found what they are looking for.
+
+        """
+        chunk_size = chunk_size or self.CHUNK_SIZE
+        yielded = 0
+        for start in xrange(0, len(doc), chunk_size):
+            self.feed(doc[start:start + chunk_size])
+            while yielded < len(self.links):
+                yield self.links[yielded]
+                yielded = yielded + 1
+        self.close()
+        while yielded < len(self.links):
+            yield self.links[yielded]
+            yielded = yielded + 1
+
 
 class HttpLinkParser(LinkParser):
     """
@@ -136,8 +501,12 @@ class HttpLinkParser(LinkParser):
 
     """
     def parse(self, doc):
-        self.feed(doc)
-        return filter(lambda url: url.lower().startswith('http://'), self.links)
+        return list(self.iterparse(doc))
+
+    def iterparse(self, doc, chunk_size=None):
+        for link in LinkParser.iterparse(self, doc, chunk_size):
+            if link.lower().startswith('http://'):
+                yield link
 
 
 class TitleParser(BaseParser):
@@ -178,6 +547,7 @@ class TitleParser(BaseParser):
 
     def parse(self, data):
         self.feed(data)
+        self.close()
         return self.title or (self.most_prominent_heading and self.most_prominent_heading[1]) or ''
 
 
@@ -187,8 +557,8 @@ class ContextualExcerptParser(BaseParser):
     number of words.
 
     """
-    def __init__(self):
-        BaseParser.__init__(self)
+    def __init__(self, backend=None):
+        BaseParser.__init__(self, backend=backend)
     
     def reset(self):
         BaseParser.reset(self)
@@ -221,6 +591,7 @@ class ContextualExcerptParser(BaseParser):
         """
         self.target_url = target_url
         self.feed(doc)
+        self.close()
         return self.build_excerpts(max_words)
 
     def build_excerpts(self, max_words):
@@ -228,44 +599,120 @@ class ContextualExcerptParser(BaseParser):
         Returns a list of excerpts that are less than ``max_words`` in length.
 
         """
-        import math
-        parts = self.parts
-        excerpts = []
-        for start, end in self.found_target_links:
-            split_words = []
-            for segment in parts[start:end+1]:
-                split_words.extend(segment.split())
-                pieces = split_words
-                initial_count = len(split_words)
-                if initial_count > max_words:
-                    pieces = split_words[:max_words]
-                elif initial_count < max_words:
-                    # gather pieces from neighbors
-                    half_num_left = float(max_words - initial_count) / 2.0
-                    num_left_words, num_right_words = int(math.ceil(half_num_left)), int(math.floor(half_num_left))
-                    left_words, right_words = [], []
-                    left_index, right_index = start, end
-                    while len(left_words) < num_left_words:
-                        left_index = left_index - 1
-                        if left_index < 0:
-                            num_right_words = num_right_words + (num_left_words - len(left_words))
-                            break
-                        left_pieces = parts[left_index].split()
-                        if left_pieces:
-                            lindex = min(len(left_pieces), num_left_words - len(left_words))
-                            new_pieces = left_pieces[-lindex:]
-                            new_pieces.extend(left_words)
-                            left_words = new_pieces
-                    while len(right_words) < num_right_words:
-                        right_index = right_index + 1
-                        if right_index >= len(parts):
-                            break
-                        right_pieces = parts[right_index].split()
-                        if right_pieces:
-                            rindex = min(len(right_pieces), num_right_words - len(right_words))
-                            right_words.extend(right_pieces[:rindex])
-                    pieces = left_words
-                    pieces.extend(split_words)
-                    pieces.extend(right_words)
-            excerpts.append(' '.join(pieces))
-        return excerpts
+        return build_excerpts(self.parts, self.found_target_links, max_words)
+
+
+class DocumentParser(BaseParser):
+    """
+    Collects the links, title and text of a document in a single pass.
+
+    ``links`` lists the ``href`` values of all ``a`` tags in document order,
+    and ``link_spans`` the (href, start, end) indexes into ``parts`` of the
+    text in and around each of them, as used by ``build_excerpts``.
+
+    """
+    HEADING_TAGS = TitleParser.HEADING_TAGS
+
+    def reset(self):
+        BaseParser.reset(self)
+        self.links = []
+        self.link_spans = []
+        self.parts = []
+        self.title = ''
+        self.in_title = False
+        self.in_heading = False
+        self.most_prominent_heading = [None, '']
+        self.open_links = []
+
+    def start_title(self, attrs):
+        self.in_title = True
+
+    def end_title(self):
+        self.in_title = False
+
+    def start_a(self, attrs):
+        href = None
+        for k, v in attrs:
+            if k.lower() == 'href':
+                href = v
+        if href is not None:
+            self.links.append(href)
+        self.open_links.append((href, len(self.parts) - 1))
+
+    def end_a(self):
+        if self.open_links:
+            href, start = self.open_links.pop()
+            if href is not None:
+                self.link_spans.append((href, start, len(self.parts) - 1))
+
+    def unknown_starttag(self, tag, attrs):
+        BaseParser.unknown_starttag(self, tag, attrs)
+        if tag in self.HEADING_TAGS:
+            level, contents = self.most_prominent_heading
+            if not level or int(tag[1]) < int(level[1]):
+                self.in_heading = True
+                self.most_prominent_heading = [tag, '']
+
+    def unknown_endtag(self, tag):
+        BaseParser.unknown_endtag(self, tag)
+        if tag in self.HEADING_TAGS:
+            self.in_heading = False
+
+    def handle_data(self, data):
+        if self.in_title:
+            self.title = self.title + data
+        elif self.in_heading:
+            self.most_prominent_heading[1] = self.most_prominent_heading[1] + data
+        if not self.literal:
+            self.parts.append(data)
+
+    def get_title(self):
+        return self.title or self.most_prominent_heading[1] or ''
+
+
+def build_excerpts(parts, spans, max_words):
+    """
+    Returns a list of excerpts of up to ``max_words`` words of the text
+    ``parts`` in and around each (start, end) span of them.
+
+    """
+    excerpts = []
+    for start, end in spans:
+        start = max(start, 0)
+        split_words, pieces = [], []
+        for segment in parts[start:end+1]:
+            split_words.extend(segment.split())
+            pieces = split_words
+            initial_count = len(split_words)
+            if initial_count > max_words:
+                pieces = split_words[:max_words]
+            elif initial_count < max_words:
+                # gather pieces from neighbors
+                half_num_left = float(max_words - initial_count) / 2.0
+                num_left_words, num_right_words = int(math.ceil(half_num_left)), int(math.floor(half_num_left))
+                left_words, right_words = [], []
+                left_index, right_index = start, end
+                while len(left_words) < num_left_words:
+                    left_index = left_index - 1
+                    if left_index < 0:
+                        num_right_words = num_right_words + (num_left_words - len(left_words))
+                        break
+                    left_pieces = parts[left_index].split()
+                    if left_pieces:
+                        lindex = min(len(left_pieces), num_left_words - len(left_words))
+                        new_pieces = left_pieces[-lindex:]
+                        new_pieces.extend(left_words)
+                        left_words = new_pieces
+                while len(right_words) < num_right_words:
+                    right_index = right_index + 1
+                    if right_index >= len(parts):
+                        break
+                    right_pieces = parts[right_index].split()
+                    if right_pieces:
+                        rindex = min(len(right_pieces), num_right_words - len(right_words))
+                        right_words.extend(right_pieces[:rindex])
+                pieces = left_words
+                pieces.extend(split_words)
+                pieces.extend(right_words)
+        excerpts.append(' '.join(pieces))
+    return excerpts
@@ -0,0 +1,122 @@
+import threading
+import time
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+from backlinks.conf import settings
+
+
+class HostRateLimiter(object):
+    """
+    Spaces out requests to each host with a token bucket per host, allowing
+    bursts of up to ``burst`` requests and a sustained ``rate`` of requests
+    per second. A ``rate`` of ``None`` or ``0`` disables limiting.
+
+    Buckets are kept in-process. If a Django ``cache`` is given, requests are
+    also counted in it, in windows of ``burst / rate`` seconds, so that the
+    limit holds across all processes using the cache.
+
+    """
+    KEY_PREFIX = 'backlinks.ratelimit.'
+    # Number of hosts tracked before buckets which have refilled are dropped
+    MAX_HOSTS = 1000
+
+    def __init__(self, rate, burst=1, cache=None):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.cache = cache
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _prune(self, now):
+        # Called with the lock held
+        refill_time = self.burst / float(self.rate)
+        for host, (tokens, last) in self._buckets.items():
+            if now - last >= refill_time:
+                del self._buckets[host]
+
+    def reserve(self, host, now=None):
+        """
+        Take a token from the host's bucket and return the number of seconds
+        to wait before making the request it allows.
+
+        """
+        if not self.rate:
+            return 0
+        now = now or time.time()
+        self._lock.acquire()
+        try:
+            if len(self._buckets) >= self.MAX_HOSTS:
+                self._prune(now)
+            tokens, last = self._buckets.get(host, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate) - 1
+            self._buckets[host] = (tokens, now)
+        finally:
+            self._lock.release()
+        if tokens >= 0:
+            return 0
+        return -tokens / self.rate
+
+    def get_cache_key(self, host, window):
+        if isinstance(host, unicode):
+            host = host.encode('utf-8')
+        return '%s%s.%d' % (self.KEY_PREFIX, md5(host).hexdigest(), window)
+
+    def reserve_shared(self, host, now=None):
+        """
+        Count a request to the host in the shared cache and return the
+        number of seconds until the next window if the current one is full.
+
+        """
+        if not self.rate or self.cache is None:
+            return 0
+        now = now or time.time()
+        window_length = self.burst / float(self.rate)
+        window = int(now / window_length)
+        key = self.get_cache_key(host, window)
+        self.cache.add(key, 0, int(window_length) + 1)
+        try:
+            count = self.cache.incr(key)
+        except ValueError:
+            # The key was evicted in between
+            self.cache.set(key, 1, int(window_length) + 1)
+            count = 1
+        if count <= self.burst:
+            return 0
+        return (window + 1) * window_length - now
+
+    def wait(self, host):
+        """
+        Block until a request to the host is allowed.
+
+        """
+        delay = self.reserve(host)
+        if delay:
+            time.sleep(delay)
+        while True:
+            delay = self.reserve_shared(host)
+            if not delay:
+                break
+            time.sleep(delay)
+
+
+_default_rate_limiter = None
+
+def get_default_rate_limiter():
+    """
+    Return the process-wide ``HostRateLimiter`` configured by the
+    ``RATE_LIMIT_*`` settings.
+
+    """
+    global _default_rate_limiter
+    if _default_rate_limiter is None:
+        cache = None
+        if settings.RATE_LIMIT_USE_DJANGO_CACHE:
+            from django.core.cache import cache
+        _default_rate_limiter = HostRateLimiter(settings.RATE_LIMIT_RATE,
+                                                settings.RATE_LIMIT_BURST,
+                                                cache)
+    return _default_rate_limiter
@@ -1,12 +1,92 @@
 import urllib
 import urllib2
+import httplib
 import zlib
+import errno
 import socket
+import time
 import re
 
+from backlinks.utils.connections import ConnectionPool
+
 CHARSET_RE = re.compile(r'charset=([-\w]+)', re.IGNORECASE)
 
+# Requests which may be sent again if a reused connection was found closed
+IDEMPOTENT_METHODS = ('GET', 'HEAD')
+
+try:
+    memoryview
+except NameError:
+    # Python < 2.7
+    memoryview = buffer
+
+def get_deadline_timeout(req, timeout):
+    """
+    Returns the given timeout, shortened to the time left before the
+    request's ``deadline``, if it has one, or ``None`` for no timeout.
+    Raises ``socket.timeout`` if the deadline has passed.
+
+    """
+    if timeout is socket._GLOBAL_DEFAULT_TIMEOUT:
+        timeout = None
+    deadline = getattr(req, 'deadline', None)
+    if deadline is None:
+        return timeout
+    remaining = deadline - time.time()
+    if remaining <= 0:
+        raise socket.timeout('Deadline exceeded')
+    if timeout is None:
+        return remaining
+    return min(timeout, remaining)
+
+
+class TimeoutConnectionMixin(object):
+    """
+    Gives an ``httplib`` connection separate connect and read timeouts.
+
+    """
+    def connect(self):
+        if self.connect_timeout is not None:
+            self.timeout = self.connect_timeout
+        self.base_class.connect(self)
+        if self.read_timeout is not None:
+            self.sock.settimeout(self.read_timeout)
+
+class TimeoutHTTPConnection(TimeoutConnectionMixin, httplib.HTTPConnection):
+    base_class = httplib.HTTPConnection
+
+    def __init__(self, host, connect_timeout=None, read_timeout=None, **kwargs):
+        httplib.HTTPConnection.__init__(self, host, **kwargs)
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+if hasattr(httplib, 'HTTPSConnection'):
+    class TimeoutHTTPSConnection(TimeoutConnectionMixin, httplib.HTTPSConnection):
+        base_class = httplib.HTTPSConnection
+
+        def __init__(self, host, connect_timeout=None, read_timeout=None, **kwargs):
+            httplib.HTTPSConnection.__init__(self, host, **kwargs)
+            self.connect_timeout = connect_timeout
+            self.read_timeout = read_timeout
+else:
+    TimeoutHTTPSConnection = None
+
+
 class SmartRedirectHandler(urllib2.HTTPRedirectHandler):
+    """
+    Records the status of followed redirects, and carries the request's
+    connect timeout and deadline over to the redirected request.
+
+    """
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        get_deadline_timeout(req, None)
+        new = urllib2.HTTPRedirectHandler.redirect_request(self, req, fp, code, msg,
+                                                           headers, newurl)
+        if new is not None:
+            new.connect_timeout = getattr(req, 'connect_timeout', None)
+            new.deadline = getattr(req, 'deadline', None)
+        return new
+
     def http_error_301(self, req, fp, code, msg, headers):
         result = urllib2.HTTPRedirectHandler.http_error_301(self, req, fp, code, msg, headers)
         result.status = code
@@ -25,54 +105,371 @@ class DefaultErrorHandler(urllib2.HTTPDefaultErrorHandler):
         return result
 
 
-class GzipStream(object):
-    def __init__(self, fp):
-        self.buf = ''
+class DeadlineSocket(object):
+    """
+    Wraps a connected socket so that each receive times out once the
+    request's ``deadline`` has passed, even if data keeps trickling in.
+
+    """
+    def __init__(self, sock, req):
+        self.sock = sock
+        self.req = req
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+    def recv(self, bufsize, *args):
+        self.sock.settimeout(get_deadline_timeout(self.req, getattr(self.req, 'timeout', None)))
+        return self.sock.recv(bufsize, *args)
+
+    def makefile(self, mode='r', bufsize=-1):
+        return socket._fileobject(self, mode, bufsize)
+
+
+class PooledResponse(object):
+    """
+    Wraps an ``httplib.HTTPResponse`` read over a pooled connection, and
+    returns the connection to its pool once the response has been read.
+
+    A response closed before it has been read is drained if at most
+    ``DRAIN_LIMIT`` bytes remain; otherwise its connection is closed.
+
+    """
+    DRAIN_LIMIT = 16384
+
+    def __init__(self, response, connection, pool, key):
+        self.response = response
+        self.connection = connection
+        self.pool = pool
+        self.key = key
+
+    def read(self, amt=None):
+        data = self.response.read(amt)
+        if self.response.isclosed():
+            self.release()
+        return data
+
+    recv = read
+
+    def release(self):
+        if self.connection is None:
+            return
+        connection, self.connection = self.connection, None
+        if self.response.isclosed() and not self.response.will_close:
+            self.pool.put(self.key, connection)
+        else:
+            self.response.close()
+            connection.close()
+
+    def close(self):
+        response = self.response
+        if self.connection is not None and not response.isclosed() and not response.will_close:
+            if response.length is None or response.length <= self.DRAIN_LIMIT:
+                try:
+                    response.read(self.DRAIN_LIMIT)
+                except (socket.error, httplib.HTTPException):
+                    pass
+        self.release()
+
+
+def is_closed_connection_error(error):
+    """
+    Returns whether an error raised sending a request over a reused
+    connection shows that the server had closed the connection before any
+    of the response was read, as opposed to a timeout or a failure later on.
+
+    """
+    if isinstance(error, socket.timeout):
+        return False
+    if isinstance(error, httplib.BadStatusLine):
+        # The line is empty, quoted or, on newer versions of httplib, a
+        # message saying the connection was closed
+        return not error.line.strip("'") or 'closed the connection' in error.line
+    if isinstance(error, socket.error):
+        return bool(error.args) and error.args[0] in (errno.ECONNRESET, errno.EPIPE)
+    return False
+
+
+class PooledConnectionMixin(object):
+    """
+    Makes an ``urllib2`` HTTP handler send requests over persistent HTTP/1.1
+    connections kept in its ``pool``.
+
+    A GET or HEAD request is sent again, once, over a new connection if the
+    server turns out to have closed the reused connection before responding.
+    Other methods, timeouts and errors after the response began are not
+    retried.
+
+    """
+    def get_connection(self, http_class, req):
+        kwargs = {}
+        read_timeout = get_deadline_timeout(req, getattr(req, 'timeout', None))
+        connect_timeout = getattr(req, 'connect_timeout', None) or read_timeout
+        kwargs['connect_timeout'] = get_deadline_timeout(req, connect_timeout)
+        kwargs['read_timeout'] = read_timeout
+        if getattr(self, '_context', None) is not None:
+            kwargs['context'] = self._context
+        return http_class(req.get_host(), **kwargs)
+
+    def prepare_connection(self, connection, req):
+        # Reused connections get this request's read timeout
+        if isinstance(connection.sock, DeadlineSocket):
+            connection.sock = connection.sock.sock
+        if connection.sock is not None:
+            timeout = get_deadline_timeout(req, getattr(req, 'timeout', None))
+            if timeout is not None:
+                connection.sock.settimeout(timeout)
+
+    def do_open(self, http_class, req):
+        if getattr(req, '_tunnel_host', None):
+            # Proxy tunnels are not pooled
+            return urllib2.AbstractHTTPHandler.do_open(self, http_class, req)
+        key = (req.get_type(), req.get_host())
+        headers = dict(req.unredirected_hdrs)
+        headers.update(dict([(k, v) for k, v in req.headers.items() if k not in headers]))
+        headers['Connection'] = 'keep-alive'
+        headers = dict([(name.title(), value) for name, value in headers.items()])
+
+        connection = self.pool.get(key)
+        reused = connection is not None
+        while True:
+            try:
+                if connection is None:
+                    connection = self.get_connection(http_class, req)
+                else:
+                    self.prepare_connection(connection, req)
+                connection.request(req.get_method(), req.get_selector(), req.data, headers)
+                if getattr(req, 'deadline', None) is not None:
+                    connection.sock = DeadlineSocket(connection.sock, req)
+                response = connection.getresponse()
+                break
+            except (socket.error, httplib.HTTPException), e:
+                if connection is not None:
+                    connection.close()
+                connection = None
+                if not reused or req.get_method() not in IDEMPOTENT_METHODS or \
+                        not is_closed_connection_error(e):
+                    raise urllib2.URLError(e)
+                # The server closed the idle connection; retry once over a
+                # new one.
+                reused = False
+
+        pooled = PooledResponse(response, connection, self.pool, key)
+        fp = socket._fileobject(pooled, close=True)
+        resp = urllib.addinfourl(fp, response.msg, req.get_full_url())
+        resp.code = response.status
+        resp.msg = response.reason
+        return resp
+
+
+class PooledHTTPHandler(PooledConnectionMixin, urllib2.HTTPHandler):
+    def __init__(self, pool, debuglevel=0):
+        urllib2.HTTPHandler.__init__(self, debuglevel)
+        self.pool = pool
+
+    def http_open(self, req):
+        return self.do_open(TimeoutHTTPConnection, req)
+
+
+if hasattr(httplib, 'HTTPSConnection'):
+    class PooledHTTPSHandler(PooledConnectionMixin, urllib2.HTTPSHandler):
+        def __init__(self, pool, debuglevel=0):
+            urllib2.HTTPSHandler.__init__(self, debuglevel)
+            self.pool = pool
+
+        def https_open(self, req):
+            return self.do_open(TimeoutHTTPSConnection, req)
+else:
+    PooledHTTPSHandler = None
+
+
+class DecompressionError(IOError):
+    pass
+
+
+class DecompressingStream(object):
+    """
+    Decodes a ``gzip`` or ``deflate`` encoded stream as it is read, reading
+    at most ``WINDOW`` bytes of encoded data at a time.
+
+    Decoding stops, as if the stream had ended, once ``max_size`` bytes
+    have been decoded, or once more than ``max_ratio`` times as many bytes
+    have been decoded as were read, and ``limit_exceeded`` is then set.
+    Corrupt data raises ``DecompressionError``.
+
+    """
+    WINDOW = 16384
+    # Most bytes decoded by a single call to the decompressor
+    OUTPUT_WINDOW = 65536
+    # Bytes decoded before the compression ratio is checked
+    RATIO_GRACE = 16384
+
+    def __init__(self, fp, encoding='gzip', max_size=None, max_ratio=None):
         self.fp = fp
-        self.dc = zlib.decompressobj(16+zlib.MAX_WBITS)
-    
-    def read(self, max_length=None):
-        # Prime the read buffer
-        buf_len = len(self.buf)
-        # Make sure we grab enough compressed data
-        chunk_size = (max_length + 1024) if max_length else 0
-        if (buf_len < chunk_size) or buf_len == 0:
-            if max_length:
-                self.buf = self.buf + self.fp.read(chunk_size - buf_len)
-            else:
-                self.buf = self.fp.read()
-        # Decompress read buffer
-        if len(self.buf) > 0:
-            if max_length:
-                result = self.dc.decompress(self.buf, max_length)
-                self.buf = self.dc.unconsumed_tail
-            else:
-                result = self.dc.decompress(self.buf)
+        self.encoding = encoding
+        self.max_size = max_size
+        self.max_ratio = max_ratio
+        if encoding == 'deflate':
+            self.dc = zlib.decompressobj()
         else:
-            result = self.dc.flush()
-        return result
+            self.dc = zlib.decompressobj(16+zlib.MAX_WBITS)
+        self.raw_deflate = False
+        self.input = ''
+        self.bytes_read = 0
+        self.bytes_decoded = 0
+        self.eof = False
+        self.limit_exceeded = False
+
+    def decompress(self, data, max_length):
+        try:
+            try:
+                return self.dc.decompress(data, max_length)
+            except zlib.error:
+                if self.encoding != 'deflate' or self.raw_deflate or self.bytes_decoded:
+                    raise
+                # Some servers send deflate data without the zlib header
+                self.raw_deflate = True
+                self.dc = zlib.decompressobj(-zlib.MAX_WBITS)
+                return self.dc.decompress(data, max_length)
+        except zlib.error, e:
+            raise DecompressionError('Invalid %s data: %s' % (self.encoding, e))
+
+    def read(self, max_length=None):
+        output = []
+        length = 0
+        while not self.eof and (max_length is None or length < max_length):
+            if not self.input:
+                self.input = self.fp.read(self.WINDOW)
+                self.bytes_read = self.bytes_read + len(self.input)
+                if not self.input:
+                    self.eof = True
+                    break
+            limit = self.OUTPUT_WINDOW
+            if max_length is not None:
+                limit = min(limit, max_length - length)
+            if self.max_size is not None:
+                # Decode a byte more than allowed to tell if there are more
+                limit = min(limit, self.max_size - self.bytes_decoded + 1)
+            data = self.decompress(self.input, limit)
+            self.input = self.dc.unconsumed_tail
+            if self.dc.unused_data:
+                # Anything after the end of the compressed data is ignored
+                self.input = ''
+                self.eof = True
+            self.bytes_decoded = self.bytes_decoded + len(data)
+            if self.max_size is not None and self.bytes_decoded > self.max_size:
+                data = data[:len(data) - (self.bytes_decoded - self.max_size)]
+                self.bytes_decoded = self.max_size
+                self.limit_exceeded = self.eof = True
+            elif self.max_ratio and self.bytes_decoded > self.RATIO_GRACE and \
+                    self.bytes_decoded > self.max_ratio * (self.bytes_read - len(self.input)):
+                self.limit_exceeded = self.eof = True
+            output.append(data)
+            length = length + len(data)
+        return ''.join(output)
+
+
+class BodyBuffer(object):
+    """
+    Holds a response body as the list of chunks it was read in. The chunks
+    are only joined when the whole body is asked for, so reading a body in
+    many small pieces costs no more than reading it all at once.
+
+    """
+    def __init__(self):
+        self.chunks = []
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def append(self, chunk):
+        if chunk:
+            self.chunks.append(chunk)
+            self.length = self.length + len(chunk)
+
+    def getvalue(self):
+        if len(self.chunks) > 1:
+            self.chunks = [''.join(self.chunks)]
+        return self.chunks and self.chunks[0] or ''
+
+    def getview(self, start=0, end=None):
+        """
+        Returns a read-only ``memoryview`` of the body, or part of it. The
+        chunks are joined into a single string on the first access, as by
+        ``getvalue``; the view and any later ones share that string without
+        copying it again.
+
+        """
+        return memoryview(self.getvalue())[start:end]
 
 
 class ResponseWrapper(object):
-    def __init__(self, response):
+    """
+    Wraps an ``urllib2`` response, keeping the body read from it in a
+    ``BodyBuffer``. ``gzip`` and ``deflate`` encoded bodies are decoded as
+    they are read by a ``DecompressingStream``, limited to
+    ``MAX_DECOMPRESSED_LENGTH`` bytes and a ``MAX_COMPRESSION_RATIO``.
+
+    At most ``max_length`` bytes of the body are read in total, if given.
+    ``bytes_read`` is the number of bytes read so far, ``finished`` is set
+    once the end of the body or the limit has been reached, and
+    ``truncated`` is set if the body went on past the limit.
+
+    """
+    MAX_LENGTH = None
+    MAX_DECOMPRESSED_LENGTH = None
+    MAX_COMPRESSION_RATIO = None
+
+    def __init__(self, response, max_length=None):
         self.raw_response = response
         self.url = response.url
         self.fp = response.fp
         self.headers = response.headers
-        if self.headers.getheader('content-encoding', None) == 'gzip':
-            self.stream = GzipStream(self.fp)
+        encoding = (self.headers.getheader('content-encoding', None) or '').strip().lower()
+        if encoding in ('gzip', 'x-gzip', 'deflate'):
+            self.stream = DecompressingStream(self.fp, encoding.replace('x-', ''),
+                                              self.MAX_DECOMPRESSED_LENGTH,
+                                              self.MAX_COMPRESSION_RATIO)
             self._read = self.stream.read
         else:
             self.stream = None
             self._read = self.fp.read
-        self._body = ''
+        self.max_length = max_length or self.MAX_LENGTH
+        self.buffer = BodyBuffer()
+        self.finished = False
+        self.truncated = False
         self._charset = None
 
     def read(self, max_length=None):
+        """
+        Reads and returns up to ``max_length`` more bytes of the body, or
+        the rest of it.
+
+        """
+        if self.finished or max_length == 0:
+            return ''
+        if self.max_length:
+            remaining = self.max_length - len(self.buffer)
+            if max_length is None or max_length > remaining:
+                max_length = remaining
         chunk = self._read(max_length)
-        self._body = self._body + chunk
+        self.buffer.append(chunk)
+        if self.stream is not None and self.stream.limit_exceeded:
+            self.truncated = self.finished = True
+        elif not chunk or max_length is None:
+            self.finished = True
+        elif self.max_length and len(self.buffer) >= self.max_length:
+            # See whether the body goes on past the limit
+            self.truncated = bool(self._read(1))
+            self.finished = True
         return chunk
 
+    def _get_bytes_read(self):
+        return len(self.buffer)
+
+    bytes_read = property(_get_bytes_read)
+
     def close(self):
         self.read = None
         if self.stream:
@@ -82,9 +479,13 @@ class ResponseWrapper(object):
         self.fp = None
 
     def _get_body(self):
-        if not self._body:
+        """
+        The body read so far, after reading the rest of it, up to the limit.
+
+        """
+        if not self.finished:
             self.read()
-        return self._body
+        return self.buffer.getvalue()
 
     body = property(_get_body)
 
@@ -110,25 +511,48 @@ class URLReader(object):
     A simple class which builds an urllib2 URL opener, adding some sensible
     default request headers, and returns a ResponseWrapper object.
 
+    Requests are made over persistent connections, of which at most
+    ``pool_size`` idle ones are kept for up to ``pool_idle_timeout`` seconds.
+
+    Connecting may take up to ``connect_timeout`` seconds, and each read of
+    the response up to ``timeout`` seconds. If ``deadline`` is given, the
+    whole request, including any redirects followed and the reading of the
+    response, must be done within that many seconds. These are set on each
+    request's own socket, rather than process-wide.
+
     """
 
     DEFAULT_HEADERS = {
-        'Accept-Encoding': 'gzip',
+        'Accept-Encoding': 'gzip, deflate',
         'Accept-Charset': 'utf-8',
         'Accept': 'text/xml,application/xml,application/xhtml+xml,text/html',
     }
     DEFAULT_TIMEOUT = 30
+    CONNECT_TIMEOUT = None
+    DEADLINE = None
     RESPONSE_CLASS = ResponseWrapper
+    POOL_SIZE = 10
+    POOL_IDLE_TIMEOUT = 30
 
-    def __init__(self, extra_headers={}, timeout=None):
+    def __init__(self, extra_headers={}, timeout=None, pool_size=None, pool_idle_timeout=None,
+                 connect_timeout=None, deadline=None):
         self._headers = extra_headers
         self._headers.update(self.DEFAULT_HEADERS)
         self.timeout = timeout or self.DEFAULT_TIMEOUT
-        self._opener = urllib2.build_opener(urllib2.HTTPHandler(debuglevel=0),
-                                            urllib2.HTTPCookieProcessor(),
-                                            SmartRedirectHandler())
+        self.connect_timeout = connect_timeout or self.CONNECT_TIMEOUT
+        self.deadline = deadline or self.DEADLINE
+        if pool_size is None:
+            pool_size = self.POOL_SIZE
+        self.connection_pool = ConnectionPool(pool_size,
+                                              pool_idle_timeout or self.POOL_IDLE_TIMEOUT)
+        handlers = [PooledHTTPHandler(self.connection_pool)]
+        if PooledHTTPSHandler is not None:
+            handlers.append(PooledHTTPSHandler(self.connection_pool))
+        handlers.extend([urllib2.HTTPCookieProcessor(), SmartRedirectHandler()])
+        self._opener = urllib2.build_opener(*handlers)
 
-    def open(self, url, data=None, extra_headers={}, timeout=None):
+    def open(self, url, data=None, extra_headers={}, timeout=None, method=None,
+             connect_timeout=None, deadline=None):
         # Build request headers
         request_headers = {}
         request_headers.update(extra_headers)
@@ -138,8 +562,13 @@ class URLReader(object):
         if data:
             data = urllib.urlencode(data)
         request = urllib2.Request(url, data, request_headers)
+        if method:
+            request.get_method = lambda: method
+
+        request.connect_timeout = connect_timeout or self.connect_timeout
+        deadline = deadline or self.deadline
+        request.deadline = deadline and time.time() + deadline or None
 
         # Perform request
-        socket.setdefaulttimeout(timeout or self.timeout)
-        response = self._opener.open(request)
+        response = self._opener.open(request, timeout=timeout or self.timeout)
         return self.RESPONSE_CLASS(response)
@@ -0,0 +1,87 @@
+import sys
+import threading
+
+
+class WorkerPool(object):
+    """
+    A bounded pool of worker threads for running blocking calls, such as
+    URL fetches, concurrently.
+
+    At most ``num_workers`` calls run at once. If ``max_per_key`` is given,
+    at most that many calls run at once for any single key, such as the
+    host name of a fetched URL. Workers skip over items whose key is at
+    capacity rather than blocking on them.
+
+    """
+    def __init__(self, num_workers, max_per_key=None):
+        self.num_workers = max(1, int(num_workers))
+        self.max_per_key = max_per_key
+
+    def map(self, func, items, key=None):
+        """
+        Call ``func`` with each of ``items`` and return the results in the
+        order of ``items``. ``key`` is an optional callable returning the key
+        an item is limited by. The first exception raised by ``func`` is
+        re-raised in the calling thread once all workers have finished.
+
+        """
+        items = list(items)
+        results = [None] * len(items)
+        errors = []
+        pending = range(len(items))
+        running = {}
+        condition = threading.Condition()
+        max_per_key = (key and self.max_per_key) or None
+
+        def get_key(index):
+            if max_per_key:
+                return key(items[index])
+            return None
+
+        def next_task():
+            # Called with the condition held. Returns an (index, key) tuple
+            # for the next item whose key has spare capacity, or None when
+            # all items are taken.
+            while pending:
+                for position, index in enumerate(pending):
+                    item_key = get_key(index)
+                    if not max_per_key or running.get(item_key, 0) < max_per_key:
+                        del pending[position]
+                        running[item_key] = running.get(item_key, 0) + 1
+                        return index, item_key
+                condition.wait()
+            return None
+
+        def work():
+            while True:
+                condition.acquire()
+                try:
+                    task = next_task()
+                finally:
+                    condition.release()
+                if task is None:
+                    return
+                index, item_key = task
+                try:
+                    results[index] = func(items[index])
+                except Exception:
+                    errors.append(sys.exc_info())
+                condition.acquire()
+                try:
+                    running[item_key] = running[item_key] - 1
+                    condition.notifyAll()
+                finally:
+                    condition.release()
+
+        threads = []
+        for i in range(min(self.num_workers, len(items))):
+            thread = threading.Thread(target=work)
+            thread.setDaemon(True)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        if errors:
+            exc_type, exc_value, exc_tb = errors[0]
+            raise exc_type, exc_value, exc_tb
+        return results